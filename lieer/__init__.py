@@ -1 +1,2 @@
 from .gmailieer import *
+from .repository import Repository  # noqa: F401
@@ -0,0 +1,154 @@
+# Copyright © 2020  Gaute Hope <eg@gaute.vetsj.com>
+#
+# This file is part of Lieer.
+#
+# Lieer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import io
+import json
+import os
+import tarfile
+
+
+class Archive:
+    """
+    A snapshot of a repository for setting up the same account on another machine:
+    a tar archive (compressed by the file extension: .gz, .tgz, .bz2 or .xz) of the
+    configuration, the synchronization state and the messages, with the tags of
+    every message. The credentials are not included.
+    """
+
+    VERSION = 1
+
+    # repository files in the archive, if they exist
+    FILES = (
+        ".gmailieer.json",
+        ".state.gmailieer.json",
+        ".threads.gmailieer.json",
+        ".backfill.gmailieer.json",
+    )
+
+    # the tags of the messages, by file name in the mail directory
+    TAGS = "tags.gmailieer.json"
+
+    MAIL_DIRS = ("cur", "new", "tmp")
+
+    COMPRESSION = {".gz": "gz", ".tgz": "gz", ".bz2": "bz2", ".xz": "xz"}
+
+    # the members are checked by `allowed`, the filter is an additional safeguard
+    # where available (python 3.12, and backported to some earlier versions)
+    FILTER = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+
+    def __init__(self, archive):
+        self.archive = archive
+
+    def create(self, local, tags):
+        """
+        Create the archive from the local repository, tags is a map of file name in
+        the mail directory (e.g. 'cur/...') to the tags of the message.
+        """
+        (_, ext) = os.path.splitext(self.archive)
+        mode = "w:" + self.COMPRESSION.get(ext, "")
+
+        with tarfile.open(self.archive, mode) as tar:
+            # the tags first, so that they can be read before the messages when
+            # extracting a stream
+            j = json.dumps({"version": self.VERSION, "tags": tags}).encode()
+            info = tarfile.TarInfo(self.TAGS)
+            info.size = len(j)
+            tar.addfile(info, io.BytesIO(j))
+
+            for f in self.FILES:
+                p = os.path.join(local.wd, f)
+                if os.path.exists(p):
+                    tar.add(p, f)
+
+            for d in local.maildirs():
+                for sub in self.MAIL_DIRS:
+                    name = os.path.join("mail", d, sub)
+                    tar.add(os.path.join(local.wd, name), name, recursive=False)
+
+            for f in local.files:
+                tar.add(os.path.join(local.md, f), "mail/" + f)
+
+    def extract(self, wd):
+        """
+        Extract the archive into the directory wd, which must not contain a
+        repository. Returns the tags of the messages.
+        """
+        from .local import Local
+
+        if os.path.exists(os.path.join(wd, ".gmailieer.json")) or os.path.exists(
+            os.path.join(wd, "mail")
+        ):
+            raise Local.RepositoryException(
+                "import: %s seems to already contain a repository." % wd
+            )
+
+        tags = None
+
+        with tarfile.open(self.archive, "r:*") as tar:
+            for member in tar:
+                if member.name == self.TAGS:
+                    j = json.load(tar.extractfile(member))
+                    if j["version"] != self.VERSION:
+                        raise Local.RepositoryException(
+                            "import: mismatching version in archive: %d != %d"
+                            % (j["version"], self.VERSION)
+                        )
+                    tags = j["tags"]
+                    continue
+
+                if not self.allowed(member):
+                    raise Local.RepositoryException(
+                        "import: unexpected file in archive: %s" % member.name
+                    )
+
+                tar.extract(member, wd, **self.FILTER)
+
+        if tags is None:
+            raise Local.RepositoryException(
+                "import: %s is not an archive of a repository." % self.archive
+            )
+
+        return tags
+
+    def allowed(self, member):
+        """
+        Only the files of a repository are extracted, nothing outside the directory
+        and no links.
+        """
+        if member.name in self.FILES:
+            return member.isfile()
+
+        from .local import Local
+
+        parts = member.name.split("/")
+        if parts[0] != "mail":
+            return False
+
+        # the maildirs of the sharded layout
+        if len(parts) > 1 and Local.is_shard(parts[1]):
+            parts = parts[1:]
+            if len(parts) == 1:
+                return member.isdir()
+
+        if len(parts) < 2 or parts[1] not in self.MAIL_DIRS:
+            return False
+
+        if len(parts) == 2:
+            return member.isdir()
+
+        return len(parts) == 3 and parts[2] not in ("", ".", "..") and member.isfile()
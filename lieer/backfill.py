@@ -0,0 +1,89 @@
+# Copyright © 2020  Gaute Hope <eg@gaute.vetsj.com>
+#
+# This file is part of Lieer.
+#
+# Lieer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import tempfile
+
+
+class Backfill:
+    """
+    State of the backfill of older messages after an initial pull of only the recent
+    messages (`gmi pull --recent-first`). The backfill is complete, and the file
+    removed, once every message has been fetched by `gmi backfill` or a full pull.
+
+    Messages are backfilled newest first, `before` is the date (seconds since the
+    epoch) of the oldest message fetched so far: the next run lists the messages
+    from there rather than from the newest message.
+    """
+
+    VERSION = 1
+
+    def __init__(self, backfill_file, days=None, fetched=0, before=None):
+        self.backfill_file = backfill_file
+        self.days = days
+        self.fetched = fetched
+        self.before = before
+
+    @staticmethod
+    def load(backfill_file):
+        """
+        Load the backfill state, returns None if there is nothing to backfill.
+        """
+        if not os.path.exists(backfill_file):
+            return None
+
+        with open(backfill_file) as fd:
+            j = json.load(fd)
+
+        if j["version"] != Backfill.VERSION:
+            print(
+                "error: mismatching version in backfill file: %d != %d"
+                % (j["version"], Backfill.VERSION)
+            )
+            raise ValueError()
+
+        return Backfill(backfill_file, j["days"], j["fetched"], j.get("before"))
+
+    def update(self, fetched, before):
+        """
+        fetched: number of messages fetched by the backfill
+
+        before: date of the oldest message fetched
+        """
+        self.fetched += fetched
+        if before is not None:
+            self.before = before
+        self.save()
+
+    def save(self):
+        j = {
+            "version": self.VERSION,
+            "days": self.days,
+            "fetched": self.fetched,
+            "before": self.before,
+        }
+
+        with tempfile.NamedTemporaryFile(
+            mode="w+", dir=os.path.dirname(self.backfill_file), delete=False
+        ) as fd:
+            json.dump(j, fd)
+            os.rename(fd.name, self.backfill_file)
+
+    def delete(self):
+        if os.path.exists(self.backfill_file):
+            os.unlink(self.backfill_file)
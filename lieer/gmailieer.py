@@ -19,24 +19,62 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import argparse
+import collections
+import itertools
 import os
+import signal
 import sys
 
-import googleapiclient
-import googleapiclient.errors
-import notmuch2
-
 from .local import Local
+from .metrics import Metrics
 from .remote import Remote
+from .trace import Trace
 
 
 class Gmailieer:
-    cwd = None
+    path = None
+    remote = None
+    metrics = None
+    trace = None
+
+    # lock file (or lock object) held while the notmuch database is open for writing,
+    # used to take turns when several repositories are synchronized into the same
+    # database.
+    write_lock = None
+
+    # number of changed messages resolved and pushed at a time
+    PUSH_CHUNK_SIZE = 500
+
+    # number of messages of a Takeout or an archive stored (or moved to another
+    # layout) at a time with the database open
+    STORE_CHUNK_SIZE = 1000
+
+    # number of date ranges listed concurrently on a full pull
+    list_shards = 1
+
+    # historyId of each thread seen during a full pull, for the thread index
+    thread_history = None
+
+    # only pull messages from the last days (and in the inbox or unread) on the
+    # initial pull, the rest is fetched by `gmi backfill`
+    recent_first = None
+
+    def main(self, argv=None):
+        if argv is None:
+            argv = sys.argv[1:]
+        argv = list(argv)
 
-    def main(self):
         parser = argparse.ArgumentParser("gmi")
         self.parser = parser
 
+        parser.add_argument(
+            "--profile",
+            type=str,
+            default=None,
+            metavar="FILE",
+            help="profile the command and write the stats to FILE (pstats format)",
+        )
+
         common = argparse.ArgumentParser(add_help=False)
         common.add_argument("-C", "--path", type=str, default=None, help="path")
 
@@ -72,6 +110,30 @@ class Gmailieer:
             help="print list of changes",
         )
 
+        common.add_argument(
+            "--stats",
+            type=str,
+            default=None,
+            metavar="FILE",
+            help="write timings and counters of the run as JSON to FILE",
+        )
+
+        common.add_argument(
+            "--prometheus",
+            type=str,
+            default=None,
+            metavar="FILE",
+            help="write timings and counters of the run to FILE for the Prometheus node exporter textfile collector",
+        )
+
+        common.add_argument(
+            "--trace",
+            type=str,
+            default=None,
+            metavar="FILE",
+            help="write a trace of all requests, backoff and phases to FILE (Chrome trace format)",
+        )
+
         subparsers = parser.add_subparsers(help="actions", dest="action")
         subparsers.required = True
 
@@ -122,8 +184,167 @@ class Gmailieer:
             help="Resume previous incomplete synchronization if possible (this might cause local changes made in the interim to be ignored when pushing)",
         )
 
+        parser_pull.add_argument(
+            "--recent-first",
+            type=int,
+            default=None,
+            metavar="DAYS",
+            help="On the initial synchronization, only pull messages from the last DAYS days and messages in the inbox or unread. Older messages are fetched with 'gmi backfill'.",
+        )
+
+        parser_pull.add_argument(
+            "--list-shards",
+            type=int,
+            default=1,
+            metavar="N",
+            help="List messages in N date ranges concurrently on a full synchronization",
+        )
+
         parser_pull.set_defaults(func=self.pull)
 
+        # backfill
+        parser_backfill = subparsers.add_parser(
+            "backfill",
+            help="fetch older messages after an initial pull with --recent-first",
+            description="backfill",
+            parents=[common],
+        )
+
+        parser_backfill.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Maximum number of messages to fetch, run again to continue",
+        )
+
+        parser_backfill.add_argument(
+            "-d",
+            "--dry-run",
+            action="store_true",
+            default=False,
+            help="do not make any changes",
+        )
+
+        parser_backfill.set_defaults(func=self.backfill)
+
+        # hydrate
+        parser_hydrate = subparsers.add_parser(
+            "hydrate",
+            help="fetch the content of messages stored as headers only",
+            description="hydrate",
+            parents=[common],
+        )
+
+        parser_hydrate.add_argument(
+            "query",
+            nargs="+",
+            help="notmuch query for the messages to fetch (e.g. 'thread:0000000000000042')",
+        )
+
+        parser_hydrate.add_argument(
+            "-d",
+            "--dry-run",
+            action="store_true",
+            default=False,
+            help="do not make any changes",
+        )
+
+        parser_hydrate.set_defaults(func=self.hydrate)
+
+        # import-takeout
+        parser_takeout = subparsers.add_parser(
+            "import-takeout",
+            help="store the messages of a Google Takeout mbox before the initial pull",
+            description="import-takeout",
+            parents=[common],
+        )
+
+        parser_takeout.add_argument(
+            "mbox", type=str, help="the mbox file of a Google Takeout of GMail"
+        )
+
+        parser_takeout.add_argument(
+            "-d",
+            "--dry-run",
+            action="store_true",
+            default=False,
+            help="do not make any changes",
+        )
+
+        parser_takeout.set_defaults(func=self.import_takeout)
+
+        # export
+        parser_export = subparsers.add_parser(
+            "export",
+            help="write an archive of the repository, for setting it up elsewhere with 'import'",
+            description="export",
+            parents=[common],
+        )
+
+        parser_export.add_argument(
+            "archive",
+            type=str,
+            help="the archive to write (compressed by the extension: .gz, .tgz, .bz2 or .xz)",
+        )
+
+        parser_export.set_defaults(func=self.export)
+
+        # import
+        parser_import = subparsers.add_parser(
+            "import",
+            help="set up a repository from an archive made with 'export' and pull the changes since",
+            description="import",
+            parents=[common],
+        )
+
+        parser_import.add_argument(
+            "archive", type=str, help="archive made with 'export'"
+        )
+
+        parser_import.set_defaults(func=self.import_archive)
+
+        # migrate-layout
+        parser_migrate = subparsers.add_parser(
+            "migrate-layout",
+            help="move the messages to another maildir layout",
+            description="migrate-layout",
+            parents=[common],
+        )
+
+        parser_migrate.add_argument(
+            "layout",
+            choices=Local.Config.LAYOUTS,
+            help="'flat': all messages in mail/cur, 'sharded': messages spread over mail/<xx>/cur by the last two digits of the GID",
+        )
+
+        parser_migrate.add_argument(
+            "-d",
+            "--dry-run",
+            action="store_true",
+            default=False,
+            help="do not make any changes",
+        )
+
+        parser_migrate.set_defaults(func=self.migrate_layout)
+
+        # reconcile
+        parser_reconcile = subparsers.add_parser(
+            "reconcile",
+            help="compare label counts with local tag counts and fix the labels that differ",
+            description="reconcile",
+            parents=[common],
+        )
+
+        parser_reconcile.add_argument(
+            "-d",
+            "--dry-run",
+            action="store_true",
+            default=False,
+            help="do not make any changes",
+        )
+
+        parser_reconcile.set_defaults(func=self.reconcile)
+
         # push
         parser_push = subparsers.add_parser(
             "push", parents=[common], description="push", help="push local tag-changes"
@@ -171,11 +392,11 @@ class Gmailieer:
         )
 
         # Ignored arguments for sendmail compatibility
-        if "-oi" in sys.argv:
-            sys.argv.remove("-oi")
+        if "-oi" in argv:
+            argv.remove("-oi")
 
-        if "-i" in sys.argv:
-            sys.argv.remove("-i")
+        if "-i" in argv:
+            argv.remove("-i")
 
         parser_send.add_argument(
             "-i",
@@ -255,8 +476,110 @@ class Gmailieer:
             help="Resume previous incomplete synchronization if possible (this might cause local changes made in the interim to be ignored when pushing)",
         )
 
+        parser_sync.add_argument(
+            "--list-shards",
+            type=int,
+            default=1,
+            metavar="N",
+            help="List messages in N date ranges concurrently on a full synchronization",
+        )
+
         parser_sync.set_defaults(func=self.sync)
 
+        # sync-all
+        parser_sync_all = subparsers.add_parser(
+            "sync-all",
+            parents=[common],
+            description="Synchronize several repositories concurrently, writing to the notmuch database one at a time.",
+            help="sync several repositories in parallel",
+        )
+
+        parser_sync_all.add_argument(
+            "repositories",
+            nargs="+",
+            help="Paths of the repositories to synchronize",
+        )
+
+        parser_sync_all.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=None,
+            help="Number of repositories to synchronize at the same time (default: 4)",
+        )
+
+        parser_sync_all.add_argument(
+            "-d",
+            "--dry-run",
+            action="store_true",
+            default=False,
+            help="do not make any changes",
+        )
+
+        parser_sync_all.add_argument(
+            "-f",
+            "--force",
+            action="store_true",
+            default=False,
+            help="Passed on to sync, see: gmi sync -h",
+        )
+
+        parser_sync_all.add_argument(
+            "--write-lock",
+            type=str,
+            default=None,
+            help="File to lock while writing to the notmuch database (default: derived from the notmuch database path)",
+        )
+
+        parser_sync_all.set_defaults(func=self.sync_all)
+
+        # watch
+        parser_watch = subparsers.add_parser(
+            "watch",
+            parents=[common],
+            description="Keep running and synchronize whenever the remote or the local notmuch database changes.",
+            help="keep running and sync changes as they happen",
+        )
+
+        parser_watch.add_argument(
+            "--min-interval",
+            type=float,
+            default=10,
+            help="Shortest interval in seconds between checking the remote for changes (default: 10)",
+        )
+
+        parser_watch.add_argument(
+            "--max-interval",
+            type=float,
+            default=300,
+            help="Longest interval in seconds between checking the remote for changes when there is no activity (default: 300)",
+        )
+
+        parser_watch.add_argument(
+            "--debounce",
+            type=float,
+            default=5,
+            help="Push local changes when the notmuch database has not changed for this many seconds (default: 5)",
+        )
+
+        parser_watch.add_argument(
+            "--local-interval",
+            type=float,
+            default=2,
+            help="Interval in seconds between checking the notmuch database for changes (default: 2)",
+        )
+
+        parser_watch.add_argument(
+            "--trigger",
+            nargs="?",
+            const="sync",
+            default=None,
+            choices=["sync", "push", "pull"],
+            help="Ask the running watcher of this repository to sync (or push or pull) immediately and exit",
+        )
+
+        parser_watch.set_defaults(func=self.watch)
+
         # auth
         parser_auth = subparsers.add_parser(
             "auth",
@@ -367,6 +690,28 @@ class Gmailieer:
             "--no-ignore-empty-history", action="store_true", default=False
         )
 
+        parser_set.add_argument(
+            "--thread-metadata",
+            action="store_true",
+            default=False,
+            help="Check labels on a full pull with one request per thread, rather than one per message",
+        )
+
+        parser_set.add_argument(
+            "--no-thread-metadata", action="store_true", default=False
+        )
+
+        parser_set.add_argument(
+            "--dedupe-message-id",
+            action="store_true",
+            default=False,
+            help="Link the content of new messages from other lieer repositories in the notmuch database with the same Message-ID, rather than downloading it",
+        )
+
+        parser_set.add_argument(
+            "--no-dedupe-message-id", action="store_true", default=False
+        )
+
         parser_set.add_argument(
             "--ignore-tags-local",
             type=str,
@@ -381,6 +726,59 @@ class Gmailieer:
             help="Set custom tags to ignore when syncing from remote to local (comma-separated, before translations). Important: see the manual.",
         )
 
+        parser_set.add_argument(
+            "--scope-labels",
+            type=str,
+            default=None,
+            help="Only synchronize messages with at least one of these labels (comma-separated, remote label names, empty for all). Important: see the manual.",
+        )
+
+        parser_set.add_argument(
+            "--scope-exclude-labels",
+            type=str,
+            default=None,
+            help="Do not synchronize messages with any of these labels (comma-separated, remote label names)",
+        )
+
+        parser_set.add_argument(
+            "--exclude-spam-trash",
+            action="store_true",
+            default=False,
+            help="Do not synchronize messages in spam or trash",
+        )
+
+        parser_set.add_argument(
+            "--no-exclude-spam-trash", action="store_true", default=False
+        )
+
+        parser_set.add_argument(
+            "--max-age-days",
+            type=int,
+            default=None,
+            help="Only synchronize messages received in the last N days (0 for no limit)",
+        )
+
+        parser_set.add_argument(
+            "--full-body-days",
+            type=int,
+            default=None,
+            help="Only store the headers of new messages older than N days, fetch the rest with 'gmi hydrate' (0 for no limit)",
+        )
+
+        parser_set.add_argument(
+            "--full-body-max-size",
+            type=int,
+            default=None,
+            help="Only store the headers of new messages larger than N bytes, fetch the rest with 'gmi hydrate' (0 for no limit)",
+        )
+
+        parser_set.add_argument(
+            "--durability",
+            choices=Local.Config.DURABILITY,
+            default=None,
+            help="With 'batch', new message files are written to disk (fsync) a batch at a time before they are added to the notmuch database",
+        )
+
         parser_set.add_argument(
             "--file-extension",
             type=str,
@@ -417,17 +815,66 @@ class Gmailieer:
 
         parser_set.set_defaults(func=self.set)
 
-        args = parser.parse_args(sys.argv[1:])
+        args = parser.parse_args(argv)
         self.args = args
 
         if args.quiet:
             args.no_progress = True
 
+        self.metrics = Metrics()
+        status = "error"
+
+        if args.trace is not None:
+            self.trace = Trace(args.trace)
+            self.metrics.trace = self.trace
+
         try:
-            args.func(args)
+            if args.profile is not None:
+                from .profiling import Profile
+
+                with Profile(args.profile):
+                    args.func(args)
+            else:
+                args.func(args)
+            status = "ok"
+        except SystemExit as e:
+            # e.g. `gmi watch` stopped by SIGTERM
+            if not e.code:
+                status = "ok"
+            raise
         except Local.LockingException as e:
             print(e, file=sys.stderr)
             sys.exit(7)
+        finally:
+            self.write_stats(args, status)
+
+            if self.trace is not None:
+                self.trace.close()
+
+        if self.remote is not None and self.remote.calls and self.verbose:
+            print(
+                "remote: %d API calls, %d quota units (%s)"
+                % (
+                    sum(self.remote.calls.values()),
+                    self.remote.quota,
+                    ", ".join(
+                        "%s: %d" % (m.split(".", 2)[-1], n)
+                        for m, n in sorted(self.remote.calls.items())
+                    ),
+                )
+            )
+
+    def write_stats(self, args, status):
+        if args.stats is None and args.prometheus is None:
+            return
+
+        report = self.metrics.report(self, status)
+
+        if args.stats is not None:
+            self.metrics.write_json(args.stats, report)
+
+        if args.prometheus is not None:
+            self.metrics.write_prometheus(args.prometheus, report)
 
     def initialize(self, args):
         self.setup(args, False)
@@ -457,26 +904,34 @@ class Gmailieer:
         self.remote.authorize(args.force)
 
     def setup(self, args, dry_run=False, load=False, block=False):
-        global tqdm
+        if self.metrics is None:
+            self.metrics = Metrics()
 
         # common options
         if args.path is not None:
             self.vprint("path: %s" % args.path)
-            if args.action == "init" and not os.path.exists(args.path):
+            args.path = os.path.expanduser(args.path)
+            if args.action in ("init", "import") and not os.path.exists(args.path):
                 os.makedirs(args.path)
 
-            args.path = os.path.expanduser(args.path)
-            if os.path.isdir(args.path):
-                self.cwd = os.getcwd()
-                os.chdir(args.path)
-            else:
+            if not os.path.isdir(args.path):
                 print("error: %s is not a valid path!" % args.path)
                 raise NotADirectoryError("error: %s is not a valid path!" % args.path)
 
+        # all paths are derived from the repository path, the working directory of
+        # the process is left alone.
+        self.path = os.path.abspath(args.path if args.path is not None else ".")
+
         self.dry_run = dry_run
         self.verbose = args.verbose
         self.HAS_TQDM = not args.no_progress
+
+        # a relative credentials file is relative to the repository
         self.credentials_file = args.credentials
+        if self.credentials_file:
+            self.credentials_file = os.path.join(
+                self.path, os.path.expanduser(self.credentials_file)
+            )
 
         if self.HAS_TQDM:
             if not (sys.stderr.isatty() and sys.stdout.isatty()):
@@ -485,6 +940,7 @@ class Gmailieer:
                 try:
                     from tqdm import tqdm
 
+                    self.tqdm = tqdm
                     self.HAS_TQDM = True
                 except ImportError:
                     self.HAS_TQDM = False
@@ -492,10 +948,12 @@ class Gmailieer:
         if not self.HAS_TQDM:
             from .nobar import tqdm
 
+            self.tqdm = tqdm
+
         if self.dry_run:
             print("dry-run: ", self.dry_run)
 
-        self.local = Local(self)
+        self.local = Local(self, self.path)
         if load:
             self.local.load_repository(block)
             self.remote = Remote(self)
@@ -506,8 +964,7 @@ class Gmailieer:
         self.limit = args.limit
         self.list_labels = False
         self.resume = args.resume
-
-        self.remote.get_labels()
+        self.list_shards = args.list_shards
 
         # will try to push local changes, this operation should not make
         # any changes to the local store or any of the file names.
@@ -517,14 +974,172 @@ class Gmailieer:
         # resolving any conflicts.
         self.pull(args, True)
 
+    def reconcile(self, args, setup=False):
+        """
+        Compare the number of messages with each remote label to the number of local
+        messages with the corresponding tag, and re-fetch the labels of the messages
+        that differ for the labels that do not match. Changes that do not change the
+        number of messages with a label (e.g. a label moved from one message to
+        another) are not detected, use `pull -f` for that.
+        """
+        import notmuch2
+
+        if not setup:
+            self.setup(args, args.dry_run, True)
+
+        labels = {
+            lid: name
+            for lid, name in self.remote.labels.items()
+            if lid not in self.remote.not_sync
+            and name not in self.remote.ignore_labels
+            and self.remote.in_scope({"labelIds": [lid]})
+        }
+
+        counts = {}
+
+        def _got_labels(ls):
+            counts.update((l["id"], l.get("messagesTotal", 0)) for l in ls)
+
+        with self.metrics.phase("list"):
+            self.remote.get_label_counts(list(labels), _got_labels)
+
+        drifted = []
+        with notmuch2.Database() as db:
+            for lid, total in counts.items():
+                tag = self.local.label_to_tag(labels[lid])
+                local = db.count_messages(self.local.tag_query(tag))
+
+                if local != total:
+                    self.vprint(
+                        "reconcile: %s: %d remote, %d local messages"
+                        % (tag, total, local)
+                    )
+                    drifted.append((lid, tag))
+
+        if not drifted:
+            self.vprint("reconcile: all labels match.")
+            return
+
+        # messages that have the label remotely or the tag locally, but not both
+        fix = set()
+        for lid, tag in drifted:
+            with self.metrics.phase("list"):
+                remote = {
+                    m["id"]
+                    for _, ms in self.remote.all_messages(label_ids=[lid])
+                    for m in ms
+                }
+
+            with notmuch2.Database() as db:
+                (_, local) = self.local.messages_to_gids(
+                    db.messages(self.local.tag_query(tag))
+                )
+
+            fix |= remote ^ set(local)
+
+        # local changes that have not been pushed yet are not drift, they are kept
+        with notmuch2.Database() as db:
+            rev = db.revision().rev
+            if rev != self.local.state.lastmod:
+                (_, changed) = self.local.messages_to_gids(
+                    db.messages(
+                        "path:%s/** and lastmod:%d..%d"
+                        % (self.local.nm_relative, self.local.state.lastmod + 1, rev)
+                    )
+                )
+                changed = fix & set(changed)
+                if changed:
+                    self.vprint(
+                        "reconcile: skipping %d messages with local changes, push them first."
+                        % len(changed)
+                    )
+                    fix -= changed
+
+        self.vprint(
+            "reconcile: %d labels differ, checking %d messages"
+            % (len(drifted), len(fix))
+        )
+
+        fix = list(fix)
+        updated = self.get_content(fix)
+        self.get_meta(list(set(fix) - set(updated)))
+
+    def sync_all(self, args):
+        import time
+
+        from .syncall import SyncAll
+
+        # progress bars from several repositories would be interleaved
+        argv = ["-s"]
+        if args.verbose:
+            argv.append("-v")
+        else:
+            argv.append("-q")
+        if args.dry_run:
+            argv.append("-d")
+        if args.force:
+            argv.append("-f")
+        if args.credentials is not None:
+            argv.extend(["-c", args.credentials])
+
+        start = time.perf_counter()
+        s = SyncAll(self, args.repositories, args.jobs)
+        results = s.run(argv, args.write_lock)
+
+        if not args.quiet or any(r[1] is not None for r in results):
+            s.summary(results, time.perf_counter() - start)
+
+        if any(r[1] is not None for r in results):
+            sys.exit(1)
+
+    def watch(self, args):
+        from .watch import Watch
+
+        if args.trigger is not None:
+            self.setup(args)
+            reply = Watch.trigger(
+                os.path.join(self.local.wd, Watch.SOCKET), args.trigger
+            )
+            self.vprint("watch:", reply)
+            if reply != "ok":
+                sys.exit(1)
+            return
+
+        self.setup(args, False, True)
+        self.force = False
+        self.limit = None
+        self.list_labels = False
+        self.resume = False
+
+        # exit cleanly (removing the socket) when terminated
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+        w = Watch(
+            self,
+            args.min_interval,
+            args.max_interval,
+            args.debounce,
+            args.local_interval,
+        )
+
+        # the repository is only locked while synchronizing
+        self.local.unlock()
+
+        try:
+            w.run()
+        except KeyboardInterrupt:
+            self.vprint("watch: stopping.")
+
     def push(self, args, setup=False):
+        import notmuch2
+
         if not setup:
             self.setup(args, args.dry_run, True)
 
             self.force = args.force
             self.limit = args.limit
 
-            self.remote.get_labels()
+        self.remote.all_updated = True
 
         # loading local changes
 
@@ -540,64 +1155,70 @@ class Gmailieer:
                 rev,
             )
 
-            messages = [db.get(m.path) for m in db.messages(qry)]
-
-            if self.limit is not None and len(messages) > self.limit:
-                messages = messages[: self.limit]
-
-            # get gids and filter out messages outside this repository
-            messages, gids = self.local.messages_to_gids(messages)
+            total = db.count_messages(qry)
+            if self.limit is not None:
+                total = min(total, self.limit)
+
+            # the changed messages are streamed from the query and pushed in windows of
+            # PUSH_CHUNK_SIZE messages, so that only one window of notmuch messages and
+            # remote metadata is held in memory at any time.
+            paths = (m.path for m in db.messages(qry))
+            if self.limit is not None:
+                paths = itertools.islice(paths, self.limit)
+
+            self.bar_create(leave=True, total=total, desc="pushing, 0 changed")
+            changed = 0
+            pushed = 0
+
+            def cb(_):
+                nonlocal changed
+                changed += 1
+                if not self.args.quiet and self.bar:
+                    self.bar.set_description("pushing, %d changed" % changed)
+
+            while chunk := list(itertools.islice(paths, self.PUSH_CHUNK_SIZE)):
+                with self.metrics.phase("push_planning"):
+                    messages = [db.get(p) for p in chunk]
+
+                    # get gids and filter out messages outside this repository
+                    messages, gids = self.local.messages_to_gids(messages)
+                    messages = dict(zip(gids, messages))
+
+                    # get meta-data on changed messages from remote and resolve changes,
+                    # remote messages are matched on gid since missing messages are
+                    # skipped by get_messages.
+                    actions = []
+
+                    def _got_msgs(ms):
+                        for rm in ms:
+                            nm = messages.get(rm["id"])
+                            if nm is None:
+                                continue
+
+                            a = self.remote.update(
+                                rm, nm, self.local.state.last_historyId, self.force
+                            )
+                            if a:
+                                actions.append(a)
 
-            # get meta-data on changed messages from remote
-            remote_messages = []
-            self.bar_create(leave=True, total=len(gids), desc="receiving metadata")
+                    self.remote.get_messages(gids, _got_msgs, "minimal")
 
-            def _got_msgs(ms):
-                for m in ms:
-                    self.bar_update(1)
-                    remote_messages.append(m)
+                    # limit
+                    if self.limit is not None and pushed + len(actions) >= self.limit:
+                        actions = actions[: self.limit - pushed]
 
-            self.remote.get_messages(gids, _got_msgs, "minimal")
-            self.bar_close()
+                # push changes
+                if len(actions) > 0:
+                    with self.metrics.phase("push"):
+                        self.remote.push_changes(actions, cb)
+                    pushed += len(actions)
+                    self.metrics.count("messages_pushed", len(actions))
 
-            # resolve changes
-            self.bar_create(leave=True, total=len(gids), desc="resolving changes")
-            actions = []
-            for rm, nm in zip(remote_messages, messages):
-                actions.append(
-                    self.remote.update(
-                        rm, nm, self.local.state.last_historyId, self.force
-                    )
-                )
-                self.bar_update(1)
+                self.bar_update(len(chunk))
 
             self.bar_close()
 
-            # remove no-ops
-            actions = [a for a in actions if a]
-
-            # limit
-            if self.limit is not None and len(actions) >= self.limit:
-                actions = actions[: self.limit]
-
-            # push changes
-            if len(actions) > 0:
-                self.bar_create(
-                    leave=True, total=len(actions), desc="pushing, 0 changed"
-                )
-                changed = 0
-
-                def cb(_):
-                    nonlocal changed
-                    self.bar_update(1)
-                    changed += 1
-                    if not self.args.quiet and self.bar:
-                        self.bar.set_description("pushing, %d changed" % changed)
-
-                self.remote.push_changes(actions, cb)
-
-                self.bar_close()
-            else:
+            if pushed == 0:
                 self.vprint("push: nothing to push")
 
         if not self.remote.all_updated:
@@ -613,11 +1234,6 @@ class Gmailieer:
         if not self.dry_run and self.remote.all_updated:
             self.local.state.set_lastmod(rev)
 
-        self.vprint(
-            "remote historyId: %d"
-            % self.remote.get_current_history_id(self.local.state.last_historyId)
-        )
-
     def pull(self, args, setup=False):
         if not setup:
             self.setup(args, args.dry_run, True)
@@ -626,8 +1242,8 @@ class Gmailieer:
             self.force = args.force
             self.limit = args.limit
             self.resume = args.resume
-
-            self.remote.get_labels()  # to make sure label map is initialized
+            self.list_shards = args.list_shards
+            self.recent_first = args.recent_first
 
         if self.list_labels:
             for k, l in self.remote.labels.items():
@@ -638,6 +1254,18 @@ class Gmailieer:
             self.vprint("pull: full synchronization (forced)")
             self.full_pull()
 
+        elif (
+            self.local.state.last_historyId == 0
+            and self.recent_first
+            # the messages outside the recent window would be removed
+            and not self.local.gids
+        ):
+            self.vprint(
+                "pull: synchronization of the last %d days (no previous synchronization state)"
+                % self.recent_first
+            )
+            self.recent_pull(self.recent_first)
+
         elif self.local.state.last_historyId == 0:
             self.vprint(
                 "pull: full synchronization (no previous synchronization state)"
@@ -651,28 +1279,124 @@ class Gmailieer:
             )
             self.partial_pull()
 
+    def recent_pull(self, days):
+        """
+        Pull the messages from the last days and the messages in the inbox or unread,
+        and start a backfill of the older messages. Incremental pulls work as usual
+        from here.
+        """
+        from .backfill import Backfill
+
+        query = self.remote.query
+        self.remote.query = "%s {newer_than:%dd in:inbox is:unread}" % (query, days)
+        try:
+            self.full_pull()
+        finally:
+            self.remote.query = query
+
+        if not self.dry_run:
+            Backfill(
+                os.path.join(self.local.wd, ".backfill.gmailieer.json"), days
+            ).save()
+            self.vprint("pull: fetch older messages with 'gmi backfill'")
+
+    def backfill(self, args, setup=False):
+        """
+        Fetch the messages left out by an initial pull with --recent-first, newest
+        first. With --limit at most that many messages are fetched, the backfill
+        continues where it left off on the next run.
+        """
+        from .backfill import Backfill
+
+        if not setup:
+            self.setup(args, args.dry_run, True)
+            self.limit = args.limit
+
+        state = Backfill.load(os.path.join(self.local.wd, ".backfill.gmailieer.json"))
+        if state is None:
+            self.vprint("backfill: nothing to backfill.")
+            return
+
+        if self.local.state.last_historyId == 0:
+            raise Local.RepositoryException("backfill: pull before backfilling.")
+
+        # messages are listed newest first, continuing from the oldest message
+        # fetched by the last backfill. messages that have been fetched (e.g. with
+        # the same date) are skipped.
+        missing = []
+        complete = True
+        self.bar_create(leave=True, desc="listing messages to backfill")
+        with self.metrics.phase("list"):
+            for total, gids in self.remote.all_messages(before=state.before):
+                if not self.args.quiet and self.bar:
+                    self.bar.total = total
+                self.bar_update(len(gids))
+
+                missing.extend(m["id"] for m in gids if not self.local.has(m["id"]))
+
+                if self.limit is not None and len(missing) >= self.limit:
+                    missing = missing[: self.limit]
+                    complete = False
+                    break
+        self.bar_close()
+
+        if missing:
+            self.get_content(missing)
+
+        if self.dry_run:
+            return
+
+        if complete:
+            self.vprint(
+                "backfill: complete, %d messages fetched."
+                % (state.fetched + len(missing))
+            )
+            state.delete()
+        else:
+            # the files have the date of their message
+            before = min(
+                (
+                    int(
+                        os.stat(
+                            os.path.join(self.local.md, self.local.gids[g])
+                        ).st_mtime
+                    )
+                    for g in missing
+                    if self.local.has(g)
+                ),
+                default=None,
+            )
+            state.update(len(missing), before)
+            self.vprint(
+                "backfill: %d messages fetched, run again to continue." % state.fetched
+            )
+
     def partial_pull(self):
+        import googleapiclient.errors
+
         # get history
         bar = None
         history = []
-        last_id = self.remote.get_current_history_id(self.local.state.last_historyId)
 
         try:
-            for hist in self.remote.get_history_since(self.local.state.last_historyId):
-                history.extend(hist)
+            with self.metrics.phase("history"):
+                for hist in self.remote.get_history_since(
+                    self.local.state.last_historyId
+                ):
+                    history.extend(hist)
 
-                if bar is None:
-                    self.bar_create(leave=True, desc="fetching changes")
+                    if bar is None:
+                        self.bar_create(leave=True, desc="fetching changes")
 
-                self.bar_update(len(hist))
+                    self.bar_update(len(hist))
 
-                if self.limit is not None and len(history) >= self.limit:
-                    break
+                    if self.limit is not None and len(history) >= self.limit:
+                        break
 
         except googleapiclient.errors.HttpError as excep:
             if excep.resp.status == 404:
                 print("pull: historyId is too old, full sync required.")
-                self.full_pull()
+                self.full_pull(delta=True)
                 return
             else:
                 raise
@@ -685,6 +1409,9 @@ class Gmailieer:
             if bar is not None:
                 self.bar_close()
 
+        # the historyId of the mailbox before the changes were fetched
+        last_id = self.remote.history_id
+
         # figure out which changes need to be applied
         added_messages = []  # added messages, if they are later deleted they will be
         # removed from this list
@@ -716,67 +1443,70 @@ class Gmailieer:
         else:
             bar = None
 
-        for h in history:
-            if "messagesAdded" in h:
-                for m in h["messagesAdded"]:
-                    mm = m["message"]
-                    if not (set(mm.get("labelIds", [])) & self.remote.not_sync):
+        with self.metrics.phase("compaction"):
+            for h in history:
+                if "messagesAdded" in h:
+                    for m in h["messagesAdded"]:
+                        mm = m["message"]
+                        if self.remote.in_scope(mm):
+                            remove_from_all(mm)
+                            added_messages.append(mm)
+
+                if "messagesDeleted" in h:
+                    for m in h["messagesDeleted"]:
+                        mm = m["message"]
+                        # might silently fail to delete this
                         remove_from_all(mm)
-                        added_messages.append(mm)
-
-            if "messagesDeleted" in h:
-                for m in h["messagesDeleted"]:
-                    mm = m["message"]
-                    # might silently fail to delete this
-                    remove_from_all(mm)
-                    if self.local.has(mm["id"]):
-                        deleted_messages.append(mm)
-
-            # messages that are subsequently deleted by a later action will be removed
-            # from either labels_changed or added_messages.
-            if "labelsAdded" in h:
-                for m in h["labelsAdded"]:
-                    mm = m["message"]
-                    if not (set(mm.get("labelIds", [])) & self.remote.not_sync):
-                        new = remove_from_list(
-                            added_messages, mm
-                        ) or not self.local.has(mm["id"])
-                        remove_from_list(labels_changed, mm)
-                        if new:
-                            added_messages.append(mm)  # needs to fetched
-                        else:
-                            labels_changed.append(mm)
-                    else:
-                        # in case a not_sync tag has been added to a scheduled message
-                        remove_from_list(added_messages, mm)
-                        remove_from_list(labels_changed, mm)
-
                         if self.local.has(mm["id"]):
-                            remove_from_list(deleted_messages, mm)
                             deleted_messages.append(mm)
 
-            if "labelsRemoved" in h:
-                for m in h["labelsRemoved"]:
-                    mm = m["message"]
-                    if not (set(mm.get("labelIds", [])) & self.remote.not_sync):
-                        new = remove_from_list(
-                            added_messages, mm
-                        ) or not self.local.has(mm["id"])
-                        remove_from_list(labels_changed, mm)
-                        if new:
-                            added_messages.append(mm)  # needs to fetched
+                # messages that are subsequently deleted by a later action will be removed
+                # from either labels_changed or added_messages.
+                if "labelsAdded" in h:
+                    for m in h["labelsAdded"]:
+                        mm = m["message"]
+                        if self.remote.in_scope(mm):
+                            new = remove_from_list(
+                                added_messages, mm
+                            ) or not self.local.has(mm["id"])
+                            remove_from_list(labels_changed, mm)
+                            if new:
+                                added_messages.append(mm)  # needs to fetched
+                            else:
+                                labels_changed.append(mm)
                         else:
-                            labels_changed.append(mm)
-                    else:
-                        # in case a not_sync tag has been added
-                        remove_from_list(added_messages, mm)
-                        remove_from_list(labels_changed, mm)
+                            # in case a not_sync tag has been added to a scheduled message,
+                            # or the message has otherwise left the scope
+                            remove_from_list(added_messages, mm)
+                            remove_from_list(labels_changed, mm)
+
+                            if self.local.has(mm["id"]):
+                                remove_from_list(deleted_messages, mm)
+                                deleted_messages.append(mm)
+
+                if "labelsRemoved" in h:
+                    for m in h["labelsRemoved"]:
+                        mm = m["message"]
+                        if self.remote.in_scope(mm):
+                            new = remove_from_list(
+                                added_messages, mm
+                            ) or not self.local.has(mm["id"])
+                            remove_from_list(labels_changed, mm)
+                            if new:
+                                added_messages.append(mm)  # needs to fetched
+                            else:
+                                labels_changed.append(mm)
+                        else:
+                            # in case a not_sync tag has been added, or the message has
+                            # otherwise left the scope
+                            remove_from_list(added_messages, mm)
+                            remove_from_list(labels_changed, mm)
 
-                        if self.local.has(mm["id"]):
-                            remove_from_list(deleted_messages, mm)
-                            deleted_messages.append(mm)
+                            if self.local.has(mm["id"]):
+                                remove_from_list(deleted_messages, mm)
+                                deleted_messages.append(mm)
 
-            self.bar_update(1)
+                self.bar_update(1)
 
         if bar:
             self.bar_close()
@@ -795,15 +1525,17 @@ class Gmailieer:
             changed = True
 
         if self.local.config.remove_local_messages and len(deleted_messages) > 0:
-            with notmuch2.Database(mode=notmuch2.Database.MODE.READ_WRITE) as db:
-                for m in tqdm(deleted_messages, leave=True, desc="removing messages"):
+            with self.metrics.phase("notmuch_write"), self.local.write_db() as db:
+                for m in self.tqdm(
+                    deleted_messages, leave=True, desc="removing messages"
+                ):
                     self.local.remove(m["id"], db)
 
             changed = True
 
         if len(labels_changed) > 0:
             lchanged = 0
-            with notmuch2.Database(mode=notmuch2.Database.MODE.READ_WRITE) as db:
+            with self.metrics.phase("notmuch_write"), self.local.write_db() as db:
                 self.bar_create(
                     total=len(labels_changed), leave=True, desc="updating tags (0)"
                 )
@@ -828,7 +1560,16 @@ class Gmailieer:
         if last_id > 0:
             self.vprint("current historyId: %d" % last_id)
 
-    def full_pull(self):
+    def full_pull(self, delta=False):
+        """
+        Fetch all messages. With `delta` only the labels of messages in threads that
+        have changed since the last full pull are checked (see `ThreadIndex`).
+        """
+        import notmuch2
+
+        from .backfill import Backfill
+        from .threadindex import ThreadIndex
+
         total = 1
 
         self.bar_create(leave=True, total=total, desc="fetching messages")
@@ -838,7 +1579,27 @@ class Gmailieer:
         # about how much memory this will take. this is just a list of some
         # simple metadata like message ids.
         message_gids = []
-        last_id = self.remote.get_current_history_id(self.local.state.last_historyId)
+        last_id = self.remote.get_current_history_id()
+
+        index = ThreadIndex(os.path.join(self.local.wd, ".threads.gmailieer.json"))
+        if delta and not index:
+            self.vprint("pull: no thread index, checking all messages.")
+            delta = False
+
+        elif delta and self.limit is not None:
+            # a limited pull does not list the historyId of every thread
+            self.vprint("pull: limited pull, checking all messages.")
+            delta = False
+
+        # the historyId of every thread, for the thread index: listed when only the
+        # changed threads are checked, otherwise taken from the messages as they are
+        # fetched (see `note_history`). not useful for a limited pull, which does
+        # not see all threads.
+        self.thread_history = {} if self.limit is None else None
+
+        # the thread of each message, for checking labels a thread at a time or
+        # only in changed threads
+        threads = {} if self.local.config.thread_metadata or delta else None
 
         resume_file = os.path.join(self.local.wd, ".resume-pull.gmailieer.json")
 
@@ -867,15 +1628,22 @@ class Gmailieer:
                 previous.delete()
                 previous = self.load_resume(resume_file, last_id)
 
-        for total, gids in self.remote.all_messages():
-            if not self.args.quiet and self.bar:
-                self.bar.total = total
-            self.bar_update(len(gids))
+        with self.metrics.phase("list"):
+            for total, gids in self.remote.all_messages(shards=self.list_shards):
+                if not self.args.quiet and self.bar:
+                    self.bar.total = total
+                self.bar_update(len(gids))
+
+                message_gids.extend(m["id"] for m in gids)
+                if threads is not None:
+                    threads.update((m["id"], m["threadId"]) for m in gids)
 
-            message_gids.extend(m["id"] for m in gids)
+                if self.limit is not None and len(message_gids) >= self.limit:
+                    break
 
-            if self.limit is not None and len(message_gids) >= self.limit:
-                break
+            if delta:
+                for ts in self.remote.all_threads():
+                    self.thread_history.update((t["id"], t["historyId"]) for t in ts)
 
         self.bar_close()
 
@@ -890,7 +1658,7 @@ class Gmailieer:
             all_local = set(self.local.gids.keys())
             remove = list(all_local - all_remote)
             self.bar_create(leave=True, total=len(remove), desc="removing deleted")
-            with notmuch2.Database(mode=notmuch2.Database.MODE.READ_WRITE) as db:
+            with self.metrics.phase("notmuch_write"), self.local.write_db() as db:
                 for m in remove:
                     self.local.remove(m, db)
                     self.bar_update(1)
@@ -911,7 +1679,24 @@ class Gmailieer:
                 )
                 needs_update = list(set(needs_update) - set(previous.meta_fetched))
 
-            self.get_meta(needs_update, previous, self.resume)
+            if delta:
+                unchanged = len(needs_update)
+                needs_update = [
+                    m
+                    for m in needs_update
+                    if index.changed(threads[m], self.thread_history.get(threads[m]))
+                ]
+                self.vprint(
+                    "pull: delta: skipping metadata for %d messages in unchanged threads"
+                    % (unchanged - len(needs_update))
+                )
+
+            self.get_meta(
+                needs_update,
+                previous,
+                self.resume,
+                threads if self.local.config.thread_metadata else None,
+            )
         else:
             self.vprint("pull: no messages.")
 
@@ -928,6 +1713,17 @@ class Gmailieer:
             else:
                 self.local.state.set_last_history_id(last_id)
 
+            if self.thread_history is not None:
+                index.save(self.thread_history)
+
+            if self.limit is None:
+                # every message has been fetched
+                Backfill(
+                    os.path.join(self.local.wd, ".backfill.gmailieer.json")
+                ).delete()
+
+        self.thread_history = None
+
         self.vprint("pull: complete, removing resume file")
         previous.delete()
 
@@ -940,11 +1736,14 @@ class Gmailieer:
                 "pull: note that local changes made in the interim might be ignored in the next push"
             )
 
-    def get_meta(self, msgids, previous=None, resume=False):
+    def get_meta(self, msgids, previous=None, resume=False, threads=None):
         """
         Only gets the minimal message objects in order to check if labels are up-to-date.
 
         `previous` and `resume` is passed by `full_pull` to track progress and resume previous metadata pull.
+
+        `threads` maps message ids to thread ids, if given the messages are fetched a
+        thread at a time.
         """
 
         if len(msgids) > 0:
@@ -957,22 +1756,74 @@ class Gmailieer:
 
             # opening db for whole metadata sync
             def _got_msgs(ms):
-                with notmuch2.Database(mode=notmuch2.Database.MODE.READ_WRITE) as db:
+                self.note_history(ms)
+                with self.metrics.phase("notmuch_write"), self.local.write_db() as db:
                     for m in ms:
                         self.bar_update(1)
                         self.local.update_tags(m, None, db)
 
-                    if previous is not None:
-                        gids = [m["id"] for m in ms]
-                        previous.update(gids)
+                # checkpoint once the changes are committed
+                if previous is not None:
+                    gids = [m["id"] for m in ms]
+                    previous.update(gids)
 
-            self.remote.get_messages(msgids, _got_msgs, "minimal")
+            with self.metrics.phase("metadata"):
+                if threads is None:
+                    self.remote.get_messages(msgids, _got_msgs, "minimal")
+                else:
+                    self.get_thread_meta(msgids, threads, _got_msgs)
 
             self.bar_close()
 
         else:
             self.vprint("receiving metadata: everything up-to-date.")
 
+    def note_history(self, ms):
+        """
+        Record the historyId of the threads of messages fetched during a full pull.
+        The historyId of a thread is that of its last changed message, so a thread
+        gets the highest historyId of its messages.
+        """
+        if self.thread_history is None:
+            return
+
+        for m in ms:
+            (tid, hid) = (m.get("threadId"), m.get("historyId"))
+            if tid is None or hid is None:
+                continue
+
+            if int(hid) > int(self.thread_history.get(tid, 0)):
+                self.thread_history[tid] = hid
+
+    def get_thread_meta(self, msgids, threads, cb):
+        """
+        Get the minimal message objects of msgids with one request per thread, cb is
+        called with the wanted messages of each batch of threads. A thread costs
+        more quota than a message, so the messages of threads with few wanted
+        messages are fetched one by one, as are messages that are no longer in their
+        thread (e.g. moved by GMail since listing).
+        """
+        units = self.remote.QUOTA_UNITS
+        per_thread = units["gmail.users.threads.get"]
+        per_message = units["gmail.users.messages.get"]
+
+        counts = collections.Counter(threads[m] for m in msgids)
+        tids = [t for t, n in counts.items() if n * per_message >= per_thread]
+        by_thread = set(tids)
+        wanted = {m for m in msgids if threads[m] in by_thread}
+
+        def _got_threads(ts):
+            ms = [m for t in ts for m in t.get("messages", []) if m["id"] in wanted]
+            wanted.difference_update(m["id"] for m in ms)
+            if ms:
+                cb(ms)
+
+        self.remote.get_threads(tids, _got_threads)
+
+        single = [m for m in msgids if m in wanted or threads[m] not in by_thread]
+        if single:
+            self.remote.get_messages(single, cb, "minimal")
+
     def get_content(self, msgids):
         """
         Get the full email source of the messages that we do not already have
@@ -990,14 +1841,53 @@ class Gmailieer:
                 leave=True, total=len(need_content), desc="receiving content"
             )
 
-            def _got_msgs(ms):
+            config = self.local.config
+            stubs = bool(config.full_body_days or config.full_body_max_size)
+
+            def _got_msgs(ms, metadata=False):
+                self.note_history(ms)
+
                 # opening db per message batch since it takes some time to download each one
-                with notmuch2.Database(mode=notmuch2.Database.MODE.READ_WRITE) as db:
+                with self.metrics.phase("notmuch_write"), self.local.write_db() as db:
                     for m in ms:
+                        # e.g. an old message that got a label outside the max age
+                        if not self.remote.in_scope(m):
+                            self.bar_update(1)
+                            continue
+
+                        if metadata:
+                            # the same message in another account
+                            source = (
+                                self.local.find_copy(m, db)
+                                if config.dedupe_message_id
+                                else None
+                            )
+                            if source is not None:
+                                self.bar_update(1)
+                                self.local.store(m, db, source=source)
+                                continue
+
+                            if not stubs or self.full_body(m):
+                                full.append(m["id"])
+                                continue
+
                         self.bar_update(1)
-                        self.local.store(m, db)
+                        self.local.store(m, db, stub=metadata)
+
+            full = need_content
+            with self.metrics.phase("content"):
+                if stubs or config.dedupe_message_id:
+                    # the headers tell which messages to keep the bodies of, the rest
+                    # are stored as stubs or linked from another account.
+                    full = []
+                    self.remote.get_messages(
+                        need_content,
+                        lambda ms: _got_msgs(ms, True),
+                        "metadata",
+                        None if stubs else ["Message-ID"],
+                    )
 
-            self.remote.get_messages(need_content, _got_msgs, "raw")
+                self.remote.get_messages(full, _got_msgs, "raw")
 
             self.bar_close()
 
@@ -1006,6 +1896,260 @@ class Gmailieer:
 
         return need_content
 
+    def import_takeout(self, args, setup=False):
+        """
+        Store the messages of a Google Takeout mbox in a repository that has not been
+        pulled. The labels in the Takeout are applied, the initial (full) pull then
+        only fetches the content of messages that are not in the Takeout and updates
+        the labels of the rest.
+        """
+        from .takeout import Takeout
+
+        if not setup:
+            self.setup(args, args.dry_run, True)
+            self.mbox = os.path.expanduser(args.mbox)
+
+        if self.local.state.last_historyId != 0:
+            raise Local.RepositoryException(
+                "import-takeout: the repository has already been pulled, a Takeout can only be imported before the initial pull."
+            )
+
+        takeout = Takeout(self.mbox, self.remote.invlabels)
+        messages = iter(takeout)
+        stored = 0
+
+        self.bar_create(leave=True, total=takeout.size, desc="importing takeout")
+        with self.metrics.phase("takeout"):
+            done = False
+            while not done:
+                # opening db per batch, letting other repositories write in between
+                done = True
+                with self.metrics.phase("notmuch_write"), self.local.write_db() as db:
+                    for m, content in itertools.islice(messages, self.STORE_CHUNK_SIZE):
+                        done = False
+                        self.bar_update(len(content))
+
+                        if self.local.has(m["id"]) or not self.remote.in_scope(m):
+                            continue
+
+                        self.local.store(m, db, content=content)
+                        stored += 1
+
+        self.bar_close()
+
+        for name, n in sorted(takeout.unknown.items()):
+            self.vprint(
+                "import-takeout: label '%s' of %d messages does not exist, ignored."
+                % (name, n)
+            )
+
+        self.vprint(
+            "import-takeout: %d messages stored, run 'gmi pull' to fetch the rest and update the labels."
+            % stored
+        )
+
+    def export(self, args, setup=False):
+        """
+        Write an archive of the repository (see `Archive`) for setting up the same
+        account on another machine with `gmi import`.
+        """
+        import notmuch2
+
+        from .archive import Archive
+
+        if not setup:
+            self.setup(args, False, True)
+            self.archive = os.path.expanduser(args.archive)
+
+        tags = {}
+        with notmuch2.Database() as db:
+            rev = db.revision().rev
+            if rev != self.local.state.lastmod:
+                changed = db.count_messages(
+                    "path:%s/** and lastmod:%d..%d"
+                    % (self.local.nm_relative, self.local.state.lastmod, rev)
+                )
+                if changed > 0:
+                    print(
+                        "export: warning: %d messages have local changes that have not been pushed, these are not pushed from the imported repository."
+                        % changed
+                    )
+
+            for m in db.messages("path:%s/**" % self.local.nm_relative):
+                t = sorted(m.tags)
+                for f in m.filenames():
+                    if self.local.contains(f):
+                        tags[os.path.relpath(f, self.local.md)] = t
+
+        Archive(self.archive).create(self.local, tags)
+        self.vprint(
+            "export: %d messages written to %s." % (len(self.local.files), self.archive)
+        )
+
+    def import_archive(self, args, setup=False):
+        """
+        Set up a repository from an archive made with `gmi export`, and pull the
+        changes since the export.
+        """
+        from .archive import Archive
+
+        if not setup:
+            self.setup(args, False, False)
+            self.archive = os.path.expanduser(args.archive)
+            self.force = False
+            self.limit = None
+            self.resume = False
+
+        tags = Archive(self.archive).extract(self.local.wd)
+
+        self.local.load_repository()
+        self.remote = Remote(self)
+        self.register(tags)
+
+        hid = self.local.state.last_historyId
+        if hid and self.remote.is_history_id_valid(hid):
+            self.vprint("import: pulling changes since the export.. (hid: %d)" % hid)
+            self.partial_pull()
+        else:
+            self.vprint("import: the history since the export has expired.")
+            self.full_pull(delta=True)
+
+    def register(self, tags):
+        """
+        Add the messages of a repository that has been copied (e.g. from an archive)
+        to the notmuch database. tags is a map of file name in the mail directory to
+        the tags of the message, messages not in the map get the tags of their
+        maildir flags.
+        """
+        import notmuch2
+
+        files = list(self.local.files)
+
+        self.bar_create(leave=True, total=len(files), desc="registering messages")
+        with self.metrics.phase("notmuch_write"):
+            for i in range(0, len(files), self.STORE_CHUNK_SIZE):
+                # opening db per chunk, letting other repositories write in between
+                with self.local.write_db() as db:
+                    for f in files[i : i + self.STORE_CHUNK_SIZE]:
+                        self.bar_update(1)
+
+                        fname = os.path.join(self.local.md, f)
+                        try:
+                            (nmsg, _) = db.add(fname, sync_flags=f not in tags)
+                        except notmuch2.FileNotEmailError:
+                            print("%s is not an email" % fname)
+                            continue
+
+                        self.local.written(
+                            self.local.__filename_to_gid__(os.path.basename(f))
+                        )
+
+                        if f in tags:
+                            with nmsg.frozen():
+                                nmsg.tags.clear()
+                                for t in tags[f]:
+                                    nmsg.tags.add(t)
+
+        self.bar_close()
+
+        # the changes since the export are pulled, nothing has changed locally
+        with notmuch2.Database() as db:
+            self.local.state.set_lastmod(db.revision().rev)
+
+    def migrate_layout(self, args, setup=False):
+        """
+        Move the messages to the maildirs of another layout, keeping their file
+        names and tags. Can be interrupted and run again, the layout is changed
+        once all the messages have been moved.
+        """
+        if not setup:
+            self.setup(args, args.dry_run, True)
+            self.layout = args.layout
+
+        moves = [
+            gid
+            for gid, f in self.local.gids.items()
+            if os.path.dirname(os.path.dirname(f))
+            != self.local.maildir(gid, self.layout)
+        ]
+
+        self.bar_create(leave=True, total=len(moves), desc="moving messages")
+        with self.metrics.phase("notmuch_write"):
+            for i in range(0, len(moves), self.STORE_CHUNK_SIZE):
+                # opening db per chunk, letting other repositories write in between
+                with self.local.write_db() as db:
+                    for gid in moves[i : i + self.STORE_CHUNK_SIZE]:
+                        self.local.move(gid, self.local.maildir(gid, self.layout), db)
+                        self.bar_update(1)
+        self.bar_close()
+
+        if self.dry_run:
+            return
+
+        if self.layout == "flat":
+            self.local.remove_empty_shards()
+
+        self.local.config.set_maildir_layout(self.layout)
+        self.vprint(
+            "migrate-layout: %d messages moved, the layout is %s."
+            % (len(moves), self.layout)
+        )
+
+    def full_body(self, m):
+        """
+        Whether the body of the message is stored, or only its headers: messages
+        must be younger than `full_body_days` and smaller than `full_body_max_size`
+        (when set).
+        """
+        import time
+
+        config = self.local.config
+
+        if config.full_body_days:
+            age = time.time() - int(m["internalDate"]) / 1000
+            if age > config.full_body_days * 24 * 3600:
+                return False
+
+        size = m.get("sizeEstimate", 0)
+        return not (config.full_body_max_size and size > config.full_body_max_size)
+
+    def hydrate(self, args, setup=False):
+        """
+        Fetch the content of messages stored as headers only.
+        """
+        import notmuch2
+
+        if not setup:
+            self.setup(args, args.dry_run, True)
+            self.query = " ".join(args.query)
+
+        query = "(%s) and tag:%s and path:%s/**" % (
+            self.query,
+            Local.STUB_TAG,
+            self.local.nm_relative,
+        )
+
+        with notmuch2.Database() as db:
+            (_, gids) = self.local.messages_to_gids(db.messages(query))
+
+        gids = list(dict.fromkeys(gids))
+        if not gids:
+            self.vprint("hydrate: no messages to fetch.")
+            return
+
+        self.bar_create(leave=True, total=len(gids), desc="hydrating messages")
+
+        def _got_msgs(ms):
+            with self.metrics.phase("notmuch_write"), self.local.write_db() as db:
+                for m in ms:
+                    self.bar_update(1)
+                    self.local.hydrate(m, db)
+
+        with self.metrics.phase("content"):
+            self.remote.get_messages(gids, _got_msgs, "raw")
+
+        self.bar_close()
+
     def load_resume(self, f, lastid):
         """
         Load a previous incomplete pull from resume file or create new resume file.
@@ -1022,9 +2166,6 @@ class Gmailieer:
             return ResumePull.new(f, lastid)
 
     def send(self, args):
-        self.setup(args, args.dry_run, True, args.blocking)
-        self.remote.get_labels()
-
         msg = sys.stdin.buffer.read()
 
         # check if in-reply-to is set and find threadId
@@ -1064,11 +2205,17 @@ class Gmailieer:
                 )
             )
 
+        # the message is validated before the repository is loaded
+        self.setup(args, args.dry_run, True, args.blocking)
+
         self.vprint("sending message, from: %s.." % (eml.get("From")))
 
         if "In-Reply-To" in eml:
             repl = eml["In-Reply-To"].strip().strip("<>")
             self.vprint("looking for original message: %s" % repl)
+
+            import notmuch2
+
             with notmuch2.Database(mode=notmuch2.Database.MODE.READ_ONLY) as db:
                 try:
                     nmsg = db.find(repl)
@@ -1136,6 +2283,18 @@ class Gmailieer:
         if args.no_ignore_empty_history:
             self.local.config.set_ignore_empty_history(False)
 
+        if args.thread_metadata:
+            self.local.config.set_thread_metadata(True)
+
+        if args.no_thread_metadata:
+            self.local.config.set_thread_metadata(False)
+
+        if args.dedupe_message_id:
+            self.local.config.set_dedupe_message_id(True)
+
+        if args.no_dedupe_message_id:
+            self.local.config.set_dedupe_message_id(False)
+
         if args.remove_local_messages:
             self.local.config.set_remove_local_messages(True)
 
@@ -1148,6 +2307,30 @@ class Gmailieer:
         if args.ignore_tags_remote is not None:
             self.local.config.set_ignore_remote_labels(args.ignore_tags_remote)
 
+        if args.scope_labels is not None:
+            self.local.config.set_scope_labels(args.scope_labels)
+
+        if args.scope_exclude_labels is not None:
+            self.local.config.set_scope_exclude_labels(args.scope_exclude_labels)
+
+        if args.exclude_spam_trash:
+            self.local.config.set_exclude_spam_trash(True)
+
+        if args.no_exclude_spam_trash:
+            self.local.config.set_exclude_spam_trash(False)
+
+        if args.max_age_days is not None:
+            self.local.config.set_max_age_days(args.max_age_days)
+
+        if args.full_body_days is not None:
+            self.local.config.set_full_body_days(args.full_body_days)
+
+        if args.full_body_max_size is not None:
+            self.local.config.set_full_body_max_size(args.full_body_max_size)
+
+        if args.durability is not None:
+            self.local.config.set_durability(args.durability)
+
         if args.file_extension is not None:
             self.local.config.set_file_extension(args.file_extension)
 
@@ -1168,9 +2351,19 @@ class Gmailieer:
         print("Remove local messages .....:", self.local.config.remove_local_messages)
         print("Drop non existing labels...:", self.local.config.drop_non_existing_label)
         print("Ignore empty history ......:", self.local.config.ignore_empty_history)
+        print("Thread metadata ...........:", self.local.config.thread_metadata)
+        print("Dedupe Message-ID .........:", self.local.config.dedupe_message_id)
         print("Replace . with / ..........:", self.local.config.replace_slash_with_dot)
         print("Ignore tags (local) .......:", self.local.config.ignore_tags)
         print("Ignore labels (remote) ....:", self.local.config.ignore_remote_labels)
+        print("Scope labels ..............:", self.local.config.scope_labels)
+        print("Scope exclude labels ......:", self.local.config.scope_exclude_labels)
+        print("Exclude spam and trash ....:", self.local.config.exclude_spam_trash)
+        print("Max age (days) ............:", self.local.config.max_age_days)
+        print("Full body (days) ..........:", self.local.config.full_body_days)
+        print("Full body max size ........:", self.local.config.full_body_max_size)
+        print("Durability ................:", self.local.config.durability)
+        print("Maildir layout ............:", self.local.config.maildir_layout)
         print("Trash tag (local) .........:", self.local.config.local_trash_tag)
         print(
             "Translation list overlay ..:", self.local.config.translation_list_overlay
@@ -1188,7 +2381,7 @@ class Gmailieer:
         Create progress bar.
         """
         if not self.args.quiet:
-            self.bar = tqdm(leave=True, total=total, desc=desc)
+            self.bar = self.tqdm(leave=True, total=total, desc=desc)
 
     def bar_update(self, n):
         """
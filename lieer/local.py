@@ -16,6 +16,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import base64
+import contextlib
 import errno
 import fcntl
 import json
@@ -24,14 +25,13 @@ import shutil
 import tempfile
 from pathlib import Path
 
-import notmuch2
-
 from .remote import Remote
 
 
 class Local:
     wd = None
     loaded = False
+    lckf = None
 
     # NOTE: Update README when changing this map.
     translate_labels_default = {
@@ -65,7 +65,11 @@ class Local:
 
     labels_translate_default = {v: k for k, v in translate_labels_default.items()}
 
+    # tag of messages stored with only their headers, see `gmi hydrate`
+    STUB_TAG = "lieer-stub"
+
     ignore_labels = {
+        STUB_TAG,
         "archive",
         "arxiv",
         "attachment",
@@ -132,6 +136,25 @@ class Local:
         file_extension = None
         local_trash_tag = "trash"
         translation_list_overlay = None
+        thread_metadata = False
+        dedupe_message_id = False
+        scope_labels = None
+        scope_exclude_labels = None
+        exclude_spam_trash = False
+        max_age_days = 0
+        full_body_days = 0
+        full_body_max_size = 0
+        durability = "none"
+        maildir_layout = "flat"
+
+        # 'flat': all messages in mail/{cur,new,tmp}, 'sharded': messages spread over
+        # maildirs mail/<xx>/{cur,new,tmp} by the last two digits of the GID.
+        LAYOUTS = ("flat", "sharded")
+
+        # 'none': message files are left to the operating system to write to disk,
+        # 'batch': message files are written to disk (fsync) a batch at a time
+        # before the notmuch database is committed.
+        DURABILITY = ("none", "batch")
 
         def __init__(self, config_f):
             self.config_f = config_f
@@ -163,6 +186,16 @@ class Local:
             self.translation_list_overlay = self.json.get(
                 "translation_list_overlay", []
             )
+            self.thread_metadata = self.json.get("thread_metadata", False)
+            self.dedupe_message_id = self.json.get("dedupe_message_id", False)
+            self.scope_labels = set(self.json.get("scope_labels", []))
+            self.scope_exclude_labels = set(self.json.get("scope_exclude_labels", []))
+            self.exclude_spam_trash = self.json.get("exclude_spam_trash", False)
+            self.max_age_days = self.json.get("max_age_days", 0)
+            self.full_body_days = self.json.get("full_body_days", 0)
+            self.full_body_max_size = self.json.get("full_body_max_size", 0)
+            self.durability = self.json.get("durability", "none")
+            self.maildir_layout = self.json.get("maildir_layout", "flat")
 
         def write(self):
             self.json = {}
@@ -178,6 +211,16 @@ class Local:
             self.json["file_extension"] = self.file_extension
             self.json["local_trash_tag"] = self.local_trash_tag
             self.json["translation_list_overlay"] = self.translation_list_overlay
+            self.json["thread_metadata"] = self.thread_metadata
+            self.json["dedupe_message_id"] = self.dedupe_message_id
+            self.json["scope_labels"] = list(self.scope_labels)
+            self.json["scope_exclude_labels"] = list(self.scope_exclude_labels)
+            self.json["exclude_spam_trash"] = self.exclude_spam_trash
+            self.json["max_age_days"] = self.max_age_days
+            self.json["full_body_days"] = self.full_body_days
+            self.json["full_body_max_size"] = self.full_body_max_size
+            self.json["durability"] = self.durability
+            self.json["maildir_layout"] = self.maildir_layout
 
             if os.path.exists(self.config_f):
                 shutil.copyfile(self.config_f, self.config_f + ".bak")
@@ -208,6 +251,14 @@ class Local:
             self.ignore_empty_history = r
             self.write()
 
+        def set_thread_metadata(self, r):
+            self.thread_metadata = r
+            self.write()
+
+        def set_dedupe_message_id(self, r):
+            self.dedupe_message_id = r
+            self.write()
+
         def set_remove_local_messages(self, r):
             self.remove_local_messages = r
             self.write()
@@ -228,6 +279,63 @@ class Local:
 
             self.write()
 
+        def set_scope_labels(self, t):
+            if len(t.strip()) == 0:
+                self.scope_labels = set()
+            else:
+                self.scope_labels = {tt.strip() for tt in t.split(",")}
+
+            self.write()
+
+        def set_scope_exclude_labels(self, t):
+            if len(t.strip()) == 0:
+                self.scope_exclude_labels = set()
+            else:
+                self.scope_exclude_labels = {tt.strip() for tt in t.split(",")}
+
+            self.write()
+
+        def set_exclude_spam_trash(self, r):
+            self.exclude_spam_trash = r
+            self.write()
+
+        def set_max_age_days(self, d):
+            if d < 0:
+                raise ValueError("max age must be positive (or 0 for no limit)")
+
+            self.max_age_days = d
+            self.write()
+
+        def set_full_body_days(self, d):
+            if d < 0:
+                raise ValueError("days must be positive (or 0 for no limit)")
+
+            self.full_body_days = d
+            self.write()
+
+        def set_full_body_max_size(self, s):
+            if s < 0:
+                raise ValueError("size must be positive (or 0 for no limit)")
+
+            self.full_body_max_size = s
+            self.write()
+
+        def set_durability(self, d):
+            if d not in self.DURABILITY:
+                raise ValueError(
+                    "durability must be one of: %s" % ", ".join(self.DURABILITY)
+                )
+
+            self.durability = d
+            self.write()
+
+        def set_maildir_layout(self, layout):
+            if layout not in self.LAYOUTS:
+                raise ValueError("layout must be one of: %s" % ", ".join(self.LAYOUTS))
+
+            self.maildir_layout = layout
+            self.write()
+
         def set_file_extension(self, t):
             try:
                 with tempfile.NamedTemporaryFile(
@@ -275,6 +383,7 @@ class Local:
 
         def __init__(self, state_f, config):
             self.state_f = state_f
+            self.config = config
 
             # True if config file contains state keys and should be migrated.
             # We will write both state and config after load if true.
@@ -320,8 +429,16 @@ class Local:
                 mode="w+", dir=os.path.dirname(self.state_f), delete=False
             ) as fd:
                 json.dump(self.json, fd)
+
+                if self.config.durability == "batch":
+                    fd.flush()
+                    os.fsync(fd.fileno())
+
                 os.rename(fd.name, self.state_f)
 
+            if self.config.durability == "batch":
+                Local.fsync(os.path.dirname(self.state_f))
+
         def set_last_history_id(self, hid):
             self.last_historyId = hid
             self.write()
@@ -331,11 +448,12 @@ class Local:
             self.write()
 
     # we are in the class "Local"; this is the Local instance constructor
-    def __init__(self, g):
+    def __init__(self, g, wd=None):
         self.gmailieer = g
-        self.wd = os.getcwd()
+        self.wd = os.path.abspath(wd) if wd is not None else os.getcwd()
         self.dry_run = g.dry_run
         self.verbose = g.verbose
+        self.metrics = g.metrics
 
         # config and state files for local repository
         self.config_f = os.path.join(self.wd, ".gmailieer.json")
@@ -345,6 +463,13 @@ class Local:
         # mail store
         self.md = os.path.join(self.wd, "mail")
 
+        # gids of the message files written since the last `flush`
+        self.unflushed = []
+
+        # directories (relative to the mail directory) with files renamed or removed
+        # since the last `flush`
+        self.unflushed_dirs = set()
+
         # initialize label translation instance variables
         self.translate_labels = Local.translate_labels_default.copy()
         self.labels_translate = Local.labels_translate_default.copy()
@@ -355,14 +480,16 @@ class Local:
 
         block (boolean): if repository is in use, wait for lock to be freed (default: False)
         """
+        import notmuch2
 
         if not os.path.exists(self.config_f):
             raise Local.RepositoryException(
                 "local repository not initialized: could not find config file"
             )
 
-        if any(
-            not os.path.exists(os.path.join(self.md, mail_dir))
+        if not os.path.isdir(self.md) or any(
+            not os.path.exists(os.path.join(self.md, d, mail_dir))
+            for d in self.maildirs()
             for mail_dir in ("cur", "new", "tmp")
         ):
             raise Local.RepositoryException(
@@ -380,9 +507,32 @@ class Local:
                 )
             self.nm_dir = str(Path(self.md).resolve())
 
-        ## Lock repository
+        self.lock(block)
+
+        self.config = Local.Config(self.config_f)
+        self.state = Local.State(self.state_f, self.config)
+
+        self.ignore_labels = self.ignore_labels | self.config.ignore_tags
+        self.update_translation("TRASH", self.config.local_trash_tag)
+        self.update_translation_list_with_overlay(self.config.translation_list_overlay)
+
+        self.__load_cache__()
+
+        # load notmuch config
+        with notmuch2.Database() as db:
+            self.new_tags = db.config.get("new.tags", "").split(";")
+        self.new_tags = [t.strip() for t in self.new_tags if len(t.strip()) > 0]
+
+        self.loaded = True
+
+    def lock(self, block=False):
+        """
+        Lock the repository for this gmi instance
+
+        block (boolean): if repository is in use, wait for lock to be freed (default: False)
+        """
         try:
-            self.lckf = open(".lock", "w")  # noqa: SIM115
+            self.lckf = open(os.path.join(self.wd, ".lock"), "w")  # noqa: SIM115
             if block:
                 fcntl.lockf(self.lckf, fcntl.LOCK_EX)
             else:
@@ -396,37 +546,184 @@ class Local:
             # otherwise probably irrecoverable, keep the raw exception to help debugging
             raise
 
-        self.config = Local.Config(self.config_f)
-        self.state = Local.State(self.state_f, self.config)
+    def unlock(self):
+        """
+        Release the repository lock so that other gmi instances may use the repository
+        """
+        fcntl.lockf(self.lckf, fcntl.LOCK_UN)
+        self.lckf.close()
+        self.lckf = None
 
-        self.ignore_labels = self.ignore_labels | self.config.ignore_tags
-        self.update_translation("TRASH", self.config.local_trash_tag)
-        self.update_translation_list_with_overlay(self.config.translation_list_overlay)
+    def cache_stamp(self):
+        """
+        Modification times of the mail directories, these change whenever a
+        message file is added, renamed or removed.
+        """
+        return tuple(
+            os.stat(os.path.join(self.md, d, sub)).st_mtime_ns
+            for d in self.maildirs()
+            for sub in ("cur", "new")
+        )
+
+    @staticmethod
+    def is_shard(name):
+        """
+        Whether name is a maildir of the sharded layout
+        """
+        return len(name) == 2 and all(c in "0123456789abcdef" for c in name)
 
-        self.__load_cache__()
+    def maildirs(self):
+        """
+        The maildirs of the repository relative to the mail directory: the top level
+        one, and the shards of the sharded layout. Messages are found in all of
+        them whatever the layout, the layout decides where new messages go.
+        """
+        with os.scandir(self.md) as it:
+            shards = sorted(e.name for e in it if self.is_shard(e.name) and e.is_dir())
 
-        # load notmuch config
-        with notmuch2.Database() as db:
-            self.new_tags = db.config.get("new.tags", "").split(";")
-        self.new_tags = [t.strip() for t in self.new_tags if len(t.strip()) > 0]
+        return ["", *shards]
 
-        self.loaded = True
+    def maildir(self, gid, layout=None):
+        """
+        The maildir (relative to the mail directory) of message gid in layout (the
+        configured layout by default). The last digits of the GID are used, since
+        the first digits are nearly the same for messages received around the same
+        time.
+        """
+        if (layout or self.config.maildir_layout) == "sharded":
+            return gid[-2:]
+
+        return ""
+
+    def relative(self, fname):
+        """
+        File name relative to the mail directory, e.g. 'cur/...' or 'ab/cur/...'
+        """
+        return os.path.relpath(fname, self.md)
+
+    @contextlib.contextmanager
+    def write_db(self):
+        """
+        Open the notmuch database for writing. If the gmi instance has a write lock
+        configured it is held for as long as the database is open, so that several
+        gmi instances writing to the same database take turns rather than failing on
+        the database lock. The write lock is either the path of a lock file, or a
+        lock object (e.g. `threading.Lock`) for repositories in the same process.
+        """
+        import notmuch2
+
+        write_lock = self.gmailieer.write_lock
+
+        with contextlib.ExitStack() as stack:
+            if isinstance(write_lock, str):
+                lckf = stack.enter_context(open(write_lock, "w"))
+                fcntl.lockf(lckf, fcntl.LOCK_EX)
+            elif write_lock is not None:
+                # a lock object shared by repositories in the same process
+                stack.enter_context(write_lock)
+
+            db = stack.enter_context(
+                notmuch2.Database(mode=notmuch2.Database.MODE.READ_WRITE)
+            )
+
+            # the files are on disk before the database that points to them is
+            # committed (when closed)
+            try:
+                yield db
+            finally:
+                self.flush()
+
+    def written(self, gid):
+        """
+        Record that the file of message gid has been written, it is written to disk
+        on the next `flush`.
+        """
+        if self.config.durability == "batch" and not self.dry_run:
+            self.unflushed.append(gid)
+
+    def touched(self, *fnames):
+        """
+        Record that files (relative to the mail directory) have been renamed or
+        removed, their directories are written to disk on the next `flush`.
+        """
+        if self.config.durability == "batch" and not self.dry_run:
+            self.unflushed_dirs.update(os.path.dirname(f) for f in fnames)
+
+    def flush(self):
+        """
+        With the 'batch' durability mode, write the message files written since the
+        last flush to disk, followed by their directories and the directories of the
+        files renamed or removed.
+        """
+        if self.config.durability != "batch" or self.dry_run:
+            return
+
+        dirs = {os.path.join(self.md, d) for d in self.unflushed_dirs}
+        for gid in self.unflushed:
+            # the file may have been renamed (maildir flags) since it was written
+            fname = self.gids.get(gid)
+            if fname is not None:
+                fname = os.path.join(self.md, fname)
+                self.fsync(fname)
+                dirs.add(os.path.dirname(fname))
+
+        for d in sorted(dirs):
+            # e.g. an empty shard that has been removed
+            if os.path.isdir(d):
+                self.fsync(d)
+
+        self.metrics.count("files_flushed", len(self.unflushed))
+        self.unflushed = []
+        self.unflushed_dirs = set()
+
+    def make_maildir(self, maildir):
+        """
+        Create maildir (relative to the mail directory) if it does not exist
+        """
+        if not os.path.isdir(os.path.join(self.md, maildir)):
+            self.touched(maildir, os.path.join(maildir, "cur"))
+
+        for sub in ("cur", "new", "tmp"):
+            os.makedirs(os.path.join(self.md, maildir, sub), exist_ok=True)
+
+    def remove_empty_shards(self):
+        """
+        Remove the maildirs of the sharded layout that are empty
+        """
+        for d in self.maildirs()[1:]:
+            dirs = [os.path.join(self.md, d, sub) for sub in ("cur", "new", "tmp")]
+            if any(os.listdir(p) for p in dirs if os.path.isdir(p)):
+                continue
+
+            with contextlib.suppress(OSError):
+                for p in dirs:
+                    os.rmdir(p)
+                os.rmdir(os.path.join(self.md, d))
+
+    @staticmethod
+    def fsync(path):
+        """
+        Write file or directory (the names in it) to disk.
+        """
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
 
     def __load_cache__(self):
         ## The Cache:
         ##
         ## this cache is used to know which messages we have a physical copy of.
         ## hopefully this won't grow too gigantic with lots of messages.
+        self.metrics.count("cache_reloads")
         self.files = []
-        for _, _, fnames in os.walk(os.path.join(self.md, "cur")):
-            _fnames = ("cur/" + f for f in fnames)
-            self.files.extend(_fnames)
-            break
-
-        for _, _, fnames in os.walk(os.path.join(self.md, "new")):
-            _fnames = ("new/" + f for f in fnames)
-            self.files.extend(_fnames)
-            break
+        for d in self.maildirs():
+            for sub in ("cur", "new"):
+                for _, _, fnames in os.walk(os.path.join(self.md, d, sub)):
+                    _fnames = (os.path.join(d, sub, f) for f in fnames)
+                    self.files.extend(_fnames)
+                    break
 
         # exclude files that are unlikely to be real message files
         self.files = [f for f in self.files if os.path.basename(f)[0] != "."]
@@ -461,6 +758,23 @@ class Local:
         os.makedirs(os.path.join(self.md, "new"))
         os.makedirs(os.path.join(self.md, "tmp"))
 
+    def label_to_tag(self, label):
+        """
+        The notmuch tag for a remote label name
+        """
+        tag = self.translate_labels.get(label, label)
+
+        if self.config.replace_slash_with_dot:
+            tag = tag.replace("/", ".")
+
+        return tag
+
+    def tag_query(self, tag):
+        """
+        Query for the messages in the repository with tag
+        """
+        return 'path:%s/** and tag:"%s"' % (self.nm_relative, tag.replace('"', '""'))
+
     def has(self, m):
         """Check whether we have message id"""
         return m in self.gids
@@ -480,23 +794,27 @@ class Local:
         # remove old file from cache
         if old is not None:
             (old_gid, old_f) = old
+            old_f = self.relative(old_f)
 
-            old_f = Path(old_f)
-            self.files.remove(os.path.join(old_f.parent.name, old_f.name))
+            self.files.remove(old_f)
             self.gids.pop(old_gid)
 
         # add message to cache
         fname_iter = nmsg.filenames()
         for _f in fname_iter:
             if self.contains(_f):
-                new_f = Path(_f)
+                new_f = self.relative(_f)
 
                 # there might be more GIDs (and files) for each NotmuchMessage, if so,
                 # the last matching file will be used in the gids map.
 
-                _m = self.__filename_to_gid__(new_f.name)
-                self.gids[_m] = os.path.join(new_f.parent.name, new_f.name)
-                self.files.append(os.path.join(new_f.parent.name, new_f.name))
+                _m = self.__filename_to_gid__(os.path.basename(new_f))
+                self.gids[_m] = new_f
+                self.files.append(new_f)
+
+                # renamed by the maildir flags
+                if old is not None and new_f != old_f:
+                    self.touched(old_f, new_f)
 
     def messages_to_gids(self, msgs):
         """
@@ -588,32 +906,136 @@ class Local:
             if nmsg is not None:
                 db.remove(fname)
             os.unlink(fname)
+            self.touched(ffname)
 
             self.files.remove(ffname)
             self.gids.pop(gid)
 
-    def store(self, m, db):
-        """
-        Store message in local store
-        """
+        self.metrics.count("messages_removed")
 
-        gid = m["id"]
+    @staticmethod
+    def __decode_raw__(m):
         msg_str = base64.urlsafe_b64decode(m["raw"].encode("ASCII"))
 
         # messages from GMail have windows line endings
         if os.linesep == "\n":
             msg_str = msg_str.replace(b"\r\n", b"\n")
 
+        return msg_str
+
+    @staticmethod
+    def make_stub(m):
+        """
+        A message with the headers of m (in 'metadata' format) and a note on how to
+        fetch the body in place of the content.
+        """
+        lines = [
+            "%s: %s" % (h["name"], h["value"])
+            for h in m.get("payload", {}).get("headers", [])
+            if not h["name"].lower().startswith(("content-", "mime-version"))
+        ]
+        lines.extend(
+            [
+                "MIME-Version: 1.0",
+                "Content-Type: text/plain; charset=utf-8",
+                "X-Lieer-Stub: %s" % m["id"],
+                "",
+                "This message (%d bytes) has not been downloaded, fetch it with:"
+                % m.get("sizeEstimate", 0),
+                "",
+                "  gmi hydrate tag:%s" % Local.STUB_TAG,
+                "",
+            ]
+        )
+
+        return "\n".join(lines).encode("utf-8")
+
+    def find_copy(self, m, db):
+        """
+        Find a file with the content of m (in 'metadata' format with the Message-ID
+        header) in another lieer repository in the notmuch database, returns None if
+        there is none.
+        """
+
+        headers = m.get("payload", {}).get("headers", [])
+        mid = next(
+            (h["value"] for h in headers if h["name"].lower() == "message-id"), ""
+        )
+        mid = mid.strip().strip("<>")
+        if not mid:
+            return None
+
+        try:
+            nmsg = db.find(mid)
+        except LookupError:
+            return None
+
+        if nmsg is None or self.STUB_TAG in nmsg.tags:
+            return None
+
+        for f in nmsg.filenames():
+            f = Path(f)
+
+            # repository/mail/cur/file, or repository/mail/xx/cur/file
+            repository = f.parents[2]
+            if self.is_shard(f.parents[1].name):
+                repository = f.parents[3]
+
+            if (
+                not self.contains(f)
+                and (repository / ".gmailieer.json").exists()
+                and f.exists()
+            ):
+                return str(f)
+
+        return None
+
+    @staticmethod
+    def __link__(src, dst):
+        """
+        Link dst to the content of src: hard link, or reflink (copy on write) or copy
+        if the files are on different file systems.
+        """
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            try:
+                FICLONE = 0x40049409  # linux/fs.h
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            except OSError:
+                shutil.copyfileobj(s, d)
+
+    def store(self, m, db, stub=False, source=None, content=None):
+        """
+        Store message in local store, with `stub` only the headers of a message in
+        'metadata' format are stored. With `source` the content is linked from that
+        file (see `find_copy`), and with `content` it is given, rather than taken
+        from m.
+        """
+
+        gid = m["id"]
+        if source is None and content is None:
+            content = self.make_stub(m) if stub else self.__decode_raw__(m)
+
         labels = m.get("labelIds", [])
 
         bname = self.__make_maildir_name__(gid, labels)
 
+        maildir = self.maildir(gid)
+
         # add to cache
-        self.files.append(os.path.join("cur", bname))
-        self.gids[gid] = os.path.join("cur", bname)
+        self.files.append(os.path.join(maildir, "cur", bname))
+        self.gids[gid] = os.path.join(maildir, "cur", bname)
 
-        p = os.path.join(self.md, "cur", bname)
-        tmp_p = os.path.join(self.md, "tmp", bname)
+        p = os.path.join(self.md, maildir, "cur", bname)
+        tmp_p = os.path.join(self.md, maildir, "tmp", bname)
+
+        if maildir and not self.dry_run:
+            self.make_maildir(maildir)
 
         if os.path.exists(p):
             raise Local.RepositoryException("local file already exists: %s" % p)
@@ -624,27 +1046,131 @@ class Local:
             )
 
         if not self.dry_run:
-            with open(tmp_p, "wb") as fd:
-                fd.write(msg_str)
+            if source is None:
+                with open(tmp_p, "wb") as fd:
+                    fd.write(content)
 
-            # Set atime and mtime of the message file to Gmail receive date
-            internalDate = int(m["internalDate"]) / 1000  # ms to s
-            os.utime(tmp_p, (internalDate, internalDate))
+                # Set atime and mtime of the message file to Gmail receive date
+                internalDate = int(m["internalDate"]) / 1000  # ms to s
+                os.utime(tmp_p, (internalDate, internalDate))
+
+            else:
+                self.__link__(source, tmp_p)
+                self.metrics.count("messages_deduplicated")
 
             os.rename(tmp_p, p)
+            self.written(gid)
+
+        self.metrics.count("messages_stored")
 
         # add to notmuch
         self.update_tags(m, p, db)
 
+        if stub and not self.dry_run:
+            db.get(p).tags.add(self.STUB_TAG)
+            self.metrics.count("messages_stubbed")
+
+    def move(self, gid, maildir, db):
+        """
+        Move the file of message gid to maildir (relative to the mail directory),
+        keeping its name and tags. Returns whether the message was moved.
+        """
+        import notmuch2
+
+        old = self.gids[gid]
+        (sub, name) = old.split(os.sep)[-2:]
+        new = os.path.join(maildir, sub, name)
+
+        if new == old:
+            return False
+
+        self.print_changes(f"moving message: {gid}: {old} to {new}")
+
+        if not self.dry_run:
+            if maildir:
+                self.make_maildir(maildir)
+
+            old_p = os.path.join(self.md, old)
+            new_p = os.path.join(self.md, new)
+            os.rename(old_p, new_p)
+
+            # another file name of the same message
+            try:
+                db.add(new_p, sync_flags=False)
+            except notmuch2.FileNotEmailError:
+                print("%s is not an email" % new_p)
+
+            try:
+                db.get(old_p)
+                db.remove(old_p)
+            except LookupError:
+                pass
+
+            self.files.remove(old)
+            self.files.append(new)
+            self.gids[gid] = new
+            self.written(gid)
+            self.touched(old)
+
+        self.metrics.count("messages_moved")
+        return True
+
+    def hydrate(self, m, db):
+        """
+        Replace the stub of a message with its content (in 'raw' format), keeping
+        the file name and tags.
+        """
+        gid = m["id"]
+        fname = os.path.join(self.md, self.gids[gid])
+        # the tmp directory of the same maildir
+        tmp_p = os.path.join(
+            os.path.dirname(os.path.dirname(fname)), "tmp", os.path.basename(fname)
+        )
+
+        nmsg = db.get(fname)
+        tags = set(nmsg.tags) - {self.STUB_TAG}
+
+        self.print_changes(f"hydrating message: {gid}: {fname}")
+
+        if not self.dry_run:
+            with open(tmp_p, "wb") as fd:
+                fd.write(self.__decode_raw__(m))
+
+            internalDate = int(m["internalDate"]) / 1000  # ms to s
+            os.utime(tmp_p, (internalDate, internalDate))
+
+            # the content is swapped in place, keeping the file name
+            os.rename(tmp_p, fname)
+
+            # only this file name is indexed again. the message is kept if it has
+            # other file names (e.g. linked from another repository), otherwise it
+            # is added again and gets its tags back.
+            with db.atomic():
+                kept = db.remove(fname)
+                (nmsg, _) = db.add(fname, sync_flags=False)
+
+                with nmsg.frozen():
+                    if not kept:
+                        for t in tags:
+                            nmsg.tags.add(t)
+                    nmsg.tags.discard(self.STUB_TAG)
+
+            self.__update_cache__(nmsg, (gid, fname))
+            self.written(gid)
+
+        self.metrics.count("messages_hydrated")
+
     def update_tags(self, m, fname, db):
+        import notmuch2
+
         # make sure notmuch tags reflect gmail labels
         gid = m["id"]
         glabels = m.get("labelIds", [])
 
-        # translate labels. Remote.get_labels () must have been called first
+        # translate labels
         labels = []
         for l in glabels:
-            ll = self.gmailieer.remote.labels.get(l, None)
+            ll = self.gmailieer.remote.label(l)
 
             if ll is None and not self.config.drop_non_existing_label:
                 err = "error: GMail supplied a label that there exists no record for! You can `gmi set --drop-non-existing-labels` to work around the issue (https://github.com/gauteh/lieer/issues/48)"
@@ -673,7 +1199,7 @@ class Local:
 
         else:
             # new file
-            fname = os.path.join(self.md, "cur", fname)
+            fname = os.path.join(self.md, self.maildir(gid), "cur", fname)
 
         if not os.path.exists(fname):
             if not self.dry_run:
@@ -738,6 +1264,7 @@ class Local:
                 self.print_changes(
                     f"changing tags on message: {gid} from: {str(otags)} to: {str(labels)}"
                 )
+                self.metrics.count("messages_retagged")
 
                 return True
             else:
@@ -0,0 +1,169 @@
+# Copyright © 2020  Gaute Hope <eg@gaute.vetsj.com>
+#
+# This file is part of Lieer.
+#
+# Lieer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+class Metrics:
+    """
+    Timings of the phases of a run and counters of requests and changes.
+
+    Phase times are exclusive: time spent in a nested phase (e.g. writing to
+    notmuch while downloading content) is only counted for the inner phase.
+    """
+
+    # phases are also recorded in the trace, if set
+    trace = None
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = collections.defaultdict(float)
+        self.counters = collections.Counter()
+        self.stack = []
+
+        # counters may be updated from several threads
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        now = begin = time.perf_counter()
+        if self.stack:
+            (parent, started) = self.stack[-1]
+            self.phases[parent] += now - started
+
+        self.stack.append((name, now))
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            (_, started) = self.stack.pop()
+            self.phases[name] += now - started
+
+            if self.stack:
+                self.stack[-1] = (self.stack[-1][0], now)
+
+            if self.trace is not None:
+                self.trace.complete(name, "phase", begin, now)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def wrap_http(self, http):
+        """
+        Count the bytes sent and received through an httplib2.Http instance.
+        """
+        request = http.request
+
+        def _request(uri, method="GET", body=None, headers=None, *args, **kwargs):
+            (resp, content) = request(uri, method, body, headers, *args, **kwargs)
+
+            if isinstance(body, str):
+                body = body.encode()
+            self.count("bytes_out", len(body or b""))
+            self.count("bytes_in", len(content or b""))
+
+            return (resp, content)
+
+        http.request = _request
+        return http
+
+    def report(self, g, status):
+        r = {
+            "command": g.args.action,
+            "path": g.path,
+            "status": status,
+            "start": self.start,
+            "duration": time.time() - self.start,
+            "phases": dict(self.phases),
+            "counters": dict(self.counters),
+        }
+
+        if g.remote is not None:
+            r["calls"] = dict(g.remote.calls)
+            r["counters"]["quota_units"] = g.remote.quota
+
+        return r
+
+    def write_json(self, path, report):
+        with open(path, "w") as fd:
+            json.dump(report, fd, indent=2)
+            fd.write("\n")
+
+    def write_prometheus(self, path, report):
+        """
+        Write the report for the Prometheus node exporter textfile collector.
+        """
+
+        def escape(v):
+            return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        def labels(**kw):
+            kw = dict(repository=report["path"], command=report["command"], **kw)
+            return ",".join('%s="%s"' % (k, escape(v)) for k, v in kw.items())
+
+        lines = []
+
+        def metric(name, help, samples):
+            lines.append("# HELP lieer_%s %s" % (name, help))
+            lines.append("# TYPE lieer_%s gauge" % name)
+            for lbl, v in samples:
+                lines.append("lieer_%s{%s} %s" % (name, lbl, v))
+
+        metric(
+            "last_run_timestamp_seconds",
+            "Start of the last run.",
+            [(labels(), "%.3f" % report["start"])],
+        )
+        metric(
+            "last_run_duration_seconds",
+            "Duration of the last run.",
+            [(labels(), "%.3f" % report["duration"])],
+        )
+        metric(
+            "last_run_success",
+            "Whether the last run succeeded.",
+            [(labels(), int(report["status"] == "ok"))],
+        )
+        metric(
+            "phase_seconds",
+            "Time spent in each phase of the last run.",
+            [
+                (labels(phase=p), "%.3f" % t)
+                for p, t in sorted(report["phases"].items())
+            ],
+        )
+
+        for name, v in sorted(report["counters"].items()):
+            metric(name, "Counter %s of the last run." % name, [(labels(), v)])
+
+        metric(
+            "api_calls",
+            "API calls of the last run by method.",
+            [(labels(method=m), n) for m, n in sorted(report.get("calls", {}).items())],
+        )
+
+        # the collector may read the file at any time
+        tmp = path + ".tmp"
+        with open(tmp, "w") as fd:
+            fd.write("\n".join(lines) + "\n")
+        os.rename(tmp, path)
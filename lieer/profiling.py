@@ -0,0 +1,79 @@
+# Copyright © 2020  Gaute Hope <eg@gaute.vetsj.com>
+#
+# This file is part of Lieer.
+#
+# Lieer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import cProfile
+import os
+import pstats
+import sys
+
+# functions in files below this directory are our own
+LIEER_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+
+class Profile:
+    """
+    Profile a block with cProfile, write the pstats to `path` and print a summary
+    of the time spent in lieer itself and in libraries.
+
+    The stats can be inspected with e.g. `python -m pstats FILE` or snakeviz.
+    """
+
+    def __init__(self, path, top=15, file=sys.stderr):
+        self.path = path
+        self.top = top
+        self.file = file
+        self.profiler = cProfile.Profile()
+
+    def __enter__(self):
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *_):
+        self.profiler.disable()
+        self.profiler.dump_stats(self.path)
+        self.summary()
+
+    @staticmethod
+    def own(func):
+        (filename, _, _) = func
+        filename = os.path.abspath(filename)
+        return filename.startswith(LIEER_DIR) and filename != os.path.abspath(__file__)
+
+    def summary(self):
+        stats = pstats.Stats(self.profiler).stats
+
+        total = sum(tt for (_, _, tt, _, _) in stats.values())
+        own = {f: s for f, s in stats.items() if self.own(f)}
+        own_time = sum(tt for (_, _, tt, _, _) in own.values())
+
+        def p(*args):
+            print(*args, file=self.file)
+
+        p("profile: written to %s" % self.path)
+        p(
+            "profile: %.2f s total, %.2f s in lieer, %.2f s in libraries"
+            % (total, own_time, total - own_time)
+        )
+        p("profile: top %d lieer functions by cumulative time:" % self.top)
+        p("  %10s %10s %10s  %s" % ("cumtime", "tottime", "ncalls", "function"))
+
+        top = sorted(own.items(), key=lambda fs: fs[1][3], reverse=True)[: self.top]
+        for (filename, line, name), (_, nc, tt, ct, _) in top:
+            module = "lieer." + os.path.relpath(filename, LIEER_DIR)[:-3].replace(
+                os.sep, "."
+            )
+            p("  %10.3f %10.3f %10d  %s:%d(%s)" % (ct, tt, nc, module, line, name))
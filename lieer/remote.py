@@ -15,16 +15,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import collections
 import json
 import os
+import threading
 import time
 
-import googleapiclient
-from apiclient import discovery
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-
 
 class Remote:
     SCOPES = [
@@ -88,8 +84,9 @@ class Remote:
 
     ignore_labels = set()
 
-    # query to use
+    # query to use, narrowed by the scope settings
     query = "-in:chats"
+    include_spam_trash = True
 
     not_sync = {"CHAT"}
 
@@ -110,6 +107,82 @@ class Remote:
     BATCH_REQUEST_SIZE = 50
     MIN_BATCH_REQUEST_SIZE = 1
 
+    # reasons given with 403 errors when rate limited
+    RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+    ## Quota units used by each method
+    ##
+    ## * https://developers.google.com/gmail/api/reference/quota
+    QUOTA_UNITS = {
+        "gmail.users.getProfile": 1,
+        "gmail.users.labels.list": 1,
+        "gmail.users.labels.get": 1,
+        "gmail.users.labels.create": 5,
+        "gmail.users.messages.list": 5,
+        "gmail.users.messages.get": 5,
+        "gmail.users.messages.modify": 5,
+        "gmail.users.messages.send": 100,
+        "gmail.users.history.list": 2,
+        "gmail.users.threads.list": 10,
+        "gmail.users.threads.get": 10,
+    }
+
+    # label maps, loaded on first use
+    _labels = None
+    _invlabels = None
+    _scope = None
+
+    # historyId of the mailbox when the last `get_history_since` started
+    history_id = None
+
+    # sharded listing splits the dates from here (GMail was launched in April 2004),
+    # the first shard includes everything before.
+    SHARD_START = 1080777600
+
+    # messages per page when listing
+    LIST_PAGE_SIZE = 500
+
+    class Backoff:
+        """
+        Batch size and delay between batch requests. The delay is doubled when
+        requests are rate limited or fail temporarily, and the batch size is halved
+        when requests fail for other reasons. Both are restored gradually by
+        successful batches.
+        """
+
+        def __init__(self, size, min_size, max_delay):
+            self.max_size = size
+            self.min_size = min_size
+            self.max_delay = max_delay
+
+            self.size = size
+            self.delay = 0
+
+        def wait(self):
+            if self.delay:
+                print("remote: waiting %.1f seconds.." % self.delay)
+                time.sleep(self.delay)
+
+        def success(self):
+            if self.delay > 0:
+                self.delay = self.delay // 2
+                print("remote: decreasing delay to %s" % self.delay)
+
+            if self.size < self.max_size:
+                self.size = min(self.size * 2, self.max_size)
+                print("remote: increasing batch request size to: %d" % self.size)
+
+        def rate_limited(self):
+            self.delay = min(self.delay * 2 + 1, self.max_delay)
+            print("remote: user rate error, increasing delay to %s" % self.delay)
+
+        def reduce(self):
+            if self.size <= self.min_size:
+                raise Remote.BatchException("cannot reduce request any further")
+
+            self.size = max(self.size // 2, self.min_size)
+            print("remote: reducing batch request size to: %d" % self.size)
+
     class BatchException(Exception):
         pass
 
@@ -131,9 +204,52 @@ class Remote:
         self.account = g.local.config.account
         self.dry_run = g.dry_run
         self.verbose = g.verbose
+        self.metrics = g.metrics
+        self.trace = g.trace
 
         self.ignore_labels = self.gmailieer.local.config.ignore_remote_labels
 
+        config = self.gmailieer.local.config
+        self.scope_labels = config.scope_labels
+        self.scope_exclude_labels = config.scope_exclude_labels
+        self.include_spam_trash = not config.exclude_spam_trash
+        self.max_age_days = config.max_age_days
+        self.query = self.__scope_query__()
+
+        # API calls made, by method id
+        self.calls = collections.Counter()
+        self.reloaded_labels = set()
+
+        # requests may be made from several threads when listing in shards
+        self.lock = threading.Lock()
+
+    def __execute__(self, request, http=None):
+        with self.lock:
+            self.calls[request.methodId] += 1
+        self.metrics.count("requests")
+
+        if self.trace is None:
+            return request.execute(http=http)
+
+        start = self.trace.clock()
+        status = 200
+        try:
+            return request.execute(http=http)
+        except Exception as ex:
+            status = getattr(getattr(ex, "resp", None), "status", type(ex).__name__)
+            raise
+        finally:
+            self.trace.complete(
+                request.methodId, "request", start, self.trace.clock(), status=status
+            )
+
+    @property
+    def quota(self):
+        """
+        Quota units used so far
+        """
+        return sum(self.QUOTA_UNITS.get(m, 5) * n for m, n in self.calls.items())
+
     def __require_auth__(func):
         def func_wrap(self, *args, **kwargs):
             if not self.authorized:
@@ -175,54 +291,72 @@ class Remote:
 
     @__require_auth__
     def get_labels(self):
-        results = self.service.users().labels().list(userId=self.account).execute()
+        results = self.__execute__(
+            self.service.users().labels().list(userId=self.account)
+        )
         labels = results.get("labels", [])
 
-        self.labels = {}
-        self.invlabels = {}
+        self._labels = {}
+        self._invlabels = {}
+        self._scope = None
         for l in labels:
-            self.labels[l["id"]] = l["name"]
-            self.invlabels[l["name"]] = l["id"]
+            self._labels[l["id"]] = l["name"]
+            self._invlabels[l["name"]] = l["id"]
+
+        return self._labels
+
+    @property
+    def labels(self):
+        """
+        Map of label id to name
+        """
+        if self._labels is None:
+            self.get_labels()
+        return self._labels
+
+    @property
+    def invlabels(self):
+        """
+        Map of label name to id
+        """
+        if self._invlabels is None:
+            self.get_labels()
+        return self._invlabels
+
+    def label(self, lid):
+        """
+        Name of label, the labels are reloaded if the label is not known (it may
+        have been created since they were loaded). Returns None if the label does
+        not exist.
+        """
+        name = self.labels.get(lid, None)
+        if name is None and lid not in self.reloaded_labels:
+            self.reloaded_labels.add(lid)
+            self.get_labels()
+            name = self.labels.get(lid, None)
 
-        return self.labels
+        return name
 
     @__require_auth__
-    def get_current_history_id(self, start):
+    def get_current_history_id(self):
         """
         Get the current history id of the mailbox
         """
-        try:
-            results = (
-                self.service.users()
-                .history()
-                .list(userId=self.account, startHistoryId=start)
-                .execute()
-            )
-            if "historyId" in results:
-                return int(results["historyId"])
-            else:
-                raise Remote.GenericException("no historyId field returned")
-
-        except googleapiclient.errors.HttpError:
-            # this happens if the original historyId is too old,
-            # try to get last message and the historyId from it.
-            for mset in self.all_messages(1):
-                (total, mset) = mset
-                m = mset[0]
-                msg = self.get_message(m["id"])
-                return int(msg["historyId"])
+        results = self.__execute__(self.service.users().getProfile(userId=self.account))
+        return int(results["historyId"])
 
     @__require_auth__
     def is_history_id_valid(self, historyId):
         """
         Check if the historyId is valid or too old.
         """
+        import googleapiclient.errors
+
         try:
-            results = (
+            results = self.__execute__(
                 self.service.users()
                 .history()
                 .list(userId=self.account, startHistoryId=historyId)
-                .execute()
             )
             if "historyId" in results:
                 return True
@@ -238,12 +372,13 @@ class Remote:
         Get all changes since start historyId
         """
         self.__wait_delay__()
-        results = (
+        results = self.__execute__(
             self.service.users()
             .history()
             .list(userId=self.account, startHistoryId=start)
-            .execute()
         )
+        self.history_id = int(results["historyId"])
+
         if "history" in results:
             self.__request_done__(True)
             yield results["history"]
@@ -254,11 +389,10 @@ class Remote:
             pt = results["nextPageToken"]
 
             self.__wait_delay__()
-            _results = (
+            _results = self.__execute__(
                 self.service.users()
                 .history()
                 .list(userId=self.account, startHistoryId=start, pageToken=pt)
-                .execute()
             )
 
             if "history" in _results:
@@ -277,22 +411,30 @@ class Remote:
                     self.__request_done__(True)
 
     @__require_auth__
-    def all_messages(self, limit=None):
+    def all_messages(self, limit=None, label_ids=None, shards=1, before=None):
         """
-        Get a list of all messages
+        Get a list of all messages, or all messages with the labels in `label_ids`.
+        With several `shards` the messages are listed in date ranges concurrently.
+        With `before` (seconds since the epoch) only the messages up to that date are
+        listed.
         """
+        if shards > 1:
+            yield from self.__all_messages_sharded__(shards, label_ids)
+            return
+
+        q = self.query if before is None else self.__shard_query__(None, before)
 
         self.__wait_delay__()
-        results = (
+        results = self.__execute__(
             self.service.users()
             .messages()
             .list(
                 userId=self.account,
-                q=self.query,
+                q=q,
+                labelIds=label_ids,
                 maxResults=limit,
-                includeSpamTrash=True,
+                includeSpamTrash=self.include_spam_trash,
             )
-            .execute()
         )
 
         if "messages" in results:
@@ -303,17 +445,17 @@ class Remote:
 
         while "nextPageToken" in results:
             pt = results["nextPageToken"]
-            _results = (
+            _results = self.__execute__(
                 self.service.users()
                 .messages()
                 .list(
                     userId=self.account,
                     pageToken=pt,
-                    q=self.query,
+                    q=q,
+                    labelIds=label_ids,
                     maxResults=limit,
-                    includeSpamTrash=True,
+                    includeSpamTrash=self.include_spam_trash,
                 )
-                .execute()
             )
 
             if "messages" in _results:
@@ -325,155 +467,524 @@ class Remote:
                 print("remote: warning: no messages when several pages were indicated.")
                 break
 
+    def __scope_query__(self):
+        """
+        The query for the messages in the configured scope.
+        """
+
+        def label(name):
+            # spaces in label names are written as dashes in searches
+            return "label:" + name.replace(" ", "-")
+
+        q = [Remote.query]
+
+        if self.scope_labels:
+            q.append("{%s}" % " ".join(label(l) for l in sorted(self.scope_labels)))
+
+        q.extend("-" + label(l) for l in sorted(self.scope_exclude_labels))
+
+        if self.max_age_days:
+            q.append("newer_than:%dd" % self.max_age_days)
+
+        return " ".join(q)
+
+    @property
+    def scope(self):
+        """
+        The label ids of the included and excluded labels of the scope.
+        """
+        if self._scope is None:
+            for l in self.scope_labels | self.scope_exclude_labels:
+                if l not in self.invlabels:
+                    print("remote: warning: no label named '%s' in scope settings" % l)
+
+            include = {self.invlabels.get(l) for l in self.scope_labels}
+            exclude = {self.invlabels.get(l) for l in self.scope_exclude_labels}
+            self._scope = (include - {None}, exclude - {None})
+
+        return self._scope
+
+    def in_scope(self, m):
+        """
+        Whether the message (a resource with labelIds, and optionally internalDate)
+        is synchronized. Messages without labels are assumed to be in scope.
+        """
+        if "labelIds" in m:
+            labels = set(m["labelIds"])
+
+            if labels & self.not_sync:
+                return False
+
+            if not self.include_spam_trash and labels & {"SPAM", "TRASH"}:
+                return False
+
+            if self.scope_labels or self.scope_exclude_labels:
+                (include, exclude) = self.scope
+                if self.scope_labels and not labels & include:
+                    return False
+                if labels & exclude:
+                    return False
+
+        if self.max_age_days and "internalDate" in m:
+            age = time.time() - int(m["internalDate"]) / 1000
+            if age > self.max_age_days * 24 * 3600:
+                return False
+
+        return True
+
+    def __shard_query__(self, after, before):
+        """
+        Query for the messages from after to before (inclusive, seconds since the
+        epoch), either may be None for no bound.
+        """
+        q = [self.query]
+
+        # after: and before: are exclusive, neighbouring shards overlap by a second.
+        if after is not None:
+            q.append("after:%d" % (after - 1))
+        if before is not None:
+            q.append("before:%d" % (before + 1))
+
+        return " ".join(q)
+
+    def shards(self, n, label_ids=None):
+        """
+        Split the messages in up to n date ranges of roughly the same size, using the
+        resultSizeEstimate of each range. Returns a list of (after, before, estimate),
+        the first range has no lower bound and the last no upper bound so that no
+        message is left out.
+        """
+        messages = self.service.users().messages()
+        backoff = self.Backoff(1, 1, self.MAX_DELAY)
+
+        def estimate(after, before):
+            r = self.__execute_retry__(
+                messages.list(
+                    userId=self.account,
+                    q=self.__shard_query__(after, before),
+                    labelIds=label_ids,
+                    maxResults=1,
+                    includeSpamTrash=self.include_spam_trash,
+                ),
+                backoff,
+            )
+            return r.get("resultSizeEstimate", 0)
+
+        end = int(time.time()) + 24 * 3600
+        shards = [(None, None, None)]
+
+        while len(shards) < n:
+            # split the largest range that can be split in the middle
+            splittable = [
+                (e, i)
+                for i, (a, b, e) in enumerate(shards)
+                if (b or end) - (a or self.SHARD_START) > 1 and e != 0
+            ]
+            if not splittable:
+                break
+
+            (_, i) = max(splittable, key=lambda s: -1 if s[0] is None else s[0])
+            (a, b, _) = shards[i]
+            mid = ((a or self.SHARD_START) + (b or end)) // 2
+
+            shards[i : i + 1] = [(a, mid, estimate(a, mid)), (mid, b, estimate(mid, b))]
+
+        return shards
+
+    def __all_messages_sharded__(self, n, label_ids):
+        """
+        List the messages of every shard concurrently, yields pages of messages like
+        `all_messages` with the messages seen in an earlier page left out.
+        """
+        import concurrent.futures
+        import queue
+
+        shards = self.shards(n, label_ids)
+        total = sum(e or 0 for _, _, e in shards)
+        messages = self.service.users().messages()
+
+        pages = queue.Queue()
+        stop = threading.Event()
+
+        def list_shard(after, before):
+            # httplib2 connections cannot be shared between threads
+            http = self.new_http()
+            backoff = self.Backoff(1, 1, self.MAX_DELAY)
+            pt = None
+
+            while not stop.is_set():
+                r = self.__execute_retry__(
+                    messages.list(
+                        userId=self.account,
+                        pageToken=pt,
+                        q=self.__shard_query__(after, before),
+                        labelIds=label_ids,
+                        maxResults=self.LIST_PAGE_SIZE,
+                        includeSpamTrash=self.include_spam_trash,
+                    ),
+                    backoff,
+                    http,
+                )
+
+                if "messages" in r:
+                    pages.put(r["messages"])
+
+                pt = r.get("nextPageToken")
+                if pt is None:
+                    break
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(shards)) as ex:
+            futures = [ex.submit(list_shard, a, b) for a, b, _ in shards]
+
+            # a finished shard is put on the queue after its pages
+            for f in futures:
+                f.add_done_callback(pages.put)
+
+            seen = set()
+            done = 0
+            try:
+                while done < len(futures):
+                    page = pages.get()
+
+                    if isinstance(page, concurrent.futures.Future):
+                        done += 1
+                        page.result()
+                        continue
+
+                    page = [m for m in page if m["id"] not in seen]
+                    seen.update(m["id"] for m in page)
+
+                    if page:
+                        yield (total, page)
+
+            finally:
+                stop.set()
+
+    @__require_auth__
+    def all_threads(self):
+        """
+        Get a list of all threads with their historyId, in pages
+        """
+        threads = self.service.users().threads()
+        pt = None
+
+        while True:
+            results = self.__execute__(
+                threads.list(
+                    userId=self.account,
+                    pageToken=pt,
+                    q=self.query,
+                    maxResults=500,
+                    includeSpamTrash=self.include_spam_trash,
+                )
+            )
+
+            # no threads field presumably means no threads
+            if "threads" in results:
+                yield results["threads"]
+
+            pt = results.get("nextPageToken")
+            if pt is None:
+                break
+
+    @__require_auth__
+    def get_messages(self, gids, cb, format, headers=None):
+        """
+        Get the messages, cb is called with the list of messages received in each
+        batch. With the 'metadata' format only the `headers` listed are included
+        (all if None).
+        """
+        # building the resource is expensive, do it once for all requests
+        messages = self.service.users().messages()
+
+        self.__batch__(
+            gids,
+            lambda gid: messages.get(
+                userId=self.account, id=gid, format=format, metadataHeaders=headers
+            ),
+            lambda results: cb([resp for _, resp in results]),
+        )
+
+    @__require_auth__
+    def get_label_counts(self, lids, cb):
+        """
+        Get the labels with their message and thread counts, cb is called with the
+        list of labels received in each batch.
+        """
+        labels = self.service.users().labels()
+
+        self.__batch__(
+            lids,
+            lambda lid: labels.get(userId=self.account, id=lid),
+            lambda results: cb([resp for _, resp in results]),
+        )
+
     @__require_auth__
-    def get_messages(self, gids, cb, format):
+    def get_threads(self, tids, cb, format="minimal"):
         """
-        Get the messages
+        Get the threads, cb is called with the list of threads received in each
+        batch. Every thread holds its messages in the requested format, so one
+        request checks the labels of all the messages in the thread.
         """
+        threads = self.service.users().threads()
 
-        max_req = self.BATCH_REQUEST_SIZE
-        req_ok = 0
-        N = len(gids)
-        i = 0
-        j = 0
+        self.__batch__(
+            tids,
+            lambda tid: threads.get(userId=self.account, id=tid, format=format),
+            lambda results: cb([resp for _, resp in results]),
+        )
 
-        # How much to wait before contacting the remote.
-        user_rate_delay = 0
-        # How many requests with the current delay returned ok.
-        user_rate_ok = 0
+    def __batch__(self, keys, request, done, describe=str):
+        """
+        Execute requests in batches, backing off when rate limited or when requests
+        fail. Failed requests are retried in the next batch, while the successful
+        requests of a partially failed batch are kept.
+
+        keys:     unique ids of the requests
+        request:  function returning the request for a key
+        done:     called with a list of (key, response) for each batch
+        describe: function describing the request for a key in messages
+        """
+        import googleapiclient.errors
 
-        conn_errors = 0
+        backoff = self.Backoff(
+            self.BATCH_REQUEST_SIZE, self.MIN_BATCH_REQUEST_SIZE, self.MAX_DELAY
+        )
+        pending = collections.deque(keys)
+        failures = 0
+
+        # for tracing: the status of each request in the current batch, and the
+        # number of times each request has been retried
+        trace = self.trace
+        statuses = {}
+        attempts = collections.Counter()
+
+        while pending:
+            results = []
+            retry = []
+            rate_limited = False
+            failed = False
+            # server or connection errors, as opposed to only rate limiting
+            broken = False
+            error = None
+
+            def _cb(rid, resp, excep):
+                nonlocal rate_limited, failed, broken
+                statuses[rid] = (
+                    200
+                    if excep is None
+                    else getattr(getattr(excep, "resp", None), "status", None)
+                )
 
-        msg_batch = (
-            []
-        )  # queue up received batch and send in one go to content / db routine
+                if excep is None:
+                    results.append((rid, resp))
 
-        def _cb(rid, resp, excep):
-            nonlocal j, msg_batch
-            if excep is not None:
-                if (
-                    type(excep) is googleapiclient.errors.HttpError
+                elif (
+                    isinstance(excep, googleapiclient.errors.HttpError)
                     and excep.resp.status == 404
                 ):
                     # message could not be found this is probably a deleted message, spam or draft
                     # message since these are not included in the messages.get() query by default.
-                    print("remote: could not find remote message: %s!" % gids[j])
-                    j += 1
-                    return
+                    print("remote: could not find remote message: %s!" % describe(rid))
 
                 elif (
-                    type(excep) is googleapiclient.errors.HttpError
+                    isinstance(excep, googleapiclient.errors.HttpError)
                     and excep.resp.status == 400
                 ):
                     # message id invalid, probably caused by stray files in the mail repo
                     print(
                         "remote: message id: %s is invalid! are there any non-lieer files created in the lieer repository?"
-                        % gids[j]
+                        % describe(rid)
                     )
-                    j += 1
-                    return
 
-                elif (
-                    type(excep) is googleapiclient.errors.HttpError
-                    and excep.resp.status == 403
-                ):
-                    raise Remote.UserRateException(excep)
+                elif isinstance(
+                    excep, googleapiclient.errors.HttpError
+                ) and self.__retryable__(excep):
+                    self.__count_error__(excep)
+                    retry.append(rid)
+                    rate_limited = True
+                    broken = broken or excep.resp.status >= 500
 
                 else:
-                    raise Remote.BatchException(excep)
-            else:
-                j += 1
-
-            msg_batch.append(resp)
+                    self.metrics.count("errors")
+                    if self.verbose:
+                        print("remote: request failed: %s" % excep)
+                    retry.append(rid)
+                    failed = broken = True
 
-        while i < N:
-            n = 0
-            j = i
             batch = self.service.new_batch_http_request(callback=_cb)
-
-            while n < max_req and i < N:
-                gid = gids[i]
-                batch.add(
-                    self.service.users()
-                    .messages()
-                    .get(userId=self.account, id=gid, format=format)
+            keys = [pending.popleft() for _ in range(min(backoff.size, len(pending)))]
+            for k in keys:
+                r = request(k)
+                self.calls[r.methodId] += 1
+                batch.add(r, request_id=k)
+
+            self.metrics.count("requests")
+            self.metrics.count("sub_requests", len(keys))
+
+            if trace is not None and backoff.delay:
+                start = trace.clock()
+                backoff.wait()
+                trace.complete(
+                    "sleep", "backoff", start, trace.clock(), delay=backoff.delay
                 )
-                n += 1
-                i += 1
-
-            # we wait if there is a user_rate_delay
-            if user_rate_delay:
-                print("remote: waiting %.1f seconds.." % user_rate_delay)
-                time.sleep(user_rate_delay)
+            else:
+                backoff.wait()
 
+            start = trace.clock() if trace is not None else None
             try:
                 batch.execute()
 
-                # gradually reduce user delay upon every ok batch
-                user_rate_ok += 1
-                if user_rate_delay > 0 and user_rate_ok > 0:
-                    user_rate_delay = user_rate_delay // 2
-                    print("remote: decreasing delay to %s" % user_rate_delay)
-                    user_rate_ok = 0
-
-                # gradually increase batch request size upon every ok request
-                req_ok += 1
-                if max_req < self.BATCH_REQUEST_SIZE and req_ok > 0:
-                    max_req = min(max_req * 2, self.BATCH_REQUEST_SIZE)
-                    print("remote: increasing batch request size to: %d" % max_req)
-                    req_ok = 0
+            except googleapiclient.errors.HttpError as excep:
+                # the whole batch request failed
+                if not self.__retryable__(excep):
+                    raise
+                self.__count_error__(excep)
+                print("remote: batch request failed: %s" % excep.resp.status)
+                retry = keys
+                rate_limited = True
+                broken = excep.resp.status >= 500
+                error = excep.resp.status
 
-                conn_errors = 0
+            except ConnectionError as ex:
+                self.metrics.count("connection_errors")
+                print("connection failed, re-trying:", ex)
+                retry = keys
+                rate_limited = broken = True
+                error = type(ex).__name__
 
-            except Remote.UserRateException:
-                user_rate_delay = user_rate_delay * 2 + 1
-                print(
-                    "remote: user rate error, increasing delay to %s" % user_rate_delay
-                )
-                user_rate_ok = 0
+            finally:
+                if trace is not None:
+                    trace.batch(
+                        start,
+                        trace.clock(),
+                        r.methodId,
+                        keys,
+                        statuses,
+                        attempts,
+                        error,
+                        describe,
+                    )
+                    statuses.clear()
 
-                i = j  # reset
+                # handle batch
+                if len(results) > 0:
+                    if trace is not None:
+                        start = trace.clock()
+                        done(results)
+                        trace.complete(
+                            "callback",
+                            "callback",
+                            start,
+                            trace.clock(),
+                            size=len(results),
+                        )
+                    else:
+                        done(results)
+
+            if not retry:
+                backoff.success()
+                failures = 0
+                continue
+
+            # rate limiting is waited out however long it lasts
+            if broken:
+                failures += 1
+            if failures > self.MAX_CONNECTION_ERRORS:
+                print("remote: too many failed batch requests")
+                raise Remote.BatchException("too many failed batch requests")
+
+            # retry the failed requests first
+            pending.extendleft(reversed(retry))
+            self.metrics.count("retries", len(retry))
+            attempts.update(retry)
+
+            if failed:
+                backoff.reduce()
+            if rate_limited:
+                backoff.rate_limited()
+
+    def __execute_retry__(self, request, backoff, http=None):
+        """
+        Execute a single request, backing off and retrying it when rate limited,
+        when the server fails temporarily or the connection fails, like the
+        requests of `__batch__`.
+        """
+        import googleapiclient.errors
 
-            except Remote.BatchException:
-                max_req = max_req // 2
-                req_ok = 0
+        failures = 0
+        while True:
+            backoff.wait()
+            try:
+                r = self.__execute__(request, http)
 
-                if max_req >= self.MIN_BATCH_REQUEST_SIZE:
-                    i = j  # reset
-                    print("remote: reducing batch request size to: %d" % max_req)
-                else:
-                    max_req = self.MIN_BATCH_REQUEST_SIZE
-                    raise Remote.BatchException("cannot reduce request any further")
+            except googleapiclient.errors.HttpError as excep:
+                if not self.__retryable__(excep):
+                    raise
+                self.__count_error__(excep)
+                print("remote: request failed: %s" % excep.resp.status)
+                if excep.resp.status >= 500:
+                    failures += 1
 
             except ConnectionError as ex:
+                self.metrics.count("connection_errors")
                 print("connection failed, re-trying:", ex)
-                i = j  # reset
-                conn_errors += 1
+                failures += 1
 
-                if conn_errors > self.MAX_CONNECTION_ERRORS:
-                    print("too many connection errors")
-                    raise
+            else:
+                backoff.success()
+                return r
+
+            if failures > self.MAX_CONNECTION_ERRORS:
+                print("remote: too many failed requests")
+                raise Remote.BatchException("too many failed requests")
+
+            self.metrics.count("retries")
+            backoff.rate_limited()
+
+    def __count_error__(self, excep):
+        status = excep.resp.status
+        if status in (403, 429):
+            self.metrics.count("rate_limited")
+        elif status >= 500:
+            self.metrics.count("server_errors")
+        else:
+            self.metrics.count("errors")
 
-                time.sleep(1)
+    @staticmethod
+    def __retryable__(excep):
+        """
+        Whether a failed request should be retried after backing off: rate limiting
+        (403 and 429) and server errors.
+        """
+        status = excep.resp.status
 
-            finally:
-                # handle batch
-                if len(msg_batch) > 0:
-                    cb(msg_batch)
-                    msg_batch.clear()
+        if status == 403:
+            # a 403 without details is assumed to be rate limiting
+            details = getattr(excep, "error_details", None)
+            if not isinstance(details, list) or not details:
+                return True
+
+            return any(
+                isinstance(d, dict) and d.get("reason") in Remote.RATE_LIMIT_REASONS
+                for d in details
+            )
+
+        return status == 429 or status >= 500
 
     @__require_auth__
     def get_message(self, gid, format="minimal"):
         """
         Get a single message
         """
+        import googleapiclient.errors
+
         self.__wait_delay__()
         try:
-            result = (
+            result = self.__execute__(
                 self.service.users()
                 .messages()
                 .get(userId=self.account, id=gid, format=format)
-                .execute()
             )
 
         except googleapiclient.errors.HttpError as excep:
@@ -488,6 +999,8 @@ class Remote:
         return result
 
     def authorize(self, reauth=False):
+        from apiclient import discovery
+
         if reauth:
             credential_path = self.gmailieer.local.credentials_f
             if os.path.exists(credential_path):
@@ -496,12 +1009,25 @@ class Remote:
 
         self.credentials = self.__get_credentials__()
 
+        self.service = discovery.build("gmail", "v1", http=self.new_http())
+        self.authorized = True
+
+    def new_http(self):
+        """
+        A new authorized connection to GMail.
+        """
+        import google_auth_httplib2
+        from googleapiclient.http import build_http
+
         timeout = self.gmailieer.local.config.timeout
         if timeout == 0:
             timeout = None
 
-        self.service = discovery.build("gmail", "v1", credentials=self.credentials)
-        self.authorized = True
+        http = build_http()
+        http.timeout = timeout
+        return google_auth_httplib2.AuthorizedHttp(
+            self.credentials, http=self.metrics.wrap_http(http)
+        )
 
     def __store_credentials__(self, path, credentials):
         """
@@ -535,6 +1061,10 @@ class Remote:
         Returns:
             Credentials, the obtained credential.
         """
+        from google.auth.transport.requests import Request
+        from google.oauth2.credentials import Credentials
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
         credentials = None
         credential_path = self.gmailieer.local.credentials_f
 
@@ -619,10 +1149,10 @@ class Remote:
 
         glabels = gmsg.get("labelIds", [])
 
-        # translate labels. Remote.get_labels () must have been called first
+        # translate labels
         labels = []
         for l in glabels:
-            ll = self.labels.get(l, None)
+            ll = self.label(l)
 
             if ll is None and not self.gmailieer.local.config.drop_non_existing_label:
                 err = "error: GMail supplied a label that there exists no record for! You can `gmi set --drop-non-existing-labels` to work around the issue (https://github.com/gauteh/lieer/issues/48)"
@@ -732,97 +1262,19 @@ class Remote:
     @__require_auth__
     def push_changes(self, actions, cb):
         """
-        Push label changes
+        Push label changes, cb is called with the response for every change.
         """
-        max_req = self.BATCH_REQUEST_SIZE
-        N = len(actions)
-        i = 0
-        j = 0
-
-        # How much to wait before contacting the remote.
-        user_rate_delay = 0
-        # How many requests with the current delay returned ok.
-        user_rate_ok = 0
-
-        def _cb(rid, resp, excep):
-            nonlocal j
-            if excep is not None:
-                if (
-                    type(excep) is googleapiclient.errors.HttpError
-                    and excep.resp.status == 404
-                ):
-                    # message could not be found this is probably a deleted message, spam or draft
-                    # message since these are not included in the messages.get() query by default.
-                    print("remote: could not find remote message: %s!" % resp)
-                    j += 1
-                    return
-
-                elif (
-                    type(excep) is googleapiclient.errors.HttpError
-                    and excep.resp.status == 400
-                ):
-                    # message id invalid, probably caused by stray files in the mail repo
-                    print(
-                        "remote: message id is invalid! are there any non-lieer files created in the lieer repository? %s"
-                        % resp
-                    )
-                    j += 1
-                    return
-
-                elif (
-                    type(excep) is googleapiclient.errors.HttpError
-                    and excep.resp.status == 403
-                ):
-                    raise Remote.UserRateException(excep)
-
-                else:
-                    raise Remote.BatchException(excep)
-            else:
-                j += 1
-
-            cb(resp)
-
-        while i < N:
-            n = 0
-            j = i
-            batch = self.service.new_batch_http_request(callback=_cb)
-
-            while n < max_req and i < N:
-                a = actions[i]
-                batch.add(a)
-                n += 1
-                i += 1
 
-            # we wait if there is a user_rate_delay
-            if user_rate_delay:
-                print("remote: waiting %.1f seconds.." % user_rate_delay)
-                time.sleep(user_rate_delay)
+        def _done(results):
+            for _, resp in results:
+                cb(resp)
 
-            try:
-                batch.execute()
-
-                # gradually reduce if we had 10 ok batches
-                user_rate_ok += 1
-                if user_rate_ok > 10:
-                    user_rate_delay = user_rate_delay // 2
-                    user_rate_ok = 0
-
-            except Remote.UserRateException:
-                user_rate_delay = user_rate_delay * 2 + 1
-                print(
-                    "remote: user rate error, increasing delay to %s" % user_rate_delay
-                )
-                user_rate_ok = 0
-
-                i = j  # reset
-
-            except Remote.BatchException:
-                if max_req > self.MIN_BATCH_REQUEST_SIZE:
-                    max_req = max_req / 2
-                    i = j  # reset
-                    print("reducing batch request size to: %d" % max_req)
-                else:
-                    raise Remote.BatchException("cannot reduce request any further")
+        self.__batch__(
+            [str(i) for i in range(len(actions))],
+            lambda i: actions[int(i)],
+            _done,
+            lambda i: actions[int(i)].uri,
+        )
 
     @__require_auth__
     def __create_label__(self, l):
@@ -834,6 +1286,7 @@ class Remote:
           (labelId, label)
 
         """
+        import googleapiclient.errors
 
         print("push: creating label: %s.." % l)
 
@@ -846,11 +1299,10 @@ class Remote:
         if not self.dry_run:
             self.__wait_delay__()
             try:
-                lr = (
+                lr = self.__execute__(
                     self.service.users()
                     .labels()
                     .create(userId=self.account, body=label)
-                    .execute()
                 )
 
                 return (lr["id"], l)
@@ -859,6 +1311,13 @@ class Remote:
                 if excep.resp.status == 403 or excep.resp.status == 500:
                     self.__request_done__(False)
                     return self.__create_label__(l)
+                elif excep.resp.status == 409:
+                    # created since the labels were loaded (e.g. by another client)
+                    self.get_labels()
+                    lid = self.invlabels.get(l, None)
+                    if lid is None:
+                        raise
+                    return (lid, l)
                 else:
                     raise
 
@@ -885,11 +1344,8 @@ class Remote:
         if threadId is not None:
             message["threadId"] = threadId
 
-        return (
-            self.service.users()
-            .messages()
-            .send(userId=self.account, body=message)
-            .execute()
+        return self.__execute__(
+            self.service.users().messages().send(userId=self.account, body=message)
         )
 
     def print_changes(self, changes):
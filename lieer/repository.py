@@ -0,0 +1,176 @@
+# Copyright © 2020  Gaute Hope <eg@gaute.vetsj.com>
+#
+# This file is part of Lieer.
+#
+# Lieer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+from types import SimpleNamespace
+
+from .gmailieer import Gmailieer
+
+
+class Repository:
+    """
+    A local repository, for using lieer as a library:
+
+      with Repository("~/.mail/account.gmail") as r:
+          r.pull()
+          r.push()
+
+    The repository is loaded and locked when constructed, and the local cache,
+    label map and connection to GMail are kept for the lifetime of the object.
+    Several repositories can be held in the same process and used from different
+    threads (one thread per repository at a time), pass the same `write_lock`
+    (e.g. a `threading.Lock`) to repositories sharing a notmuch database.
+    """
+
+    def __init__(
+        self,
+        path,
+        credentials=None,
+        dry_run=False,
+        verbose=False,
+        quiet=True,
+        progress=False,
+        block=False,
+        write_lock=None,
+    ):
+        self.gmailieer = Gmailieer()
+        self.gmailieer.write_lock = write_lock
+
+        # the options that would otherwise have come from the command line
+        self.args = SimpleNamespace(
+            action=None,
+            path=path,
+            credentials=credentials,
+            dry_run=dry_run,
+            verbose=verbose,
+            quiet=quiet,
+            no_progress=quiet or not progress,
+        )
+        self.gmailieer.args = self.args
+
+        self.gmailieer.setup(self.args, dry_run, True, block)
+        self.local = self.gmailieer.local
+        self.remote = self.gmailieer.remote
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """
+        Release the repository lock
+        """
+        if self.local.lckf is not None:
+            self.local.unlock()
+
+    def labels(self):
+        """
+        Remote labels, as a map of label id to name
+        """
+        return dict(self.remote.get_labels())
+
+    def pull(
+        self, force=False, limit=None, resume=False, list_shards=1, recent_first=None
+    ):
+        g = self.gmailieer
+        g.force = force
+        g.limit = limit
+        g.resume = resume
+        g.list_shards = list_shards
+        g.recent_first = recent_first
+        g.list_labels = False
+
+        g.pull(self.args, True)
+
+    def push(self, force=False, limit=None):
+        g = self.gmailieer
+        g.force = force
+        g.limit = limit
+
+        g.push(self.args, True)
+
+    def backfill(self, limit=None):
+        """
+        Fetch older messages after a pull with `recent_first`, like `gmi backfill`
+        """
+        g = self.gmailieer
+        g.limit = limit
+
+        g.backfill(self.args, True)
+
+    def hydrate(self, query):
+        """
+        Fetch the content of the messages matching the notmuch query that are stored
+        as headers only, like `gmi hydrate`
+        """
+        self.gmailieer.query = query
+        self.gmailieer.hydrate(self.args, True)
+
+    def import_takeout(self, mbox):
+        """
+        Store the messages of a Google Takeout mbox before the initial pull, like
+        `gmi import-takeout`
+        """
+        self.gmailieer.mbox = mbox
+        self.gmailieer.import_takeout(self.args, True)
+
+    def export(self, archive):
+        """
+        Write an archive of the repository, like `gmi export`
+        """
+        self.gmailieer.archive = archive
+        self.gmailieer.export(self.args, True)
+
+    @classmethod
+    def import_archive(cls, archive, path, **kwargs):
+        """
+        Set up a repository at path from an archive made by `export`, like `gmi
+        import` but without pulling the changes since the export (use `pull`). The
+        keyword arguments are passed on to the constructor.
+        """
+        from .archive import Archive
+
+        path = os.path.expanduser(path)
+        os.makedirs(path, exist_ok=True)
+        tags = Archive(archive).extract(path)
+
+        repo = cls(path, **kwargs)
+        repo.gmailieer.register(tags)
+        return repo
+
+    def migrate_layout(self, layout):
+        """
+        Move the messages to another maildir layout ('flat' or 'sharded'), like `gmi
+        migrate-layout`
+        """
+        self.gmailieer.layout = layout
+        self.gmailieer.migrate_layout(self.args, True)
+
+    def reconcile(self):
+        """
+        Fix the labels whose message count differs locally, like `gmi reconcile`
+        """
+        self.gmailieer.reconcile(self.args, True)
+
+    def sync(self, force=False, limit=None, resume=False, list_shards=1):
+        """
+        Push local changes and pull remote changes, like `gmi sync`
+        """
+        self.push(force, limit)
+        self.pull(force, limit, resume, list_shards)
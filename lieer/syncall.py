@@ -0,0 +1,161 @@
+# Copyright © 2020  Gaute Hope <eg@gaute.vetsj.com>
+#
+# This file is part of Lieer.
+#
+# Lieer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import concurrent.futures
+import glob
+import hashlib
+import os
+import tempfile
+import time
+
+import notmuch2
+
+from .local import Local
+
+
+def sync_one(path, argv, write_lock):
+    """
+    Synchronize a single repository, run in a worker process of `SyncAll`.
+
+    Returns:
+      (path, error, duration), error is None if the synchronization succeeded.
+    """
+    from .gmailieer import Gmailieer
+
+    start = time.perf_counter()
+    error = None
+
+    g = Gmailieer()
+    g.write_lock = write_lock
+    try:
+        g.main(["sync", "-C", path, *argv])
+    except SystemExit as ex:
+        if ex.code:
+            error = "exited with status %s" % ex.code
+    except Exception as ex:
+        error = "%s: %s" % (type(ex).__name__, ex)
+    finally:
+        # make sure the repository lock is released before the next task in
+        # this worker, the Gmailieer instance may not be freed right away.
+        local = getattr(g, "local", None)
+        if local is not None and local.lckf is not None:
+            local.unlock()
+
+    return (path, error, time.perf_counter() - start)
+
+
+class SyncAll:
+    """
+    Synchronize several repositories concurrently.
+
+    Each repository is synchronized in a worker process, so that the network
+    bound parts run in parallel. Writes to the notmuch database are serialized
+    through a shared write lock.
+    """
+
+    # repositories where mail has arrived within this period count as active
+    ACTIVE_PERIOD = 24 * 60 * 60
+
+    def __init__(self, g, paths, jobs=None):
+        self.gmailieer = g
+        self.paths = [os.path.abspath(os.path.expanduser(p)) for p in paths]
+        self.jobs = jobs or min(len(self.paths), 4)
+
+    @staticmethod
+    def default_write_lock():
+        """
+        A lock file shared by all gmi instances writing to the default notmuch database.
+        """
+        with notmuch2.Database() as db:
+            key = hashlib.sha1(str(db.path).encode()).hexdigest()[:12]  # noqa: S324
+
+        return os.path.join(
+            tempfile.gettempdir(), "gmi-%d-%s.write.lock" % (os.getuid(), key)
+        )
+
+    def priority(self, path):
+        """
+        Sort key: recently active repositories first, then the ones that have gone
+        the longest without a synchronization.
+        """
+        now = time.time()
+
+        def mtime(f):
+            try:
+                return os.stat(f).st_mtime
+            except OSError:
+                return 0
+
+        last_sync = mtime(os.path.join(path, ".state.gmailieer.json"))
+        # the maildir, or the maildirs of the sharded layout
+        last_mail = max(
+            mtime(d)
+            for d in [
+                os.path.join(path, "mail", "cur"),
+                *glob.glob(os.path.join(path, "mail", "[0-9a-f][0-9a-f]", "cur")),
+            ]
+        )
+
+        active = (now - last_mail) < self.ACTIVE_PERIOD
+        return (not active, last_sync)
+
+    def run(self, argv, write_lock=None):
+        """
+        Synchronize all repositories, `argv` is passed on to `gmi sync`.
+
+        Returns:
+          list of (path, error, duration) in the order the repositories finished.
+        """
+        if write_lock is None:
+            write_lock = self.default_write_lock()
+
+        paths = sorted(self.paths, key=self.priority)
+        for p in paths:
+            if not os.path.exists(os.path.join(p, ".gmailieer.json")):
+                raise Local.RepositoryException(
+                    "%s: local repository not initialized" % p
+                )
+
+        results = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs) as pool:
+            futures = [pool.submit(sync_one, p, argv, write_lock) for p in paths]
+
+            for f in concurrent.futures.as_completed(futures):
+                r = f.result()
+                results.append(r)
+
+                (path, error, duration) = r
+                if error is None:
+                    self.gmailieer.vprint(
+                        "sync-all: %s: done (%.1f s)" % (path, duration)
+                    )
+                else:
+                    print("sync-all: %s: failed: %s" % (path, error))
+
+        return results
+
+    def summary(self, results, wall):
+        failed = [r for r in results if r[1] is not None]
+        total = sum(r[2] for r in results)
+
+        print(
+            "sync-all: %d repositories synchronized, %d failed, in %.1f s (%.1f s serial time)"
+            % (len(results) - len(failed), len(failed), wall, total)
+        )
+
+        for path, error, _ in failed:
+            print("  %s: %s" % (path, error))
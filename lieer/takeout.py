@@ -0,0 +1,201 @@
+# Copyright © 2020  Gaute Hope <eg@gaute.vetsj.com>
+#
+# This file is part of Lieer.
+#
+# Lieer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import collections
+import csv
+import datetime
+import email.header
+import email.parser
+import email.utils
+import os
+import re
+
+
+class Takeout:
+    """
+    The messages of a Google Takeout mbox. Each message starts with a line like:
+
+      From 1597428924817653467@xxx Thu Apr 16 09:18:58 +0000 2020
+
+    with the GMail message id in decimal, the thread id is in the X-GM-THRID header
+    and the label names in X-Gmail-Labels. Lines in the content starting with
+    'From ' are escaped with '>' (mboxrd).
+    """
+
+    # GMail label ids of the label names in X-Gmail-Labels
+    SYSTEM_LABELS = {
+        "Inbox": "INBOX",
+        "Sent": "SENT",
+        "Unread": "UNREAD",
+        "Starred": "STARRED",
+        "Important": "IMPORTANT",
+        "Spam": "SPAM",
+        "Trash": "TRASH",
+        "Draft": "DRAFT",
+        "Drafts": "DRAFT",
+        "Chat": "CHAT",
+        "Category Personal": "CATEGORY_PERSONAL",
+        "Category Social": "CATEGORY_SOCIAL",
+        "Category Promotions": "CATEGORY_PROMOTIONS",
+        "Category Updates": "CATEGORY_UPDATES",
+        "Category Forums": "CATEGORY_FORUMS",
+    }
+
+    # names in X-Gmail-Labels that are not labels
+    NOT_LABELS = {"Opened", "Archived"}
+
+    TAKEOUT_HEADERS = (b"x-gm-thrid:", b"x-gmail-labels:")
+
+    SEPARATOR = re.compile(rb"^From (\d+)@xxx (.*)$")
+    ESCAPED = re.compile(rb"^>+From ")
+
+    def __init__(self, mbox, invlabels):
+        """
+        mbox:       path to the mbox
+        invlabels:  map of label name to id of the account
+        """
+        self.mbox = mbox
+        self.size = os.path.getsize(mbox)
+        self.invlabels = invlabels
+
+        # number of messages with each label name that is not a label of the account
+        self.unknown = collections.Counter()
+
+    def __iter__(self):
+        """
+        Yields a tuple of the message (as a GMail resource, without content) and its
+        content, one message at a time.
+        """
+        with open(self.mbox, "rb") as fd:
+            separator = None
+            lines = []
+
+            for line in fd:
+                if self.separates(line, separator, lines):
+                    if separator is not None:
+                        yield self.message(separator, lines)
+
+                    separator = line
+                    lines = []
+
+                elif self.ESCAPED.match(line):
+                    lines.append(line[1:])
+
+                else:
+                    lines.append(line)
+
+            if separator is not None:
+                yield self.message(separator, lines)
+
+    def separates(self, line, separator, lines):
+        """
+        Whether line is the separator of the next message: a line in the Takeout
+        format after an empty line. Lines of the body that start with "From " are
+        not always escaped. The first line is the separator of the first message,
+        and is checked by `message`.
+        """
+        if separator is None:
+            return line.startswith(b"From ")
+
+        if lines and lines[-1].strip():
+            return False
+
+        return self.SEPARATOR.match(line.rstrip()) is not None
+
+    def message(self, separator, lines):
+        content = b"".join(lines)
+
+        # messages from GMail have windows line endings
+        if os.linesep == "\n":
+            content = content.replace(b"\r\n", b"\n")
+
+        # the empty line before the next separator
+        if content.endswith(b"\n\n"):
+            content = content[:-1]
+
+        match = self.SEPARATOR.match(separator.rstrip())
+        if match is None:
+            raise ValueError(
+                "not a Google Takeout mbox, unexpected separator: %s"
+                % separator.decode("ascii", "replace").rstrip()
+            )
+
+        (head, sep, body) = content.partition(b"\n\n")
+        headers = email.parser.BytesHeaderParser().parsebytes(head + b"\n\n")
+
+        # the headers added by the Takeout, the labels are only valid at the time of
+        # the Takeout.
+        kept = []
+        skip = False
+        for line in head.splitlines(keepends=True):
+            if not line.startswith((b" ", b"\t")):
+                skip = line.lower().startswith(self.TAKEOUT_HEADERS)
+            if not skip:
+                kept.append(line)
+        content = b"".join(kept) + sep + body
+
+        m = {
+            "id": "%x" % int(match.group(1)),
+            "internalDate": str(int(self.date(match.group(2), headers) * 1000)),
+            "sizeEstimate": len(content),
+            "labelIds": self.label_ids(headers.get("X-Gmail-Labels", "")),
+        }
+
+        thread = headers.get("X-GM-THRID")
+        m["threadId"] = "%x" % int(thread) if thread else m["id"]
+
+        return (m, content)
+
+    @staticmethod
+    def date(date, headers):
+        """
+        Time the message was received in seconds, from the separator or else the
+        Date header.
+        """
+        try:
+            return datetime.datetime.strptime(
+                date.decode("ascii"), "%a %b %d %H:%M:%S %z %Y"
+            ).timestamp()
+        except ValueError:
+            pass
+
+        try:
+            return email.utils.parsedate_to_datetime(headers["Date"]).timestamp()
+        except (TypeError, ValueError):
+            return 0
+
+    def label_ids(self, value):
+        """
+        The label ids of an X-Gmail-Labels header, a comma separated list of label
+        names (quoted if they contain a comma).
+        """
+        value = re.sub(r"\r?\n", "", value)  # unfold
+        value = str(email.header.make_header(email.header.decode_header(value)))
+
+        ids = []
+        for name in next(csv.reader([value], skipinitialspace=True), []):
+            if not name or name in self.NOT_LABELS:
+                continue
+
+            lid = self.SYSTEM_LABELS.get(name, self.invlabels.get(name))
+            if lid is None:
+                self.unknown[name] += 1
+            else:
+                ids.append(lid)
+
+        return ids
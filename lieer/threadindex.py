@@ -0,0 +1,74 @@
+# Copyright © 2020  Gaute Hope <eg@gaute.vetsj.com>
+#
+# This file is part of Lieer.
+#
+# Lieer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import tempfile
+
+
+class ThreadIndex:
+    """
+    The historyId of every thread at the last full pull. A thread whose historyId
+    is unchanged has not changed since, so a full pull recovering from an expired
+    history only needs to check the labels of messages in changed threads.
+    """
+
+    VERSION = 1
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.threads = {}
+
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file) as fd:
+                    j = json.load(fd)
+
+                if j["version"] == self.VERSION:
+                    self.threads = j["threads"]
+                else:
+                    print(
+                        "warning: mismatching version in thread index, ignoring: %d != %d"
+                        % (j["version"], self.VERSION)
+                    )
+
+            except (ValueError, KeyError, TypeError):
+                print("warning: failed to read thread index, ignoring.")
+
+    def __len__(self):
+        return len(self.threads)
+
+    def changed(self, tid, history_id):
+        """
+        Whether the thread has changed since the index was saved, threads that are
+        not in the index are always changed.
+        """
+        return history_id is None or self.threads.get(tid) != str(history_id)
+
+    def save(self, threads):
+        """
+        threads: map of thread id to historyId
+        """
+        self.threads = {t: str(h) for t, h in threads.items()}
+
+        j = {"version": self.VERSION, "threads": self.threads}
+
+        with tempfile.NamedTemporaryFile(
+            mode="w+", dir=os.path.dirname(self.index_file), delete=False
+        ) as fd:
+            json.dump(j, fd)
+            os.rename(fd.name, self.index_file)
@@ -0,0 +1,92 @@
+# Copyright © 2020  Gaute Hope <eg@gaute.vetsj.com>
+#
+# This file is part of Lieer.
+#
+# Lieer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import threading
+import time
+
+
+class Trace:
+    """
+    Writes a trace of requests, backoff sleeps, callbacks and phases in the Chrome
+    trace event format, which can be loaded in e.g. https://ui.perfetto.dev or
+    chrome://tracing.
+
+    The file starts with '[' and has one event per line, each followed by a ',',
+    so it can also be read line by line and is usable even if gmi is interrupted.
+    """
+
+    def __init__(self, path):
+        self.fd = open(path, "w")  # noqa: SIM115
+        self.fd.write("[\n")
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def clock(self):
+        return time.perf_counter()
+
+    def complete(self, name, cat, start, end, **args):
+        """
+        Record an event from start to end (as returned by `clock`).
+        """
+        e = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": round((start - self.origin) * 1e6, 1),
+            "dur": round((end - start) * 1e6, 1),
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+
+        with self.lock:
+            self.fd.write(json.dumps(e) + ",\n")
+
+    def batch(self, start, end, method, keys, statuses, attempts, error, describe):
+        """
+        Record a batch request and its sub-requests.
+        """
+        ok = sum(1 for k in keys if statuses.get(k) == 200)
+        self.complete(
+            "batch",
+            "remote",
+            start,
+            end,
+            method=method,
+            size=len(keys),
+            ok=ok,
+            failed=len(keys) - ok,
+            error=error,
+        )
+
+        for k in keys:
+            self.complete(
+                method,
+                "sub-request",
+                start,
+                end,
+                id=describe(k),
+                status=statuses.get(k, error),
+                retry=attempts[k],
+            )
+
+    def close(self):
+        with self.lock:
+            self.fd.close()
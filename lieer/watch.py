@@ -0,0 +1,234 @@
+# Copyright © 2020  Gaute Hope <eg@gaute.vetsj.com>
+#
+# This file is part of Lieer.
+#
+# Lieer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import os
+import selectors
+import socket
+import time
+
+import notmuch2
+
+
+class Watch:
+    """
+    Keeps the local and remote repository loaded and synchronizes whenever
+    either side changes.
+
+    The remote is polled for a new historyId at an interval which is reset to
+    `min_interval` whenever something changed and doubled up to `max_interval`
+    while nothing happens. The notmuch revision is checked every
+    `local_interval` seconds, and local changes are pushed once the revision
+    has been stable for `debounce` seconds.
+
+    The repository lock is only held while synchronizing, so that e.g. `gmi send`
+    can use the repository while the watcher is idle.
+    """
+
+    SOCKET = ".watch.gmailieer.sock"
+    COMMANDS = ("sync", "push", "pull")
+
+    # local changes are pushed at the latest after this many debounce periods,
+    # even if the local tagging has not settled down.
+    MAX_DEBOUNCE = 10
+
+    def __init__(self, g, min_interval, max_interval, debounce, local_interval):
+        self.gmailieer = g
+        self.local = g.local
+        self.remote = g.remote
+
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.debounce = debounce
+        self.local_interval = local_interval
+
+        self.socket_f = os.path.join(self.local.wd, self.SOCKET)
+        self.stamp = None
+        self.revision = None
+
+    @staticmethod
+    def trigger(socket_f, command="sync"):
+        """
+        Ask a running watcher to synchronize immediately, returns the reply.
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(socket_f)
+            s.sendall((command + "\n").encode())
+            return s.makefile().readline().strip()
+
+    def listen(self):
+        if os.path.exists(self.socket_f):
+            try:
+                Watch.trigger(self.socket_f, "ping")
+            except OSError:
+                # left behind by a watcher that did not exit cleanly
+                os.unlink(self.socket_f)
+            else:
+                raise OSError("watch: already running on: %s" % self.socket_f)
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.socket_f)
+        self.sock.listen()
+        self.sock.setblocking(False)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+
+    def close(self):
+        self.selector.close()
+        self.sock.close()
+        if os.path.exists(self.socket_f):
+            os.unlink(self.socket_f)
+
+    def run(self):
+        self.listen()
+        self.gmailieer.vprint("watch: listening on: %s" % self.socket_f)
+
+        try:
+            self.loop()
+        finally:
+            self.close()
+
+    def loop(self):
+        self.sync(push=True, pull=True)
+
+        interval = self.min_interval
+        next_remote = time.monotonic() + interval
+        next_local = time.monotonic() + self.local_interval
+        first_change = None
+        push_at = None
+
+        while True:
+            wake = min(next_remote, next_local, push_at or float("inf"))
+            timeout = max(0.0, wake - time.monotonic())
+
+            for _ in self.selector.select(timeout):
+                if self.serve():
+                    first_change = push_at = None
+                interval = self.min_interval
+                next_remote = time.monotonic() + interval
+
+            now = time.monotonic()
+
+            if now >= next_local:
+                rev = self.get_revision()
+                if rev != self.revision:
+                    self.revision = rev
+                    if first_change is None:
+                        first_change = now
+                    push_at = min(
+                        now + self.debounce,
+                        first_change + self.MAX_DEBOUNCE * self.debounce,
+                    )
+                next_local = now + self.local_interval
+
+            if push_at is not None and now >= push_at:
+                first_change = push_at = None
+                if self.sync(push=True, pull=False):
+                    interval = self.min_interval
+                    next_remote = time.monotonic() + interval
+
+            if now >= next_remote:
+                if self.sync(push=False, pull=True, check=True):
+                    interval = self.min_interval
+                else:
+                    interval = min(interval * 2, self.max_interval)
+                next_remote = time.monotonic() + interval
+
+    def serve(self):
+        """
+        Answer a request on the socket, returns True if the local changes were
+        pushed.
+        """
+        pushed = False
+        conn, _ = self.sock.accept()
+        with conn:
+            conn.setblocking(True)
+            conn.settimeout(1)
+            try:
+                command = conn.makefile().readline().strip() or "sync"
+            except OSError:
+                return pushed
+
+            if command == "ping":
+                reply = "ok"
+            elif command not in self.COMMANDS:
+                reply = "error: unknown command: %s" % command
+            else:
+                self.gmailieer.vprint("watch: triggered: %s" % command)
+                ok = self.sync(
+                    push=command in ("sync", "push"),
+                    pull=command in ("sync", "pull"),
+                )
+                reply = "ok" if ok else "error: synchronization failed"
+                pushed = ok and command in ("sync", "push")
+
+            with contextlib.suppress(OSError):
+                conn.sendall((reply + "\n").encode())
+
+        return pushed
+
+    def get_revision(self):
+        with notmuch2.Database() as db:
+            return db.revision().rev
+
+    def sync(self, push, pull, check=False):
+        """
+        Lock the repository and push and/or pull. If `check` is set, pull only
+        when the remote historyId has moved.
+
+        Returns True if something was (or could have been) synchronized, False if
+        nothing changed or synchronization failed.
+        """
+        g = self.gmailieer
+        pushed = seen = False
+        self.local.lock(True)
+        try:
+            # local changes the loop has not seen yet are left for it to push
+            seen = self.get_revision() == self.revision
+
+            # other gmi instances may have used the repository in the meantime
+            self.local.state = self.local.State(self.local.state_f, self.local.config)
+            if self.stamp is not None and self.local.cache_stamp() != self.stamp:
+                self.local.__load_cache__()
+
+            if check:
+                hid = self.remote.get_current_history_id()
+                if hid == self.local.state.last_historyId:
+                    return False
+
+            self.remote.get_labels()
+
+            if push:
+                g.push(g.args, True)
+                pushed = True
+
+            if pull:
+                g.pull(g.args, True)
+
+            return True
+
+        except Exception as ex:
+            print("watch: synchronization failed:", ex)
+            return False
+
+        finally:
+            # our own changes should not trigger a push
+            if pushed or seen:
+                self.revision = self.get_revision()
+            self.stamp = self.local.cache_stamp()
+            self.local.unlock()
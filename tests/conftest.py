@@ -1,12 +1,43 @@
+import json
+
 import pytest
 
+import lieer
+
+from .fakegmail import FakeGmail, Mailbox
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark",
+        action="store_true",
+        default=False,
+        help="run the benchmarks against the fake GMail server",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: benchmark, run with --benchmark")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmark"):
+        return
+
+    skip = pytest.mark.skip(reason="benchmark, run with --benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
 
 class MockGmi:
     dry_run = False
     verbose = False
+    credentials_file = None
+    trace = None
 
     def __init__(self):
-        pass
+        self.metrics = lieer.metrics.Metrics()
 
 
 @pytest.fixture
@@ -16,3 +47,96 @@ def gmi():
     """
 
     return MockGmi()
+
+
+@pytest.fixture
+def local(tmp_path):
+    """
+    Local repository with an empty maildir and default configuration and state,
+    without a notmuch database.
+    """
+    for d in ("cur", "new", "tmp"):
+        (tmp_path / "mail" / d).mkdir(parents=True)
+
+    local = lieer.Local(MockGmi(), tmp_path)
+    local.config = lieer.Local.Config(local.config_f)
+    local.state = lieer.Local.State(local.state_f, local.config)
+    local.gids = {}
+    return local
+
+
+@pytest.fixture
+def fakegmail():
+    """
+    Fake GMail server with a small mailbox
+    """
+    fake = FakeGmail(Mailbox(size=50))
+    yield fake
+    fake.close()
+
+
+@pytest.fixture
+def remote(gmi, fakegmail, tmp_path):
+    """
+    Remote connected to the fake GMail server, with a local repository that is
+    not backed by notmuch.
+    """
+    gmi.local = lieer.Local(gmi, tmp_path)
+    gmi.local.config = lieer.Local.Config(gmi.local.config_f)
+    gmi.local.config.account = "me"
+    gmi.local.loaded = True
+
+    r = lieer.Remote(gmi)
+    r.service = fakegmail.service()
+    r.new_http = fakegmail.http
+    r.authorized = True
+    return r
+
+
+def make_account(root, fake, monkeypatch):
+    """
+    A lieer repository in a fresh notmuch database under root, connected to the
+    fake GMail server.
+    """
+    notmuch2 = pytest.importorskip("notmuch2")
+
+    maildb = root / "maildb"
+    path = maildb / "account"
+    for d in ("cur", "new", "tmp"):
+        (path / "mail" / d).mkdir(parents=True)
+
+    config = root / "notmuch-config"
+    config.write_text("[database]\npath=%s\n[new]\ntags=new\n" % maildb)
+
+    monkeypatch.setenv("NOTMUCH_CONFIG", str(config))
+    notmuch2.Database.create(str(maildb)).close()
+
+    (path / ".gmailieer.json").write_text(json.dumps({"account": "me"}))
+
+    repo = lieer.Repository(str(path))
+    repo.remote.service = fake.service()
+    repo.remote.new_http = fake.http
+    repo.remote.authorized = True
+    repo.fake = fake
+    return repo
+
+
+@pytest.fixture
+def account(tmp_path, fakegmail, monkeypatch):
+    """
+    Repository in a temporary notmuch database, synchronized from the fake GMail
+    server with a small mailbox.
+    """
+    repo = make_account(tmp_path, fakegmail, monkeypatch)
+    yield repo
+    repo.close()
+
+
+@pytest.fixture
+def synced(account):
+    """
+    The account after a full pull, with the API call counters cleared.
+    """
+    account.pull()
+    account.remote.calls.clear()
+    return account
@@ -0,0 +1,27 @@
+"""
+Synthetic corpus of GMail messages for benchmarks.
+"""
+
+from .fakegmail import Mailbox
+
+
+def corpus(n, seed=0, body_size=2000):
+    """
+    Generate n messages as GMail message resources in 'raw' format, with the label
+    distribution and threading of `Mailbox`. The messages are not kept, so large
+    corpora can be streamed.
+    """
+    mb = Mailbox(seed=seed, body_size=body_size)
+
+    for _ in range(n):
+        m = mb.add(record=False)
+        del mb.messages[m["id"]]
+
+        yield mb.resource(m, "raw")
+
+
+def labels(seed=0):
+    """
+    The labels of the mailbox the corpus is generated from (id to name).
+    """
+    return {l["id"]: l["name"] for l in Mailbox(seed=seed).labels.values()}
@@ -0,0 +1,758 @@
+"""
+A local stand-in for the parts of the GMail v1 API used by lieer.
+
+`Mailbox` holds a synthetic mailbox (messages, labels and history records),
+and `FakeGmail` serves it over HTTP on localhost, including batch requests.
+`FakeGmail.service()` returns a googleapiclient service which talks to the
+fake server instead of GMail.
+"""
+
+import base64
+import collections
+import email.parser
+import email.utils
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SYSTEM_LABELS = [
+    "INBOX",
+    "SPAM",
+    "TRASH",
+    "UNREAD",
+    "STARRED",
+    "IMPORTANT",
+    "SENT",
+    "DRAFT",
+    "CHAT",
+    "CATEGORY_PERSONAL",
+    "CATEGORY_SOCIAL",
+    "CATEGORY_PROMOTIONS",
+    "CATEGORY_UPDATES",
+    "CATEGORY_FORUMS",
+]
+
+# quota units per method: https://developers.google.com/gmail/api/reference/quota
+QUOTA = {
+    "getProfile": 1,
+    "labels.list": 1,
+    "labels.get": 1,
+    "labels.create": 5,
+    "messages.list": 5,
+    "messages.get": 5,
+    "messages.modify": 5,
+    "messages.send": 100,
+    "history.list": 2,
+    "threads.list": 10,
+    "threads.get": 10,
+}
+
+
+class Mailbox:
+    """
+    A synthetic mailbox. Messages are kept as dicts with the fields of the GMail
+    message resource, with the raw message as bytes.
+    """
+
+    EPOCH = 1262304000  # 2010-01-01, date of the first message
+
+    def __init__(self, size=0, seed=0, user_labels=10, thread_length=3, body_size=2000):
+        self.random = random.Random(seed)  # noqa: S311
+        self.thread_length = thread_length
+        self.body_size = body_size
+
+        self.labels = {l: {"id": l, "name": l, "type": "system"} for l in SYSTEM_LABELS}
+        for i in range(1, user_labels + 1):
+            self.create_label("label%d" % i)
+
+        self.messages = {}
+        self.history = []
+        self.history_id = 1000
+        self.first_history_id = self.history_id
+        self.next_gid = 0x17A0000000000000
+        self.threads = collections.defaultdict(list)
+        self.thread_ids = []
+
+        for _ in range(size):
+            self.add(record=False)
+
+    def create_label(self, name):
+        lid = "Label_%d" % (len(self.labels) - len(SYSTEM_LABELS) + 1)
+        self.labels[lid] = {"id": lid, "name": name, "type": "user"}
+        return self.labels[lid]
+
+    def random_labels(self):
+        """
+        Labels of a new message, roughly distributed like a real mailbox.
+        """
+        r = self.random
+        labels = set()
+
+        if r.random() < 0.1:
+            labels.add("SENT")
+        else:
+            labels.add(
+                r.choices(
+                    [
+                        "CATEGORY_PERSONAL",
+                        "CATEGORY_SOCIAL",
+                        "CATEGORY_PROMOTIONS",
+                        "CATEGORY_UPDATES",
+                        "CATEGORY_FORUMS",
+                    ],
+                    [50, 10, 20, 15, 5],
+                )[0]
+            )
+
+        if r.random() < 0.2:
+            labels.add("INBOX")
+        if r.random() < 0.05:
+            labels.add("UNREAD")
+        if r.random() < 0.15:
+            labels.add("IMPORTANT")
+        if r.random() < 0.02:
+            labels.add("STARRED")
+        if r.random() < 0.01:
+            labels.add("SPAM")
+        elif r.random() < 0.02:
+            labels.add("TRASH")
+
+        user = [l for l in self.labels if l.startswith("Label_")]
+        if user and r.random() < 0.3:
+            labels.add(r.choice(user))
+
+        return sorted(labels)
+
+    def make_raw(self, gid, thread, date):
+        """
+        A MIME message in GMail 'raw' form (CRLF line endings).
+        """
+        n = int(gid, 16) % 997
+        headers = [
+            "From: Sender %d <sender%d@example.com>" % (n, n),
+            "To: me@example.com",
+            "Subject: Message %s" % thread,
+            "Date: %s" % email.utils.formatdate(date),
+            "Message-ID: <%s@lieer.example.com>" % gid,
+        ]
+        if self.threads[thread]:
+            headers.append("In-Reply-To: <%s@lieer.example.com>" % thread)
+
+        words = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur")
+        body = []
+        length = 0
+        while length < self.body_size:
+            line = " ".join(self.random.choice(words) for _ in range(12))
+            body.append(line)
+            length += len(line) + 2
+
+        return ("\r\n".join(headers) + "\r\n\r\n" + "\r\n".join(body) + "\r\n").encode()
+
+    def record(self, kind, messages, labels=None):
+        self.history_id += 1
+        h = {
+            "id": str(self.history_id),
+            "messages": [{"id": m["id"], "threadId": m["threadId"]} for m in messages],
+        }
+
+        entries = []
+        for m in messages:
+            e = {"message": self.resource(m, "minimal", history=False)}
+            if labels is not None:
+                e["labelIds"] = labels
+            entries.append(e)
+
+        h[kind] = entries
+        self.history.append(h)
+
+    def add(self, labels=None, thread=None, raw=None, record=True):
+        gid = "%016x" % self.next_gid
+        self.next_gid += self.random.randint(1, 1 << 20)
+
+        if thread is None:
+            if self.threads and self.random.random() < 1 - 1 / self.thread_length:
+                thread = self.random.choice(self.thread_ids)
+            else:
+                thread = gid
+                self.thread_ids.append(gid)
+
+        date = self.EPOCH + len(self.messages) * 3600
+        m = {
+            "id": gid,
+            "threadId": thread,
+            "labelIds": self.random_labels() if labels is None else list(labels),
+            "internalDate": str(date * 1000),
+            "raw": raw if raw is not None else self.make_raw(gid, thread, date),
+        }
+
+        self.messages[gid] = m
+        self.threads[thread].append(gid)
+
+        if record:
+            self.record("messagesAdded", [m])
+        m["historyId"] = str(self.history_id)
+
+        return m
+
+    def modify(self, gid, add=(), remove=()):
+        m = self.messages[gid]
+        added = [l for l in add if l not in m["labelIds"]]
+        removed = [l for l in remove if l in m["labelIds"]]
+
+        m["labelIds"] = sorted((set(m["labelIds"]) | set(added)) - set(removed))
+
+        if added:
+            self.record("labelsAdded", [m], added)
+            m["historyId"] = str(self.history_id)
+        if removed:
+            self.record("labelsRemoved", [m], removed)
+            m["historyId"] = str(self.history_id)
+
+        return m
+
+    def delete(self, gid):
+        m = self.messages.pop(gid)
+        self.threads[m["threadId"]].remove(gid)
+        if not self.threads[m["threadId"]]:
+            del self.threads[m["threadId"]]
+        self.record("messagesDeleted", [m])
+
+    def churn(self, n):
+        """
+        Make n random label changes.
+        """
+        gids = list(self.messages)
+        user = [l for l in self.labels if l.startswith("Label_")] + [
+            "INBOX",
+            "UNREAD",
+            "STARRED",
+        ]
+        for _ in range(n):
+            gid = self.random.choice(gids)
+            label = self.random.choice(user)
+            if label in self.messages[gid]["labelIds"]:
+                self.modify(gid, remove=[label])
+            else:
+                self.modify(gid, add=[label])
+
+    def takeout(self, path, gids=None):
+        """
+        Write the messages (or those in gids) to an mbox like a Google Takeout of
+        GMail does.
+        """
+        names = {
+            "INBOX": "Inbox",
+            "SENT": "Sent",
+            "UNREAD": "Unread",
+            "STARRED": "Starred",
+            "IMPORTANT": "Important",
+            "SPAM": "Spam",
+            "TRASH": "Trash",
+            "DRAFT": "Drafts",
+            "CHAT": "Chat",
+        }
+        for l in SYSTEM_LABELS:
+            if l.startswith("CATEGORY_"):
+                names[l] = "Category " + l[len("CATEGORY_") :].capitalize()
+
+        with open(path, "wb") as fd:
+            for gid in gids if gids is not None else self.messages:
+                m = self.messages[gid]
+                labels = [names.get(l, self.labels[l]["name"]) for l in m["labelIds"]]
+                if "UNREAD" not in m["labelIds"]:
+                    labels.append("Opened")
+                labels = ['"%s"' % l if "," in l else l for l in labels]
+
+                date = time.gmtime(int(m["internalDate"]) / 1000)
+                fd.write(
+                    b"From %d@xxx %s\r\n"
+                    % (
+                        int(gid, 16),
+                        time.strftime("%a %b %d %H:%M:%S +0000 %Y", date).encode(),
+                    )
+                )
+                fd.write(b"X-GM-THRID: %d\r\n" % int(m["threadId"], 16))
+                fd.write(b"X-Gmail-Labels: %s\r\n" % ",".join(labels).encode())
+                for line in m["raw"].splitlines(keepends=True):
+                    if re.match(rb"^>*From ", line):
+                        line = b">" + line
+                    fd.write(line)
+                fd.write(b"\r\n")
+
+    def expire_history(self):
+        """
+        Drop all history records, older historyIds become invalid.
+        """
+        self.history = []
+        self.first_history_id = self.history_id
+
+    def resource(self, m, format="minimal", headers=None, history=True):
+        r = {
+            "id": m["id"],
+            "threadId": m["threadId"],
+            "labelIds": list(m["labelIds"]),
+        }
+        if not history:
+            return r
+
+        r["historyId"] = m["historyId"]
+        r["internalDate"] = m["internalDate"]
+        r["sizeEstimate"] = len(m["raw"])
+        r["snippet"] = ""
+
+        if format == "raw":
+            r["raw"] = base64.urlsafe_b64encode(m["raw"]).decode()
+
+        elif format in ("metadata", "full"):
+            (head, _, _) = m["raw"].partition(b"\r\n\r\n")
+            msg = email.parser.BytesHeaderParser().parsebytes(head + b"\r\n\r\n")
+            hdrs = [{"name": k, "value": v} for k, v in msg.items()]
+            if headers:
+                wanted = {h.lower() for h in headers}
+                hdrs = [h for h in hdrs if h["name"].lower() in wanted]
+            r["payload"] = {"mimeType": "text/plain", "headers": hdrs}
+
+        return r
+
+    def search(self, q=None, label_ids=None, include_spam_trash=False):
+        """
+        Ids of messages matching the query, newest first. Supports a subset of the
+        GMail search syntax: in:, label:, is:, after:, before:, newer_than:,
+        older_than:, negation with '-' and OR-groups with '{ }'.
+        """
+        terms = re.findall(r"-?\{[^}]*\}|\S+", q or "")
+
+        def date(v):
+            if v.isdigit():
+                return int(v)
+            return time.mktime(time.strptime(v, "%Y/%m/%d"))
+
+        def age(v):
+            units = {"d": 86400, "m": 30 * 86400, "y": 365 * 86400}
+            return time.time() - int(v[:-1]) * units[v[-1]]
+
+        def label(name):
+            name = name.lower()
+            for lid, l in self.labels.items():
+                if name in (lid.lower(), l["name"].lower().replace(" ", "-")):
+                    return lid
+            return name
+
+        def match(m, term):
+            if term.startswith("-"):
+                return not match(m, term[1:])
+            if term.startswith("{"):
+                return any(match(m, t) for t in term[1:-1].split())
+
+            (op, _, v) = term.partition(":")
+            d = int(m["internalDate"]) / 1000
+            if op == "in" and v == "chats":
+                return "CHAT" in m["labelIds"]
+            elif op in ("in", "label", "is"):
+                return label(v) in m["labelIds"]
+            elif op == "after":
+                return d > date(v)
+            elif op == "before":
+                return d < date(v)
+            elif op == "newer_than":
+                return d > age(v)
+            elif op == "older_than":
+                return d < age(v)
+            raise ValueError("unsupported search term: %s" % term)
+
+        ids = []
+        for m in self.messages.values():
+            if not include_spam_trash and {"SPAM", "TRASH"} & set(m["labelIds"]):
+                continue
+            if label_ids and not set(label_ids) <= set(m["labelIds"]):
+                continue
+            if all(match(m, t) for t in terms):
+                ids.append(m["id"])
+
+        ids.sort(key=lambda i: int(i, 16), reverse=True)
+        return ids
+
+
+class HttpError(Exception):
+    def __init__(self, status, reason, message=""):
+        self.status = status
+        self.reason = reason
+        self.message = message or reason
+
+
+class FakeGmail:
+    """
+    Serves a `Mailbox` over HTTP. Counts the API calls, HTTP requests and bytes
+    transferred, and optionally delays every HTTP request by `latency` seconds.
+
+    `fault` can be set to a callable taking (method, sub_request) where method is
+    e.g. 'messages.get', or 'batch' for the batch request itself. It may return an
+    HTTP status (or (status, reason)) to fail the request with, or raise
+    ConnectionResetError to drop the connection (see faults.py).
+    """
+
+    def __init__(self, mailbox=None, latency=0.0):
+        self.mailbox = mailbox if mailbox is not None else Mailbox()
+        self.latency = latency
+        self.fault = None
+        self.lock = threading.RLock()
+        self.reset_counters()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def handle_request(self):
+                length = int(self.headers.get("content-length", 0))
+                body = self.rfile.read(length) if length else b""
+                try:
+                    (status, headers, content) = fake.handle(
+                        self.command, self.path, self.headers, body
+                    )
+                except ConnectionResetError:
+                    self.close_connection = True
+                    return
+
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("content-length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = do_PUT = do_DELETE = handle_request
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        )
+        self.thread.start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d/" % self.server.server_address[1]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counters(self):
+        self.calls = collections.Counter()
+        self.requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def quota(self):
+        return sum(QUOTA.get(k, 5) * n for k, n in self.calls.items())
+
+    def http(self):
+        """
+        A new connection, unauthorized since the server does not check.
+        """
+        import httplib2
+
+        return httplib2.Http(timeout=60)
+
+    def service(self):
+        """
+        A GMail service object talking to this server.
+        """
+        from googleapiclient import discovery, discovery_cache
+
+        doc = json.loads(discovery_cache.get_static_doc("gmail", "v1"))
+        doc["rootUrl"] = self.url
+        return discovery.build_from_document(doc, http=self.http())
+
+    def handle(self, method, path, headers, body):
+        with self.lock:
+            self.requests += 1
+            self.bytes_in += len(body)
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if path.startswith("/batch"):
+            try:
+                self.check_fault("batch", False)
+                (status, headers, content) = self.batch(headers, body)
+            except HttpError as e:
+                (status, result) = self.error(e)
+                headers = {"content-type": "application/json; charset=UTF-8"}
+                content = json.dumps(result).encode()
+        else:
+            (status, result) = self.call(method, path, body, False)
+            headers = {"content-type": "application/json; charset=UTF-8"}
+            content = json.dumps(result).encode()
+
+        with self.lock:
+            self.bytes_out += len(content)
+
+        return (status, headers, content)
+
+    def batch(self, headers, body):
+        boundary = "batch_lieer_fake_boundary"
+        ctype = headers.get("content-type")
+        msg = email.parser.BytesParser().parsebytes(
+            b"content-type: " + ctype.encode() + b"\r\n\r\n" + body
+        )
+
+        parts = []
+        for part in msg.get_payload():
+            payload = part.get_payload()
+            (request_line, _, rest) = payload.partition("\n")
+            (method, path, _) = request_line.split(" ", 2)
+            (_, _, sub_body) = rest.replace("\r\n", "\n").partition("\n\n")
+
+            (status, result) = self.call(method, path, sub_body.encode(), True)
+
+            parts.append(
+                "--%s\r\nContent-Type: application/http\r\nContent-ID: <response-%s>\r\n\r\n"
+                "HTTP/1.1 %d %s\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n%s\r\n"
+                % (
+                    boundary,
+                    part["Content-ID"][1:-1],
+                    status,
+                    "OK" if status < 300 else "Error",
+                    json.dumps(result),
+                )
+            )
+
+        content = ("".join(parts) + "--%s--\r\n" % boundary).encode()
+        return (
+            200,
+            {"content-type": 'multipart/mixed; boundary="%s"' % boundary},
+            content,
+        )
+
+    def route(self, method, path):
+        """
+        Map a request to the API method name and its path parameters.
+        """
+        routes = [
+            ("GET", r"profile", "getProfile"),
+            ("GET", r"labels", "labels.list"),
+            ("POST", r"labels", "labels.create"),
+            ("GET", r"labels/(?P<id>[^/]+)", "labels.get"),
+            ("GET", r"messages", "messages.list"),
+            ("POST", r"messages/send", "messages.send"),
+            ("GET", r"messages/(?P<id>[^/]+)", "messages.get"),
+            ("POST", r"messages/(?P<id>[^/]+)/modify", "messages.modify"),
+            ("GET", r"threads", "threads.list"),
+            ("GET", r"threads/(?P<id>[^/]+)", "threads.get"),
+            ("GET", r"history", "history.list"),
+        ]
+
+        m = re.match(r"/gmail/v1/users/(?P<user>[^/]+)/(?P<rest>.*)", path)
+        if m:
+            for rmethod, rpath, name in routes:
+                mm = re.fullmatch(rpath, m.group("rest"))
+                if rmethod == method and mm:
+                    return (name, mm.groupdict())
+
+        return (None, {})
+
+    def call(self, method, uri, body, sub_request):
+        url = urllib.parse.urlparse(uri)
+        query = urllib.parse.parse_qs(url.query)
+        params = {k: v[-1] for k, v in query.items()}
+        params["_all"] = query
+
+        (name, args) = self.route(method, url.path)
+        params.update(args)
+
+        with self.lock:
+            if name is not None:
+                self.calls[name] += 1
+
+            try:
+                self.check_fault(name, sub_request)
+
+                if name is None:
+                    raise HttpError(404, "notFound", "no such method: %s" % uri)
+
+                data = json.loads(body) if body.strip() else {}
+                handler = getattr(self, "api_" + name.replace(".", "_"))
+                return (200, handler(params, data))
+
+            except HttpError as e:
+                return self.error(e)
+
+    def check_fault(self, name, sub_request):
+        if self.fault is not None:
+            f = self.fault(name, sub_request)
+            if f is not None:
+                (status, reason) = f if isinstance(f, tuple) else (f, "")
+                raise HttpError(status, reason)
+
+    @staticmethod
+    def error(e):
+        return (
+            e.status,
+            {
+                "error": {
+                    "code": e.status,
+                    "message": e.message,
+                    "errors": [{"reason": e.reason, "message": e.message}],
+                }
+            },
+        )
+
+    def message(self, gid):
+        m = self.mailbox.messages.get(gid)
+        if m is None:
+            raise HttpError(404, "notFound", "Requested entity was not found.")
+        return m
+
+    @staticmethod
+    def page(items, params, default=100):
+        size = min(int(params.get("maxResults", default)), 500)
+        start = int(params.get("pageToken", 0))
+        page = items[start : start + size]
+        token = str(start + size) if start + size < len(items) else None
+        return (page, token)
+
+    def api_getProfile(self, params, data):
+        mb = self.mailbox
+        return {
+            "emailAddress": "me@example.com",
+            "messagesTotal": len(mb.messages),
+            "threadsTotal": len(mb.threads),
+            "historyId": str(mb.history_id),
+        }
+
+    def api_labels_list(self, params, data):
+        return {"labels": list(self.mailbox.labels.values())}
+
+    def api_labels_create(self, params, data):
+        for l in self.mailbox.labels.values():
+            if l["name"] == data["name"]:
+                raise HttpError(409, "duplicate", "Label name exists or conflicts")
+        return self.mailbox.create_label(data["name"])
+
+    def api_labels_get(self, params, data):
+        l = self.mailbox.labels.get(params["id"])
+        if l is None:
+            raise HttpError(404, "notFound")
+
+        messages = [
+            m for m in self.mailbox.messages.values() if l["id"] in m["labelIds"]
+        ]
+        unread = [m for m in messages if "UNREAD" in m["labelIds"]]
+        return dict(
+            l,
+            messagesTotal=len(messages),
+            messagesUnread=len(unread),
+            threadsTotal=len({m["threadId"] for m in messages}),
+            threadsUnread=len({m["threadId"] for m in unread}),
+        )
+
+    def api_messages_list(self, params, data):
+        ids = self.mailbox.search(
+            params.get("q"),
+            params["_all"].get("labelIds"),
+            params.get("includeSpamTrash") == "true",
+        )
+        (page, token) = self.page(ids, params)
+
+        r = {"resultSizeEstimate": len(ids)}
+        if page:
+            r["messages"] = [
+                {"id": i, "threadId": self.mailbox.messages[i]["threadId"]}
+                for i in page
+            ]
+        if token:
+            r["nextPageToken"] = token
+        return r
+
+    def api_messages_get(self, params, data):
+        return self.mailbox.resource(
+            self.message(params["id"]),
+            params.get("format", "full"),
+            params["_all"].get("metadataHeaders"),
+        )
+
+    def api_threads_list(self, params, data):
+        ids = self.mailbox.search(
+            params.get("q"),
+            params["_all"].get("labelIds"),
+            params.get("includeSpamTrash") == "true",
+        )
+        tids = list(dict.fromkeys(self.mailbox.messages[i]["threadId"] for i in ids))
+        (page, token) = self.page(tids, params)
+
+        r = {"resultSizeEstimate": len(tids)}
+        if page:
+            r["threads"] = [
+                {"id": t, "historyId": self.thread_history(t)} for t in page
+            ]
+        if token:
+            r["nextPageToken"] = token
+        return r
+
+    def api_threads_get(self, params, data):
+        gids = self.mailbox.threads.get(params["id"])
+        if not gids:
+            raise HttpError(404, "notFound", "Requested entity was not found.")
+
+        messages = [
+            self.mailbox.resource(
+                self.mailbox.messages[g],
+                params.get("format", "full"),
+                params["_all"].get("metadataHeaders"),
+            )
+            for g in gids
+        ]
+        return {
+            "id": params["id"],
+            "historyId": self.thread_history(params["id"]),
+            "messages": messages,
+        }
+
+    def thread_history(self, tid):
+        """
+        The historyId of the last change to any message in the thread.
+        """
+        mb = self.mailbox
+        return max((mb.messages[g]["historyId"] for g in mb.threads[tid]), key=int)
+
+    def api_messages_modify(self, params, data):
+        m = self.message(params["id"])
+        for l in data.get("addLabelIds", []):
+            if l not in self.mailbox.labels:
+                raise HttpError(400, "invalidArgument", "Invalid label: %s" % l)
+        self.mailbox.modify(
+            m["id"], data.get("addLabelIds", []), data.get("removeLabelIds", [])
+        )
+        return self.mailbox.resource(m, "minimal", history=False)
+
+    def api_messages_send(self, params, data):
+        raw = base64.urlsafe_b64decode(data["raw"].encode())
+        m = self.mailbox.add(labels=["SENT"], thread=data.get("threadId"), raw=raw)
+        return self.mailbox.resource(m, "minimal", history=False)
+
+    def api_history_list(self, params, data):
+        mb = self.mailbox
+        start = int(params["startHistoryId"])
+        if start < mb.first_history_id:
+            raise HttpError(404, "notFound", "Requested entity was not found.")
+
+        records = [h for h in mb.history if int(h["id"]) > start]
+        (page, token) = self.page(records, params)
+
+        r = {"historyId": str(mb.history_id)}
+        if page:
+            r["history"] = page
+        if token:
+            r["nextPageToken"] = token
+        return r
@@ -0,0 +1,83 @@
+"""
+Fault injection for the fake GMail server, and a simulated clock so that backoff
+can be tested without sleeping.
+"""
+
+import random
+import time
+
+# kind of fault: (status, reason)
+KINDS = {
+    403: (403, "userRateLimitExceeded"),
+    429: (429, "rateLimitExceeded"),
+    500: (500, "backendError"),
+    503: (503, "backendError"),
+}
+
+
+class Faults:
+    """
+    A schedule of faults, to be assigned to `FakeGmail.fault`.
+
+    Each fault is (start, stop, kind, rate): batch requests number start <= n < stop
+    (counted from 0) fail with `kind`. If `rate` is None the whole batch request
+    fails, otherwise each sub-request fails with probability `rate`. `kind` is an
+    HTTP status from `KINDS` or 'reset' to drop the connection.
+    """
+
+    def __init__(self, schedule, seed=0):
+        self.schedule = schedule
+        self.random = random.Random(seed)  # noqa: S311
+        self.batches = -1
+        self.injected = 0
+
+    @property
+    def last(self):
+        """
+        The last batch request with faults.
+        """
+        return max(stop for (_, stop, _, _) in self.schedule) - 1
+
+    def inject(self, kind):
+        self.injected += 1
+        if kind == "reset":
+            raise ConnectionResetError("fault: connection reset")
+        return KINDS[kind]
+
+    def __call__(self, name, sub_request):
+        if name == "batch":
+            self.batches += 1
+
+        for start, stop, kind, rate in self.schedule:
+            if not start <= self.batches < stop:
+                continue
+
+            if rate is None and name == "batch":
+                return self.inject(kind)
+
+            if rate is not None and sub_request and self.random.random() < rate:
+                return self.inject(kind)
+
+        return None
+
+
+class Clock:
+    """
+    Replaces the `time` module in lieer.remote: sleeping advances the clock
+    instead of blocking, the time spent in requests is still real.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.slept = 0.0
+
+    def sleep(self, s):
+        self.slept += s
+
+    def monotonic(self):
+        return time.perf_counter() - self.start + self.slept
+
+    perf_counter = monotonic
+
+    def time(self):
+        return time.time() + self.slept
@@ -0,0 +1,137 @@
+import tarfile
+from types import SimpleNamespace
+
+import pytest
+
+import lieer
+from lieer.archive import Archive
+
+
+@pytest.fixture
+def repository(tmp_path):
+    """
+    The files of a repository, without notmuch.
+    """
+    wd = tmp_path / "account"
+    for d in ("cur", "new", "tmp"):
+        (wd / "mail" / d).mkdir(parents=True)
+
+    (wd / ".gmailieer.json").write_text('{"account": "me"}')
+    (wd / ".state.gmailieer.json").write_text('{"last_historyId": 42}')
+    (wd / ".credentials.gmailieer.json").write_text("secret")
+
+    files = ["cur/%016x:2,S" % i for i in range(5)]
+    for f in files:
+        (wd / "mail" / f).write_bytes(b"Subject: %s\n\nbody\n" % f.encode())
+
+    return SimpleNamespace(
+        wd=str(wd), md=str(wd / "mail"), files=files, maildirs=lambda: [""]
+    )
+
+
+@pytest.mark.parametrize("name", ["account.tar", "account.tar.gz", "account.tar.xz"])
+def test_archive(repository, tmp_path, name):
+    archive = str(tmp_path / name)
+    tags = {f: ["inbox", f] for f in repository.files}
+    Archive(archive).create(repository, tags)
+
+    with tarfile.open(archive) as tar:
+        names = tar.getnames()
+    assert names[0] == Archive.TAGS
+    assert ".credentials.gmailieer.json" not in names
+
+    wd = tmp_path / "imported"
+    assert Archive(archive).extract(str(wd)) == tags
+
+    assert (wd / ".state.gmailieer.json").read_text() == '{"last_historyId": 42}'
+    assert not (wd / ".credentials.gmailieer.json").exists()
+    assert (wd / "mail" / "tmp").is_dir()
+    for f in repository.files:
+        assert (wd / "mail" / f).read_bytes() == (b"Subject: %s\n\nbody\n" % f.encode())
+
+    # not over an existing repository
+    with pytest.raises(lieer.Local.RepositoryException):
+        Archive(archive).extract(str(wd))
+
+
+@pytest.mark.parametrize(
+    "name",
+    [
+        "../outside",
+        "mail/cur/../../outside",
+        "mail/cur/sub/message",
+        "mail/other/message",
+        ".credentials.gmailieer.json",
+    ],
+)
+def test_archive_unexpected(tmp_path, name):
+    archive = str(tmp_path / "archive.tar")
+    with tarfile.open(archive, "w") as tar:
+        info = tarfile.TarInfo(name)
+        tar.addfile(info)
+
+    with pytest.raises(lieer.Local.RepositoryException):
+        Archive(archive).extract(str(tmp_path / "imported"))
+
+    assert not (tmp_path / "outside").exists()
+
+
+def test_archive_symlink(tmp_path):
+    archive = str(tmp_path / "archive.tar")
+    with tarfile.open(archive, "w") as tar:
+        info = tarfile.TarInfo("mail/cur/message")
+        info.type = tarfile.SYMTYPE
+        info.linkname = "/etc/passwd"
+        tar.addfile(info)
+
+    with pytest.raises(lieer.Local.RepositoryException):
+        Archive(archive).extract(str(tmp_path / "imported"))
+
+
+def test_export_import(account, tmp_path, monkeypatch):
+    notmuch2 = pytest.importorskip("notmuch2")
+
+    account.pull()
+    mb = account.fake.mailbox
+
+    with account.local.write_db() as db:
+        m = next(iter(db.messages(account.local.tag_query("inbox"))))
+        m.tags.add("local-only")
+        gid = account.local.messages_to_gids([m])[1][0]
+
+    # not pushed, but kept by the archive
+    archive = str(tmp_path / "account.tar.gz")
+    account.export(archive)
+    account.close()
+
+    # changes after the export
+    changed = next(g for g in mb.messages if g != gid)
+    mb.modify(changed, add=["STARRED"])
+    new = mb.add(labels=["INBOX"])["id"]
+
+    # a new machine
+    maildb = tmp_path / "new" / "maildb"
+    maildb.mkdir(parents=True)
+    config = tmp_path / "new" / "notmuch-config"
+    config.write_text("[database]\npath=%s\n[new]\ntags=new\n" % maildb)
+    monkeypatch.setenv("NOTMUCH_CONFIG", str(config))
+    notmuch2.Database.create(str(maildb)).close()
+
+    repo = lieer.Repository.import_archive(archive, str(maildb / "account"))
+    repo.remote.service = account.fake.service()
+    repo.remote.new_http = account.fake.http
+    repo.remote.authorized = True
+
+    account.fake.reset_counters()
+    try:
+        repo.pull()
+        # a partial pull, not a full one
+        assert account.fake.calls["messages.get"] < len(mb.messages)
+
+        assert set(repo.local.gids) == set(mb.messages)
+        with notmuch2.Database() as db:
+            assert "local-only" in db.find("%s@lieer.example.com" % gid).tags
+            assert "flagged" in db.find("%s@lieer.example.com" % changed).tags
+            assert "inbox" in db.find("%s@lieer.example.com" % new).tags
+    finally:
+        repo.close()
@@ -0,0 +1,82 @@
+import os
+import time
+
+import pytest
+
+from lieer.backfill import Backfill
+
+
+def test_backfill_state(tmp_path):
+    f = str(tmp_path / ".backfill.gmailieer.json")
+    assert Backfill.load(f) is None
+
+    Backfill(f, 30).save()
+    b = Backfill.load(f)
+    assert b.days == 30
+    assert b.fetched == 0
+
+    b.update(10, 1587028738)
+    assert Backfill.load(f).fetched == 10
+    assert Backfill.load(f).before == 1587028738
+
+    b.delete()
+    assert Backfill.load(f) is None
+
+
+@pytest.fixture
+def recent(account):
+    """
+    A mailbox with a few recent messages, pulled with --recent-first.
+    """
+    mb = account.fake.mailbox
+    for _ in range(3):
+        m = mb.add(labels=["CATEGORY_PERSONAL"])
+        m["internalDate"] = str(int(time.time() * 1000))
+
+    account.pull(recent_first=30)
+    return account
+
+
+def test_recent_first(recent):
+    mb = recent.fake.mailbox
+    q = "{newer_than:30d in:inbox is:unread} -in:chats"
+    expected = mb.search(q, include_spam_trash=True)
+
+    assert sorted(recent.local.gids) == sorted(expected)
+    assert len(expected) < len(mb.messages)
+    assert recent.local.state.last_historyId == mb.history_id
+    assert os.path.exists(os.path.join(recent.local.wd, ".backfill.gmailieer.json"))
+
+
+def test_backfill(recent):
+    mb = recent.fake.mailbox
+    gids = set(recent.local.gids)
+
+    def dates(gids):
+        return [int(mb.messages[g]["internalDate"]) // 1000 for g in gids]
+
+    recent.backfill(limit=10)
+    fetched = set(recent.local.gids) - gids
+    assert len(fetched) == 10
+
+    f = os.path.join(recent.local.wd, ".backfill.gmailieer.json")
+    assert Backfill.load(f).before == min(dates(fetched))
+
+    # the next chunk continues from the oldest message fetched
+    recent.backfill(limit=10)
+    older = set(recent.local.gids) - gids - fetched
+    assert len(older) == 10
+    assert max(dates(older)) <= min(dates(fetched))
+
+    # incremental pulls work during the backfill, also for messages not yet fetched
+    old = next(g for g in mb.messages if g not in recent.local.gids)
+    mb.modify(old, add=["STARRED"])
+    new = mb.add(labels=["INBOX"])
+    recent.pull()
+    assert old in recent.local.gids
+    assert new["id"] in recent.local.gids
+
+    recent.backfill()
+
+    assert sorted(recent.local.gids) == sorted(mb.messages)
+    assert not os.path.exists(os.path.join(recent.local.wd, ".backfill.gmailieer.json"))
@@ -0,0 +1,174 @@
+import pytest
+
+import lieer
+
+from .faults import Clock, Faults
+from .test_benchmark import report
+
+SIZE = 500
+
+SCENARIOS = {
+    "rate-403": [(2, 5, 403, 0.2)],
+    "rate-429": [(2, 5, 429, None)],
+    "error-500": [(2, 5, 500, 0.1)],
+    "unavailable-503": [(2, 4, 503, None)],
+    "reset": [(2, 4, "reset", None)],
+    "mixed": [(1, 3, 403, 0.1), (3, 4, 503, None), (4, 6, 500, 0.05)],
+}
+
+
+class Harness:
+    """
+    Runs batch requests against the fake server with a schedule of faults, under a
+    simulated clock, and records the state of the backoff after every batch.
+    """
+
+    def __init__(self, remote, fake, clock, schedule):
+        self.remote = remote
+        self.fake = fake
+        self.clock = clock
+        self.faults = Faults(schedule)
+        self.events = []
+
+        fake.fault = self.faults
+        harness = self
+
+        class Backoff(lieer.Remote.Backoff):
+            def record(self):
+                harness.events.append(
+                    (
+                        harness.clock.monotonic(),
+                        harness.faults.batches,
+                        self.size,
+                        self.delay,
+                    )
+                )
+
+            def success(self):
+                super().success()
+                self.record()
+
+            def rate_limited(self):
+                super().rate_limited()
+                self.record()
+
+            def reduce(self):
+                super().reduce()
+                self.record()
+
+        remote.Backoff = Backoff
+        fake.reset_counters()
+
+    def get_messages(self):
+        got = []
+        self.remote.get_messages(
+            list(self.fake.mailbox.messages), got.extend, "minimal"
+        )
+        return got
+
+    def recovery(self):
+        """
+        Time from the end of the last faulty batch request until the backoff is back
+        to full batch size and no delay.
+        """
+        last = self.faults.last
+        ended = max((t for (t, b, _, _) in self.events if b <= last), default=0)
+
+        for t, b, size, delay in self.events:
+            if b > last and size == self.remote.BATCH_REQUEST_SIZE and delay == 0:
+                return t - ended
+
+        return None
+
+    def report(self, scenario, messages):
+        duration = self.clock.monotonic()
+        report(
+            {
+                "scenario": "backoff-%s" % scenario,
+                "messages": messages,
+                "duration": round(duration, 4),
+                "slept": self.clock.slept,
+                "messages_per_sec": round(messages / duration, 2),
+                "recovery": self.recovery(),
+                "requests": self.fake.requests,
+                "faults": self.faults.injected,
+                "min_batch_size": min(e[2] for e in self.events),
+                "max_delay": max(e[3] for e in self.events),
+            }
+        )
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(lieer.remote, "time", c)
+    return c
+
+
+@pytest.fixture
+def mailbox(fakegmail):
+    mb = fakegmail.mailbox
+    while len(mb.messages) < SIZE:
+        mb.add(record=False)
+    return mb
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS)
+def test_get_messages_recovers(remote, fakegmail, mailbox, clock, scenario):
+    h = Harness(remote, fakegmail, clock, SCENARIOS[scenario])
+    got = h.get_messages()
+
+    # every message is received once, and successful requests are not repeated
+    assert sorted(m["id"] for m in got) == sorted(mailbox.messages)
+    assert h.faults.injected > 0
+    if all(rate is not None for (_, _, _, rate) in SCENARIOS[scenario]):
+        assert fakegmail.calls["messages.get"] - h.faults.injected == SIZE
+
+    # temporary errors do not shrink the batch size, and the delay recovers
+    assert min(e[2] for e in h.events) == remote.BATCH_REQUEST_SIZE
+    assert h.recovery() is not None
+    faulty = sum(stop - start for (start, stop, _, _) in SCENARIOS[scenario])
+    assert clock.slept < 2 ** (faulty + 2)
+
+
+def test_push_changes_recovers(remote, fakegmail, mailbox, clock):
+    remote.get_labels()
+    gids = list(mailbox.messages)
+    actions = [remote.__push_tags__(gid, ["label1"], []) for gid in gids]
+
+    h = Harness(remote, fakegmail, clock, SCENARIOS["mixed"])
+    done = []
+    remote.push_changes(actions, done.append)
+
+    assert len(done) == SIZE
+    assert all("Label_1" in mailbox.messages[gid]["labelIds"] for gid in gids)
+    assert h.recovery() is not None
+
+
+def test_persistent_failure(remote, fakegmail, mailbox, clock):
+    h = Harness(remote, fakegmail, clock, [(0, 1000, 503, None)])
+
+    with pytest.raises(lieer.Remote.BatchException):
+        h.get_messages()
+
+    assert h.faults.injected == remote.MAX_CONNECTION_ERRORS + 1
+    assert max(e[3] for e in h.events) == remote.MAX_DELAY
+
+
+def test_persistent_rate_limit(remote, fakegmail, mailbox, clock):
+    batches = remote.MAX_CONNECTION_ERRORS + 5
+    h = Harness(remote, fakegmail, clock, [(0, batches, 429, None)])
+
+    # rate limiting is not a connection error
+    got = h.get_messages()
+
+    assert sorted(m["id"] for m in got) == sorted(mailbox.messages)
+    assert h.faults.injected == batches
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("scenario", SCENARIOS)
+def test_backoff_throughput(remote, fakegmail, mailbox, clock, scenario):
+    h = Harness(remote, fakegmail, clock, SCENARIOS[scenario])
+    got = h.get_messages()
+    h.report(scenario, len(got))
@@ -0,0 +1,201 @@
+"""
+End-to-end benchmarks against the fake GMail server and a temporary notmuch
+database. Run with:
+
+  pytest --benchmark -s tests/test_benchmark.py
+
+The mailbox size and server latency are set with LIEER_BENCH_SIZE (default
+2000 messages) and LIEER_BENCH_LATENCY (default 0 s). Results are printed and,
+if LIEER_BENCH_OUTPUT is set, appended to that file as one JSON object per
+scenario.
+"""
+
+import itertools
+import json
+import os
+import platform
+import subprocess
+import time
+
+import pytest
+
+from .conftest import make_account
+from .fakegmail import FakeGmail, Mailbox
+
+pytestmark = pytest.mark.benchmark
+
+SIZE = int(os.environ.get("LIEER_BENCH_SIZE", 2000))
+LATENCY = float(os.environ.get("LIEER_BENCH_LATENCY", 0))
+OUTPUT = os.environ.get("LIEER_BENCH_OUTPUT")
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],  # noqa: S607
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+COMMIT = commit()
+
+
+def report(result):
+    """
+    Print the result of a benchmark, and append it to LIEER_BENCH_OUTPUT.
+    """
+    result.setdefault("commit", COMMIT)
+    line = json.dumps(result, sort_keys=True)
+    print(line)
+
+    if OUTPUT:
+        with open(OUTPUT, "a") as fd:
+            fd.write(line + "\n")
+
+
+def reset_maxrss():
+    """
+    Reset the peak resident set size of the process, returns False if it cannot be
+    reset (only on Linux).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as fd:
+            fd.write("5")
+    except OSError:
+        return False
+
+    return True
+
+
+def maxrss():
+    """
+    Peak resident set size since the last `reset_maxrss` in kB.
+    """
+    with open("/proc/self/status") as fd:
+        for line in fd:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+    return None
+
+
+def measure(account, scenario, messages, func):
+    fake = account.fake
+    fake.reset_counters()
+    per_scenario = reset_maxrss()
+
+    start = time.perf_counter()
+    func()
+    duration = time.perf_counter() - start
+
+    report(
+        {
+            "scenario": scenario,
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "size": SIZE,
+            "latency": LATENCY,
+            "messages": messages,
+            "duration": round(duration, 4),
+            "messages_per_sec": round(messages / duration, 2) if duration else None,
+            "requests": fake.requests,
+            "calls": dict(fake.calls),
+            "quota": fake.quota,
+            "bytes_in": fake.bytes_in,
+            "bytes_out": fake.bytes_out,
+            # peak resident set size during the scenario (kB), if it can be measured
+            "maxrss": maxrss() if per_scenario else None,
+        }
+    )
+
+
+@pytest.fixture(scope="module")
+def account(tmp_path_factory):
+    fake = FakeGmail(Mailbox(size=SIZE, seed=1), latency=LATENCY)
+    mp = pytest.MonkeyPatch()
+    repo = make_account(tmp_path_factory.mktemp("bench"), fake, mp)
+
+    yield repo
+
+    repo.close()
+    fake.close()
+    mp.undo()
+
+
+def count(repo):
+    import notmuch2
+
+    with notmuch2.Database() as db:
+        return db.count_messages("path:account/**")
+
+
+def test_full_pull(account):
+    n = len(account.fake.mailbox.search("-in:chats", include_spam_trash=True))
+    measure(account, "full_pull", n, lambda: account.pull())
+
+    assert count(account) == n
+
+
+def test_partial_pull(account):
+    mb = account.fake.mailbox
+    changes = max(SIZE // 20, 1)
+    mb.churn(changes)
+    for _ in range(changes):
+        mb.add()
+
+    before = count(account)
+    measure(account, "partial_pull", 2 * changes, lambda: account.pull())
+
+    assert account.fake.calls["history.list"] > 0
+    assert count(account) == before + changes
+
+
+def test_push(account):
+    import notmuch2
+
+    changes = max(SIZE // 20, 1)
+    with account.local.write_db() as db, db.atomic():
+        for m in itertools.islice(db.messages("path:account/**"), changes):
+            m.tags.add("benchmark")
+
+    measure(account, "push", changes, lambda: account.push())
+
+    assert account.fake.calls["messages.modify"] == changes
+    with notmuch2.Database() as db:
+        assert db.count_messages("tag:benchmark") == changes
+
+
+def test_send(account):
+    g = account.gmailieer
+    sent = 50
+
+    def send():
+        for i in range(sent):
+            msg = account.remote.send(
+                b"From: me@example.com\r\nTo: you@example.com\r\n"
+                b"Subject: benchmark %d\r\n\r\nhello\r\n" % i
+            )
+            g.get_content([msg["id"]])
+            g.get_meta([msg["id"]])
+
+    measure(account, "send", sent, send)
+
+    assert account.fake.calls["messages.send"] == sent
+
+
+@pytest.mark.parametrize("shards", [1, 2, 4, 8])
+def test_list(account, shards):
+    n = len(account.fake.mailbox.search("-in:chats", include_spam_trash=True))
+
+    def _list():
+        gids = {
+            m["id"] for _, ms in account.remote.all_messages(shards=shards) for m in ms
+        }
+        assert len(gids) == n
+
+    measure(account, "list-%d-shards" % shards, n, _list)
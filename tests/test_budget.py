@@ -0,0 +1,211 @@
+"""
+Budgets for the number of API calls made in common situations, so that redundant
+round trips stay removed.
+"""
+
+import collections
+
+import lieer
+
+
+def total(remote):
+    return sum(remote.calls.values())
+
+
+def test_current_history_id(remote, fakegmail):
+    assert remote.get_current_history_id() == fakegmail.mailbox.history_id
+    assert remote.calls == {"gmail.users.getProfile": 1}
+    assert remote.quota == 1
+
+
+def test_unchanged_history(remote, fakegmail):
+    start = fakegmail.mailbox.history_id
+
+    assert list(remote.get_history_since(start)) == []
+    assert remote.history_id == start
+    assert remote.calls == {"gmail.users.history.list": 1}
+
+
+def test_labels_loaded_on_use(remote, fakegmail):
+    assert total(remote) == 0
+
+    assert remote.labels["Label_1"] == "label1"
+    assert remote.invlabels["label1"] == "Label_1"
+    assert remote.calls == {"gmail.users.labels.list": 1}
+
+    # unknown labels are looked up once
+    lid = fakegmail.mailbox.create_label("new")["id"]
+    assert remote.label(lid) == "new"
+    assert remote.label("Label_missing") is None
+    assert remote.label("Label_missing") is None
+    assert remote.calls == {"gmail.users.labels.list": 3}
+
+
+def test_create_existing_label(remote, fakegmail):
+    assert "new" not in remote.invlabels
+
+    # created by another client since the labels were loaded
+    lid = fakegmail.mailbox.create_label("new")["id"]
+
+    assert remote.__create_label__("new") == (lid, "new")
+    assert remote.invlabels["new"] == lid
+    assert remote.calls == {
+        "gmail.users.labels.list": 2,
+        "gmail.users.labels.create": 1,
+    }
+
+
+def test_batch_calls_counted(remote, fakegmail):
+    gids = list(fakegmail.mailbox.messages)
+    remote.get_messages(gids, lambda _: None, "minimal")
+
+    assert remote.calls == {"gmail.users.messages.get": len(gids)}
+    assert remote.quota == 5 * len(gids)
+    assert fakegmail.calls["messages.get"] == len(gids)
+
+
+def test_thread_metadata(remote, fakegmail):
+    mb = fakegmail.mailbox
+    threads = {gid: m["threadId"] for gid, m in mb.messages.items()}
+
+    g = lieer.Gmailieer()
+    g.remote = remote
+    got = []
+    g.get_thread_meta(list(threads), threads, got.extend)
+
+    # one request per thread rather than per message, unless that uses more quota
+    single = [t for t, gids in mb.threads.items() if len(gids) == 1]
+    assert sorted(m["id"] for m in got) == sorted(threads)
+    assert remote.calls == {
+        "gmail.users.threads.get": len(mb.threads) - len(single),
+        "gmail.users.messages.get": len(single),
+    }
+    assert len(mb.threads) < len(threads)
+    assert remote.quota < 5 * len(threads)
+
+
+def test_thread_metadata_moved(remote, fakegmail):
+    mb = fakegmail.mailbox
+    threads = {gid: m["threadId"] for gid, m in mb.messages.items()}
+
+    # a message listed in the wrong thread is fetched on its own
+    gid = next(gid for gid in threads if mb.threads[threads[gid]] == [gid])
+    other = next(t for t in mb.threads if len(mb.threads[t]) > 1)
+    threads[gid] = other
+
+    g = lieer.Gmailieer()
+    g.remote = remote
+    got = []
+    g.get_thread_meta(list(threads), threads, got.extend)
+
+    listed = collections.Counter(threads.values())
+    single = [t for t, n in listed.items() if n == 1]
+
+    assert sorted(m["id"] for m in got) == sorted(threads)
+    assert remote.calls["gmail.users.messages.get"] == len(single) + 1
+
+
+def test_noop_sync(synced):
+    synced.sync()
+
+    assert synced.remote.calls == {"gmail.users.history.list": 1}
+
+
+def test_sync_remote_label_change(synced):
+    mb = synced.fake.mailbox
+    gid = next(g for g, m in mb.messages.items() if "STARRED" not in m["labelIds"])
+    mb.modify(gid, add=["STARRED"])
+
+    synced.sync()
+
+    assert synced.remote.calls == {
+        "gmail.users.history.list": 1,
+        "gmail.users.labels.list": 1,
+    }
+
+
+def test_sync_new_message(synced):
+    synced.fake.mailbox.add(labels=["INBOX"])
+
+    synced.sync()
+
+    assert synced.remote.calls == {
+        "gmail.users.history.list": 1,
+        "gmail.users.labels.list": 1,
+        "gmail.users.messages.get": 1,
+    }
+
+
+def test_sync_local_tag_change(synced):
+    with synced.local.write_db() as db:
+        m = next(iter(db.messages("path:account/** and not tag:flagged")))
+        m.tags.add("flagged")
+
+    synced.sync()
+
+    assert synced.remote.calls == {
+        "gmail.users.labels.list": 1,
+        "gmail.users.messages.get": 1,
+        "gmail.users.messages.modify": 1,
+        "gmail.users.history.list": 1,
+    }
+
+
+def test_full_pull_thread_metadata(synced):
+    synced.local.config.set_thread_metadata(True)
+    mb = synced.fake.mailbox
+
+    synced.pull(force=True)
+
+    # all messages are known, so only their labels are checked: a thread at a time,
+    # unless only one of its messages is listed
+    listed = collections.Counter(
+        mb.messages[g]["threadId"]
+        for g in mb.search(synced.remote.query, include_spam_trash=True)
+    )
+    single = [t for t, n in listed.items() if n == 1]
+    assert synced.remote.calls["gmail.users.threads.get"] == len(listed) - len(single)
+    assert synced.remote.calls["gmail.users.messages.get"] == len(single)
+
+
+def test_expired_history_delta_pull(synced):
+    mb = synced.fake.mailbox
+    gid = next(g for g, m in mb.messages.items() if "STARRED" not in m["labelIds"])
+    mb.modify(gid, add=["STARRED"])
+    mb.expire_history()
+
+    synced.pull()
+
+    # only the messages in the changed thread are checked
+    thread = mb.threads[mb.messages[gid]["threadId"]]
+    assert synced.remote.calls["gmail.users.messages.get"] == len(thread)
+
+    with synced.local.write_db() as db:
+        assert db.count_messages("id:%s@lieer.example.com and tag:flagged" % gid) == 1
+
+
+def test_expired_history_limited_pull(synced):
+    synced.local.config.set_remove_local_messages(False)
+    mb = synced.fake.mailbox
+    gid = mb.add(labels=["INBOX"])["id"]
+    mb.expire_history()
+
+    synced.pull(limit=10)
+
+    # no delta against the thread index, the listed messages are all checked
+    assert "gmail.users.threads.list" not in synced.remote.calls
+    assert synced.remote.calls["gmail.users.messages.get"] >= 10
+    assert synced.local.has(gid)
+
+
+def test_full_pull_thread_index(synced):
+    from lieer.threadindex import ThreadIndex
+
+    synced.pull(force=True)
+
+    # the thread index is taken from the messages, without listing the threads
+    assert "gmail.users.threads.list" not in synced.remote.calls
+
+    index = ThreadIndex(synced.local.wd + "/.threads.gmailieer.json")
+    for tid in synced.fake.mailbox.threads:
+        assert not index.changed(tid, synced.fake.thread_history(tid))
@@ -0,0 +1,19 @@
+import base64
+import email
+
+from .corpus import corpus, labels
+
+
+def test_corpus():
+    messages = list(corpus(100, seed=3))
+    assert messages == list(corpus(100, seed=3))
+
+    known = labels(seed=3)
+    for m in messages:
+        assert set(m["labelIds"]) <= set(known)
+
+        msg = email.message_from_bytes(base64.urlsafe_b64decode(m["raw"]))
+        assert msg["Message-ID"] == "<%s@lieer.example.com>" % m["id"]
+
+    # messages are grouped in threads
+    assert len({m["threadId"] for m in messages}) < len(messages)
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+import lieer
+
+from .fakegmail import FakeGmail, Mailbox
+
+
+def test_get_messages_headers(remote, fakegmail):
+    gids = list(fakegmail.mailbox.messages)[:3]
+    got = []
+
+    remote.get_messages(gids, got.extend, "metadata", ["Message-ID"])
+
+    for m in got:
+        assert m["payload"]["headers"] == [
+            {"name": "Message-ID", "value": "<%s@lieer.example.com>" % m["id"]}
+        ]
+
+
+@pytest.fixture
+def accounts(account):
+    """
+    The account, pulled, and another repository in the same notmuch database which
+    received some of the same messages.
+    """
+    account.pull()
+
+    mb = Mailbox()
+    mb.next_gid = 0x27A0000000000000  # gids (and Message-IDs) unlike the account
+    for _ in range(5):
+        mb.add(labels=["INBOX"])
+
+    shared = list(account.fake.mailbox.messages.values())[:3]
+    for m in shared:
+        mb.add(labels=["INBOX", "UNREAD"], raw=m["raw"])
+
+    fake = FakeGmail(mb)
+
+    path = os.path.join(os.path.dirname(account.local.wd), "other")
+    for d in ("cur", "new", "tmp"):
+        os.makedirs(os.path.join(path, "mail", d))
+    with open(os.path.join(path, ".gmailieer.json"), "w") as fd:
+        fd.write('{"account": "other"}')
+
+    other = lieer.Repository(path)
+    other.remote.service = fake.service()
+    other.remote.new_http = fake.http
+    other.remote.authorized = True
+    other.fake = fake
+    other.shared = [m["id"] for m in shared]
+
+    yield (account, other)
+
+    other.close()
+    fake.close()
+
+
+def test_pull_dedupe(accounts):
+    import notmuch2
+
+    (account, other) = accounts
+    other.local.config.set_dedupe_message_id(True)
+    other.pull()
+
+    # metadata for every message, raw only for those not in the account
+    assert other.fake.calls["messages.get"] == 5 * 2 + 3
+    assert other.local.metrics.counters["messages_deduplicated"] == 3
+
+    by_raw = {m["raw"]: gid for gid, m in other.fake.mailbox.messages.items()}
+    for gid in other.shared:
+        raw = account.fake.mailbox.messages[gid]["raw"]
+        linked = os.path.join(other.local.md, other.local.gids[by_raw[raw]])
+        original = os.path.join(account.local.md, account.local.gids[gid])
+        with open(linked, "rb") as a, open(original, "rb") as b:
+            assert a.read() == b.read()
+
+    with notmuch2.Database() as db:
+        assert db.count_messages("path:other/**") == 8
+        m = db.find("%s@lieer.example.com" % other.shared[0])
+        assert len(list(m.filenames())) == 2
+        assert "unread" in m.tags
+
+
+def test_pull_no_dedupe(accounts):
+    (_, other) = accounts
+    other.pull()
+
+    assert other.fake.calls["messages.get"] == 8
+    assert "messages_deduplicated" not in other.local.metrics.counters
@@ -0,0 +1,95 @@
+import os
+from pathlib import Path
+
+import pytest
+
+import lieer
+
+
+@pytest.fixture
+def fsyncs(monkeypatch):
+    """
+    The paths written to disk with fsync.
+    """
+    synced = []
+    fsync = os.fsync
+
+    def _fsync(fd):
+        synced.append(os.readlink("/proc/self/fd/%d" % fd))
+        fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", _fsync)
+    return synced
+
+
+def test_set_durability(local):
+    local.config.set_durability("batch")
+    assert lieer.Local.Config(local.config_f).durability == "batch"
+
+    with pytest.raises(ValueError):
+        local.config.set_durability("always")
+
+
+def test_flush(local, fsyncs):
+    md = local.md
+    for gid, f in (("a", "cur/a:2,S"), ("b", "new/b")):
+        (Path(md) / f).write_bytes(b"")
+        local.gids[gid] = f
+
+    local.written("a")
+    local.touched("cur/a:2,S")
+    local.flush()
+    assert fsyncs == []
+
+    local.config.set_durability("batch")
+    local.written("a")
+    local.written("b")
+
+    # moved to cur (maildir flags) since it was written
+    os.rename(Path(md) / "new/b", Path(md) / "cur/b:2,")
+    local.gids["b"] = "cur/b:2,"
+    local.touched("new/b", "cur/b:2,")
+
+    del fsyncs[:]
+    local.flush()
+
+    assert fsyncs == [
+        md + "/cur/a:2,S",
+        md + "/cur/b:2,",
+        md + "/cur",
+        md + "/new",
+    ]
+    assert local.unflushed == []
+    assert local.unflushed_dirs == set()
+
+    # removed
+    os.unlink(Path(md) / "cur/a:2,S")
+    local.touched("cur/a:2,S")
+
+    del fsyncs[:]
+    local.flush()
+    assert fsyncs == [md + "/cur"]
+
+
+def test_state_fsync(local, fsyncs):
+    local.state.set_last_history_id(1)
+    assert fsyncs == []
+
+    local.config.set_durability("batch")
+    del fsyncs[:]
+    local.state.set_last_history_id(2)
+
+    assert local.wd in fsyncs
+    assert len(fsyncs) == 2
+
+
+def test_pull_durability(account, fsyncs):
+    account.local.config.set_durability("batch")
+    account.pull()
+
+    for f in account.local.files:
+        assert os.path.join(account.local.md, f) in fsyncs
+
+    # every file once
+    files = [f for f in fsyncs if os.path.dirname(f).endswith("/cur")]
+    assert len(files) == len(set(files))
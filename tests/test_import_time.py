@@ -0,0 +1,110 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+GMI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gmi")
+
+# dependencies that should only be imported on the code paths that need them
+HEAVY = (
+    "googleapiclient",
+    "apiclient",
+    "google.oauth2",
+    "google.auth.transport.requests",
+    "google_auth_oauthlib",
+    "notmuch2",
+    "tqdm",
+)
+
+# budget for the cumulative import time of lieer in milliseconds
+BUDGET_MS = float(os.environ.get("LIEER_IMPORT_BUDGET_MS", 100))
+
+# budget for running a subcommand on a small repository, including the start-up of
+# python, in milliseconds
+RUN_BUDGET_MS = float(os.environ.get("LIEER_RUN_BUDGET_MS", 1000))
+
+SUBCOMMANDS = (
+    "pull",
+    "reconcile",
+    "backfill",
+    "hydrate",
+    "import-takeout",
+    "export",
+    "import",
+    "migrate-layout",
+    "push",
+    "send",
+    "sync",
+    "sync-all",
+    "watch",
+    "auth",
+    "init",
+    "set",
+)
+
+
+def importtime(*args):
+    """
+    Run python with -X importtime, returns a map of module to cumulative import time
+    in milliseconds.
+    """
+    p = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", *args],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(GMI),
+    )
+
+    modules = {}
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        (_, cumulative, name) = line.split("|")
+        modules[name.strip()] = int(cumulative) / 1000.0
+
+    return modules
+
+
+@pytest.mark.parametrize("subcommand", SUBCOMMANDS)
+def test_subcommand_import_time(subcommand):
+    modules = importtime(GMI, subcommand, "--help")
+
+    heavy = [m for m in modules if m.startswith(HEAVY)]
+    assert heavy == [], "%s imports heavy dependencies at start-up" % subcommand
+
+    assert modules["lieer"] < BUDGET_MS, (
+        "import time budget exceeded: %.1f ms" % (modules["lieer"])
+    )
+
+
+def test_modules_import_lazily():
+    modules = importtime(
+        "-c",
+        "import lieer.local, lieer.remote, lieer.resume, lieer.nobar, lieer.repository",
+    )
+
+    heavy = [m for m in modules if m.startswith(HEAVY)]
+    assert heavy == []
+
+
+def test_subcommand_run_time(account):
+    account.pull()
+    account.close()
+
+    start = time.perf_counter()
+    modules = importtime(GMI, "set", "-C", account.local.wd)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    # the repository is loaded, but GMail is not needed
+    heavy = [
+        m for m in modules if m.startswith(HEAVY) and m.split(".")[0] != "notmuch2"
+    ]
+    assert heavy == [], "set imports: %s" % ", ".join(heavy)
+
+    assert "notmuch2" in modules
+    assert modules["lieer"] < BUDGET_MS
+    assert elapsed < RUN_BUDGET_MS, "run time budget exceeded: %.1f ms" % elapsed
@@ -0,0 +1,139 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from lieer.archive import Archive
+
+
+def test_maildir(local):
+    assert local.maildir("17a0000000001f3c") == ""
+    assert local.maildir("17a0000000001f3c", "sharded") == "3c"
+
+    local.config.set_maildir_layout("sharded")
+    assert local.maildir("17a0000000001f3c") == "3c"
+
+    with pytest.raises(ValueError):
+        local.config.set_maildir_layout("nested")
+
+
+def test_load_cache(local):
+    md = local.md
+    open(os.path.join(md, "cur", "17a0000000000001:2,S"), "w").close()
+
+    local.config.set_maildir_layout("sharded")
+    for gid in ("17a000000000003c", "17a000000000013c", "17a00000000000ff"):
+        local.make_maildir(gid[-2:])
+        open(os.path.join(md, gid[-2:], "cur", gid + ":2,"), "w").close()
+
+    # not maildirs of the layout
+    os.makedirs(os.path.join(md, "other", "cur"))
+    os.makedirs(os.path.join(md, "3C", "cur"))
+
+    assert local.maildirs() == ["", "3c", "ff"]
+    assert len(local.cache_stamp()) == 6
+
+    local.__load_cache__()
+    assert local.gids == {
+        "17a0000000000001": "cur/17a0000000000001:2,S",
+        "17a000000000003c": "3c/cur/17a000000000003c:2,",
+        "17a000000000013c": "3c/cur/17a000000000013c:2,",
+        "17a00000000000ff": "ff/cur/17a00000000000ff:2,",
+    }
+
+
+def test_remove_empty_shards(local):
+    local.make_maildir("3c")
+    local.make_maildir("ff")
+    open(os.path.join(local.md, "ff", "new", "17a00000000000ff:2,"), "w").close()
+
+    local.remove_empty_shards()
+    assert local.maildirs() == ["", "ff"]
+
+
+def test_archive_sharded(tmp_path):
+    archive = str(tmp_path / "archive.tar")
+    with tarfile.open(archive, "w") as tar:
+        j = b'{"version": 1, "tags": {}}'
+        info = tarfile.TarInfo(Archive.TAGS)
+        info.size = len(j)
+        tar.addfile(info, io.BytesIO(j))
+
+        for name in ("mail/3c", "mail/3c/cur", "mail/3c/new", "mail/3c/tmp"):
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.DIRTYPE
+            tar.addfile(info)
+
+        tar.addfile(tarfile.TarInfo("mail/3c/cur/17a000000000003c:2,"))
+
+    Archive(archive).extract(str(tmp_path / "imported"))
+    assert (tmp_path / "imported/mail/3c/cur/17a000000000003c:2,").exists()
+
+
+@pytest.fixture
+def sharded(account):
+    account.local.config.set_maildir_layout("sharded")
+    account.pull()
+    return account
+
+
+def test_pull_sharded(sharded):
+    import notmuch2
+
+    local = sharded.local
+    n = len(sharded.fake.mailbox.messages)
+
+    assert len(local.gids) == n
+    for gid, f in local.gids.items():
+        assert f == os.path.join(gid[-2:], "cur", os.path.basename(f))
+        assert os.path.exists(os.path.join(local.md, f))
+
+    gids = dict(local.gids)
+    local.__load_cache__()
+    assert local.gids == gids
+
+    with notmuch2.Database() as db:
+        assert db.count_messages("path:%s/**" % local.nm_relative) == n
+
+    # pushing finds the changed messages in the shards
+    mb = sharded.fake.mailbox
+    gid = next(g for g, m in mb.messages.items() if "STARRED" not in m["labelIds"])
+    with local.write_db() as db:
+        db.find("%s@lieer.example.com" % gid).tags.add("flagged")
+
+    sharded.push()
+    assert "STARRED" in mb.messages[gid]["labelIds"]
+
+
+def test_migrate_layout(sharded):
+    import notmuch2
+
+    local = sharded.local
+
+    with notmuch2.Database() as db:
+        tags = {
+            gid: set(db.find("%s@lieer.example.com" % gid).tags) for gid in local.gids
+        }
+
+    sharded.migrate_layout("flat")
+    assert local.config.maildir_layout == "flat"
+    assert local.maildirs() == [""]
+
+    for gid, f in local.gids.items():
+        assert f.startswith("cur/")
+
+    sharded.migrate_layout("sharded")
+
+    with notmuch2.Database() as db:
+        for gid, f in local.gids.items():
+            assert f.startswith(gid[-2:] + "/cur/")
+
+            m = db.find("%s@lieer.example.com" % gid)
+            assert set(m.tags) == tags[gid]
+            assert [local.relative(p) for p in m.filenames()] == [f]
+
+    # nothing to do
+    sharded.fake.reset_counters()
+    sharded.pull()
+    assert sharded.fake.calls["messages.get"] == 0
@@ -0,0 +1,193 @@
+"""
+Memory use of pull and push at several mailbox sizes, measured with tracemalloc.
+
+Message bodies should be streamed to the maildir a batch at a time, so the
+peak memory may only grow with the mailbox by the little metadata kept for
+every message (ids, the local cache), never by the message bodies. Set
+LIEER_MEMORY_SIZES to a comma separated list of mailbox sizes (default
+200,1000) and LIEER_BENCH_OUTPUT to keep the results.
+"""
+
+import os
+import tracemalloc
+
+import pytest
+
+import lieer
+
+from .conftest import MockGmi, make_account
+from .fakegmail import FakeGmail, Mailbox
+from .test_benchmark import maxrss, report, reset_maxrss
+
+SIZES = sorted(
+    int(n) for n in os.environ.get("LIEER_MEMORY_SIZES", "200,1000").split(",")
+)
+
+# large bodies, so that keeping them around is not lost in the noise
+BODY_SIZE = 8000
+
+# bytes of peak memory allowed per additional message in the mailbox
+PER_MESSAGE = 2048
+
+# ceiling for fetching messages in batches, independent of the number of messages
+BATCH_CEILING = 16 * 1024 * 1024
+
+
+def traced(func):
+    """
+    Run func, returns the peak of memory allocated while running in bytes.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        (_, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak
+
+
+def record(scenario, n, peak, rss):
+    report(
+        {
+            "scenario": "memory-" + scenario,
+            "size": n,
+            "peak": peak,
+            "maxrss": rss,
+        }
+    )
+
+
+def check_growth(peaks):
+    """
+    The peak may only grow by PER_MESSAGE bytes for each message.
+    """
+    (n0, p0) = peaks[0]
+    (n1, p1) = peaks[-1]
+
+    growth = (p1 - p0) / (n1 - n0)
+    assert growth < PER_MESSAGE, "peak grows by %d bytes per message" % growth
+
+
+def measure(scenario, prepare, func):
+    """
+    Measure func at every mailbox size, prepare(n) returns the argument for func.
+    """
+    if len(SIZES) < 2:
+        pytest.skip("need at least two sizes to measure growth")
+
+    peaks = []
+    for n in SIZES:
+        arg = prepare(n)
+        per_size = reset_maxrss()
+        peak = traced(lambda: func(arg))
+        record(scenario, n, peak, maxrss() if per_size else None)
+        peaks.append((n, peak))
+
+    check_growth(peaks)
+    return peaks
+
+
+@pytest.fixture
+def remotes(tmp_path):
+    """
+    Returns a function making a Remote connected to a fake GMail server with a
+    mailbox of n messages.
+    """
+    fakes = []
+
+    def make(n):
+        fake = FakeGmail(Mailbox(size=n, body_size=BODY_SIZE))
+        fakes.append(fake)
+
+        gmi = MockGmi()
+        gmi.local = lieer.Local(gmi, tmp_path / str(n))
+        gmi.local.config = lieer.Local.Config(gmi.local.config_f)
+        gmi.local.config.account = "me"
+        gmi.local.loaded = True
+
+        r = lieer.Remote(gmi)
+        r.service = fake.service()
+        r.authorized = True
+        return (r, list(fake.mailbox.messages))
+
+    yield make
+
+    for fake in fakes:
+        fake.close()
+
+
+def test_get_messages(remotes):
+    def get(arg):
+        (r, gids) = arg
+        r.get_messages(gids, lambda _: None, "raw")
+
+    peaks = measure("get_messages", remotes, get)
+
+    # only one batch is held at a time
+    assert max(p for _, p in peaks) < BATCH_CEILING
+
+
+def test_all_messages(remotes):
+    def list_all(arg):
+        (r, _) = arg
+        for _ in r.all_messages():
+            pass
+
+    peaks = measure("all_messages", remotes, list_all)
+
+    # only one page of message ids is held at a time
+    assert max(p for _, p in peaks) < BATCH_CEILING
+
+
+@pytest.fixture
+def accounts(tmp_path, monkeypatch):
+    """
+    Returns a function making a repository in a fresh notmuch database connected to
+    a fake GMail server with a mailbox of n messages.
+    """
+    pytest.importorskip("notmuch2")
+    repos = []
+
+    def make(n):
+        fake = FakeGmail(Mailbox(size=n, body_size=BODY_SIZE))
+        root = tmp_path / str(n)
+        root.mkdir()
+        repo = make_account(root, fake, monkeypatch)
+        repos.append(repo)
+        return repo
+
+    yield make
+
+    for repo in repos:
+        repo.close()
+        repo.fake.close()
+
+
+def test_full_pull(accounts):
+    measure("full_pull", accounts, lambda repo: repo.pull())
+
+
+def test_partial_pull(accounts):
+    def prepare(n):
+        repo = accounts(n)
+        repo.pull()
+
+        repo.fake.mailbox.churn(n // 2)
+        return repo
+
+    measure("partial_pull", prepare, lambda repo: repo.pull())
+
+
+def test_push(accounts):
+    def prepare(n):
+        repo = accounts(n)
+        repo.pull()
+
+        with repo.local.write_db() as db, db.atomic():
+            for m in db.messages("path:%s/**" % repo.local.nm_relative):
+                m.tags.add("memory")
+
+        return repo
+
+    measure("push", prepare, lambda repo: repo.push())
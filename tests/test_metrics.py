@@ -0,0 +1,105 @@
+import json
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import lieer
+from lieer.metrics import Metrics
+
+from .faults import Clock as SimulatedClock
+from .faults import Faults
+
+
+class Clock:
+    now = 0.0
+
+    def perf_counter(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+def test_phases_exclusive(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("lieer.metrics.time", clock)
+    m = Metrics()
+
+    with m.phase("content"):
+        clock.now += 2
+        with m.phase("notmuch_write"):
+            clock.now += 3
+        clock.now += 1
+        with m.phase("notmuch_write"):
+            clock.now += 1
+
+    assert m.phases == {"content": 3, "notmuch_write": 4}
+
+
+def test_remote_counters(remote, fakegmail, monkeypatch):
+    monkeypatch.setattr(lieer.remote, "time", SimulatedClock())
+    fakegmail.fault = Faults([(0, 1, 403, 0.5), (1, 2, 503, None)])
+    gids = list(fakegmail.mailbox.messages)
+
+    remote.get_messages(gids, lambda _: None, "minimal")
+
+    c = remote.metrics.counters
+    assert c["sub_requests"] == len(gids) + c["retries"]
+    assert c["rate_limited"] > 0
+    assert c["server_errors"] == 1
+    assert c["requests"] == 3
+
+
+def report(remote, tmp_path):
+    g = SimpleNamespace(
+        args=SimpleNamespace(action="sync"), path=str(tmp_path), remote=remote
+    )
+    return remote.metrics.report(g, "ok")
+
+
+def test_json(remote, fakegmail, tmp_path):
+    remote.get_current_history_id()
+    r = report(remote, tmp_path)
+
+    f = tmp_path / "stats.json"
+    remote.metrics.write_json(str(f), r)
+    stats = json.loads(f.read_text())
+
+    assert stats["command"] == "sync"
+    assert stats["status"] == "ok"
+    assert stats["calls"] == {"gmail.users.getProfile": 1}
+    assert stats["counters"]["quota_units"] == 1
+
+
+def test_prometheus(remote, fakegmail, tmp_path):
+    remote.get_current_history_id()
+    with remote.metrics.phase("history"):
+        pass
+    r = report(remote, tmp_path)
+
+    f = tmp_path / "lieer.prom"
+    remote.metrics.write_prometheus(str(f), r)
+    lines = f.read_text().splitlines()
+
+    labels = 'repository="%s",command="sync"' % tmp_path
+    assert "lieer_last_run_success{%s} 1" % labels in lines
+    assert "lieer_requests{%s} 1" % labels in lines
+    assert 'lieer_api_calls{%s,method="gmail.users.getProfile"} 1' % labels in lines
+    assert any(
+        l.startswith('lieer_phase_seconds{%s,phase="history"}' % labels) for l in lines
+    )
+    assert not (tmp_path / "lieer.prom.tmp").exists()
+
+
+def test_exit_status(tmp_path, monkeypatch):
+    def _exit(self, args):
+        sys.exit(0)
+
+    monkeypatch.setattr(lieer.Gmailieer, "set", _exit)
+    f = tmp_path / "stats.json"
+
+    with pytest.raises(SystemExit):
+        lieer.Gmailieer().main(["set", "--stats", str(f)])
+
+    assert json.loads(f.read_text())["status"] == "ok"
@@ -0,0 +1,132 @@
+"""
+Benchmarks of the local store, run with:
+
+  pytest --benchmark -s tests/test_microbenchmark.py
+
+LIEER_BENCH_SCALE is a comma separated list of corpus sizes (default 10000),
+e.g. 10000,100000,1000000. Results are reported like the other benchmarks.
+"""
+
+import os
+import platform
+import time
+
+import pytest
+
+from .conftest import make_account
+from .corpus import corpus
+from .fakegmail import FakeGmail, Mailbox
+from .test_benchmark import report
+
+pytestmark = pytest.mark.benchmark
+
+SCALES = [int(n) for n in os.environ.get("LIEER_BENCH_SCALE", "10000").split(",")]
+
+# messages stored per notmuch transaction, like a batch from the remote
+CHUNK = 50
+
+
+def measure(name, n, func):
+    start = time.perf_counter()
+    result = func()
+    duration = time.perf_counter() - start
+
+    report(
+        {
+            "scenario": name,
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "size": n,
+            "duration": round(duration, 4),
+            "per_sec": round(n / duration, 2) if duration else None,
+        }
+    )
+    return result
+
+
+@pytest.fixture(scope="module", params=SCALES, ids=lambda n: "n=%d" % n)
+def store(request, tmp_path_factory):
+    """
+    A repository with n messages from the corpus, stored with `Local.store`.
+    """
+    n = request.param
+    fake = FakeGmail(Mailbox())
+    mp = pytest.MonkeyPatch()
+    repo = make_account(tmp_path_factory.mktemp("micro"), fake, mp)
+    local = repo.local
+
+    def _store():
+        messages = corpus(n)
+        while True:
+            chunk = [m for _, m in zip(range(CHUNK), messages)]
+            if not chunk:
+                break
+
+            with local.write_db() as db, db.atomic():
+                for m in chunk:
+                    local.store(m, db)
+
+    measure("local.store", n, _store)
+
+    yield (n, repo)
+
+    repo.close()
+    fake.close()
+    mp.undo()
+
+
+def test_load_cache(store):
+    (n, repo) = store
+    measure("local.load_cache", n, repo.local.__load_cache__)
+
+    assert len(repo.local.gids) == n
+
+
+def test_update_tags(store):
+    (n, repo) = store
+    local = repo.local
+
+    def _update():
+        messages = corpus(n)
+        with local.write_db() as db, db.atomic():
+            for m in messages:
+                m["labelIds"] = sorted(set(m["labelIds"]) ^ {"STARRED"})
+                local.update_tags(m, None, db)
+
+    measure("local.update_tags", n, _update)
+
+
+def test_messages_to_gids(store):
+    import notmuch2
+
+    (n, repo) = store
+
+    with notmuch2.Database() as db:
+        messages = list(db.messages("path:%s/**" % repo.local.nm_relative))
+        (_, gids) = measure(
+            "local.messages_to_gids", n, lambda: repo.local.messages_to_gids(messages)
+        )
+
+    assert len(gids) == n
+
+
+def test_contains(store):
+    (n, repo) = store
+    local = repo.local
+    files = [os.path.join(local.md, f) for f in local.files]
+
+    found = measure("local.contains", n, lambda: sum(map(local.contains, files)))
+    assert found == n
+
+
+def test_filename_to_gid(store):
+    (n, repo) = store
+    local = repo.local
+    names = [os.path.basename(f) for f in local.files]
+
+    gids = measure(
+        "local.filename_to_gid",
+        n,
+        lambda: [local.__filename_to_gid__(f) for f in names],
+    )
+    assert None not in gids
@@ -0,0 +1,33 @@
+import io
+import pstats
+
+from lieer.metrics import Metrics
+from lieer.profiling import Profile
+
+
+def work():
+    m = Metrics()
+    for _ in range(1000):
+        with m.phase("list"):
+            m.count("requests")
+    return sorted(str(i) for i in range(10000))
+
+
+def test_profile(tmp_path):
+    f = tmp_path / "gmi.pstats"
+    out = io.StringIO()
+
+    with Profile(str(f), top=5, file=out):
+        work()
+
+    stats = pstats.Stats(str(f))
+    assert any(name == "work" for (_, _, name) in stats.stats)
+
+    summary = out.getvalue().splitlines()
+    assert summary[0] == "profile: written to %s" % f
+    assert "s in lieer" in summary[1]
+
+    # only our own functions are listed
+    functions = summary[4:]
+    assert 0 < len(functions) <= 5
+    assert all(" lieer.metrics:" in l for l in functions)
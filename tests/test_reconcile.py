@@ -0,0 +1,51 @@
+def test_reconcile_unchanged(synced):
+    synced.reconcile()
+
+    # only the label counts are compared
+    assert set(synced.remote.calls) == {
+        "gmail.users.labels.list",
+        "gmail.users.labels.get",
+    }
+
+
+def test_reconcile_local_drift(synced):
+    import notmuch2
+
+    with synced.local.write_db() as db:
+        m = next(iter(db.messages(synced.local.tag_query("inbox"))))
+        m.tags.discard("inbox")
+        mid = m.messageid
+
+    synced.reconcile()
+
+    # not pushed yet, the local change is kept
+    assert synced.remote.calls["gmail.users.messages.list"] == 1
+    assert "gmail.users.messages.get" not in synced.remote.calls
+
+    with notmuch2.Database() as db:
+        assert "inbox" not in db.find(mid).tags
+
+        # a change that was lost rather than made locally
+        synced.local.state.set_lastmod(db.revision().rev)
+
+    synced.remote.calls.clear()
+    synced.reconcile()
+
+    assert synced.remote.calls["gmail.users.messages.get"] == 1
+
+    with notmuch2.Database() as db:
+        assert "inbox" in db.find(mid).tags
+
+
+def test_reconcile_remote_drift(synced):
+    import notmuch2
+
+    mb = synced.fake.mailbox
+    gid = next(g for g, m in mb.messages.items() if "STARRED" not in m["labelIds"])
+    mb.modify(gid, add=["STARRED"])
+    mb.expire_history()
+
+    synced.reconcile()
+
+    with notmuch2.Database() as db:
+        assert "flagged" in db.find("%s@lieer.example.com" % gid).tags
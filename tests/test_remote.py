@@ -0,0 +1,198 @@
+import base64
+import time
+
+import lieer
+
+from .faults import Clock
+
+
+def test_all_messages(remote, fakegmail):
+    gids = [m["id"] for _, page in remote.all_messages() for m in page]
+
+    expected = [
+        m["id"]
+        for m in fakegmail.mailbox.messages.values()
+        if "CHAT" not in m["labelIds"]
+    ]
+    assert sorted(gids) == sorted(expected)
+
+
+def test_shards(remote, fakegmail):
+    shards = remote.shards(4)
+
+    assert len(shards) == 4
+    assert shards[0][0] is None
+    assert shards[-1][1] is None
+    for (_, before, _), (after, _, _) in zip(shards, shards[1:]):
+        assert before == after
+
+    # every message is in a shard
+    assert sum(e for _, _, e in shards) >= len(fakegmail.mailbox.messages)
+
+
+class FrozenTime:
+    """
+    The time module, with time() fixed so that shards are the same on every call.
+    """
+
+    def __init__(self):
+        self.now = time.time()
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+    def time(self):
+        return self.now
+
+
+def test_all_messages_sharded(remote, fakegmail, monkeypatch):
+    monkeypatch.setattr(lieer.remote, "time", FrozenTime())
+    mb = fakegmail.mailbox
+
+    # a message exactly on a boundary between shards is listed once
+    boundary = remote.shards(2)[0][1]
+    m = mb.add(labels=["INBOX"])
+    m["internalDate"] = str(boundary * 1000)
+    remote.calls.clear()
+
+    gids = [m["id"] for _, page in remote.all_messages(shards=4) for m in page]
+
+    assert sorted(gids) == sorted(remote_ids(remote))
+    assert gids.count(m["id"]) == 1
+    assert remote.calls["gmail.users.messages.list"] >= 4
+
+
+def test_all_messages_sharded_rate_limited(remote, fakegmail, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(lieer.remote, "time", clock)
+    expected = remote_ids(remote)
+
+    failed = []
+
+    def fault(name, sub_request):
+        if name == "messages.list" and len(failed) < 6:
+            failed.append(name)
+            return (429, "rateLimitExceeded")
+        return None
+
+    fakegmail.fault = fault
+    gids = [m["id"] for _, page in remote.all_messages(shards=4) for m in page]
+
+    # the failed pages are retried after backing off
+    assert sorted(gids) == sorted(expected)
+    assert len(failed) == 6
+    assert clock.slept > 0
+
+
+def remote_ids(remote):
+    return [m["id"] for _, page in remote.all_messages() for m in page]
+
+
+def test_get_messages(remote, fakegmail):
+    gids = list(fakegmail.mailbox.messages)
+    got = []
+
+    remote.get_messages(gids, got.extend, "raw")
+
+    assert sorted(m["id"] for m in got) == sorted(gids)
+    for m in got:
+        raw = base64.urlsafe_b64decode(m["raw"])
+        assert raw == fakegmail.mailbox.messages[m["id"]]["raw"]
+
+    # one list of messages per batch
+    assert fakegmail.calls["messages.get"] == len(gids)
+    assert fakegmail.requests == -(-len(gids) // remote.BATCH_REQUEST_SIZE)
+
+
+def test_get_messages_missing(remote, fakegmail):
+    gids = list(fakegmail.mailbox.messages)[:3]
+    fakegmail.mailbox.delete(gids[1])
+    got = []
+
+    remote.get_messages(gids, got.extend, "minimal")
+
+    assert [m["id"] for m in got] == [gids[0], gids[2]]
+
+
+def test_get_threads(remote, fakegmail):
+    mb = fakegmail.mailbox
+    got = []
+
+    remote.get_threads(list(mb.threads), got.extend)
+
+    assert sorted(t["id"] for t in got) == sorted(mb.threads)
+    for t in got:
+        assert [m["id"] for m in t["messages"]] == mb.threads[t["id"]]
+        for m in t["messages"]:
+            assert m["labelIds"] == mb.messages[m["id"]]["labelIds"]
+
+
+def test_all_threads(remote, fakegmail):
+    mb = fakegmail.mailbox
+    mb.modify(next(iter(mb.messages)), add=["STARRED"])
+
+    threads = {t["id"]: t["historyId"] for page in remote.all_threads() for t in page}
+
+    assert sorted(threads) == sorted(mb.threads)
+    for tid, gids in mb.threads.items():
+        assert int(threads[tid]) == max(int(mb.messages[g]["historyId"]) for g in gids)
+
+
+def test_all_messages_label(remote, fakegmail):
+    gids = [
+        m["id"] for _, page in remote.all_messages(label_ids=["INBOX"]) for m in page
+    ]
+
+    assert sorted(gids) == sorted(
+        fakegmail.mailbox.search("in:inbox -in:chats", include_spam_trash=True)
+    )
+
+
+def test_get_label_counts(remote, fakegmail):
+    mb = fakegmail.mailbox
+    got = []
+
+    remote.get_label_counts(["INBOX", "Label_1"], got.extend)
+
+    counts = {l["id"]: l["messagesTotal"] for l in got}
+    for lid in ("INBOX", "Label_1"):
+        assert counts[lid] == len(
+            [m for m in mb.messages.values() if lid in m["labelIds"]]
+        )
+
+
+def test_history(remote, fakegmail):
+    mb = fakegmail.mailbox
+    start = remote.get_current_history_id()
+    assert start == mb.history_id
+
+    m = mb.add()
+    mb.modify(m["id"], add=["STARRED"])
+
+    history = [h for page in remote.get_history_since(start) for h in page]
+    assert [list(h)[-1] for h in history] == ["messagesAdded", "labelsAdded"]
+    assert remote.is_history_id_valid(start)
+
+    mb.expire_history()
+    assert not remote.is_history_id_valid(start)
+
+
+def test_push_changes(remote, fakegmail):
+    remote.get_labels()
+    gid = next(iter(fakegmail.mailbox.messages))
+
+    actions = [
+        remote.__push_tags__(gid, ["label1"], []),
+    ]
+    done = []
+    remote.push_changes(actions, lambda resp: done.append(resp))
+
+    assert "Label_1" in fakegmail.mailbox.messages[gid]["labelIds"]
+    assert fakegmail.calls["messages.modify"] == 1
+
+
+def test_send(remote, fakegmail):
+    msg = remote.send(b"Subject: test\r\n\r\nhello\r\n")
+
+    assert fakegmail.mailbox.messages[msg["id"]]["labelIds"] == ["SENT"]
+    assert fakegmail.mailbox.messages[msg["id"]]["raw"].endswith(b"hello\r\n")
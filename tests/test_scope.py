@@ -0,0 +1,116 @@
+import time
+
+import pytest
+
+import lieer
+
+
+@pytest.fixture
+def scoped(gmi, fakegmail, tmp_path):
+    """
+    Returns a function making a Remote with the scope settings given.
+    """
+
+    def make(**settings):
+        gmi.local = lieer.Local(gmi, tmp_path)
+        gmi.local.config = lieer.Local.Config(gmi.local.config_f)
+        gmi.local.config.account = "me"
+        for k, v in settings.items():
+            setattr(gmi.local.config, k, v)
+        gmi.local.loaded = True
+
+        r = lieer.Remote(gmi)
+        r.service = fakegmail.service()
+        r.new_http = fakegmail.http
+        r.authorized = True
+        return r
+
+    return make
+
+
+def listed(remote):
+    return sorted(m["id"] for _, page in remote.all_messages() for m in page)
+
+
+def test_default_scope(scoped, fakegmail):
+    r = scoped()
+
+    assert r.query == "-in:chats"
+    assert r.include_spam_trash
+    assert listed(r) == sorted(fakegmail.mailbox.messages)
+    assert all(r.in_scope(m) for m in fakegmail.mailbox.messages.values())
+
+
+def test_scope_query(scoped):
+    r = scoped(
+        scope_labels={"INBOX", "label1"},
+        scope_exclude_labels={"my label"},
+        max_age_days=30,
+    )
+
+    assert r.query == (
+        "-in:chats {label:INBOX label:label1} -label:my-label newer_than:30d"
+    )
+
+
+def test_scope_labels(scoped, fakegmail):
+    mb = fakegmail.mailbox
+    r = scoped(scope_labels={"INBOX", "label1"}, scope_exclude_labels={"label2"})
+
+    expected = sorted(
+        g
+        for g, m in mb.messages.items()
+        if {"INBOX", "Label_1"} & set(m["labelIds"]) and "Label_2" not in m["labelIds"]
+    )
+    assert expected
+    assert listed(r) == expected
+    assert sorted(g for g, m in mb.messages.items() if r.in_scope(m)) == expected
+
+
+def test_exclude_spam_trash(scoped, fakegmail):
+    mb = fakegmail.mailbox
+    gid = next(iter(mb.messages))
+    mb.modify(gid, add=["SPAM"])
+
+    r = scoped(exclude_spam_trash=True)
+
+    assert gid not in listed(r)
+    assert not r.in_scope(mb.messages[gid])
+
+
+def test_max_age(scoped, fakegmail):
+    mb = fakegmail.mailbox
+    r = scoped(max_age_days=30)
+
+    # the synthetic mailbox is from 2010
+    assert listed(r) == []
+    assert not r.in_scope(next(iter(mb.messages.values())))
+
+    m = mb.add(labels=["INBOX"])
+    m["internalDate"] = str(int(time.time() * 1000))
+    assert listed(r) == [m["id"]]
+    assert r.in_scope(m)
+
+    # messages without a date (e.g. in the history) are assumed to be in scope
+    assert r.in_scope({"id": "x", "labelIds": ["INBOX"]})
+
+
+def test_partial_pull_leaving_scope(account):
+    import notmuch2
+
+    account.local.config.scope_labels = {"INBOX"}
+    account.remote.scope_labels = {"INBOX"}
+    account.remote.query = account.remote.__scope_query__()
+    account.pull()
+
+    mb = account.fake.mailbox
+    inbox = [g for g, m in mb.messages.items() if "INBOX" in m["labelIds"]]
+    assert sorted(account.local.gids) == sorted(inbox)
+
+    # a message leaving the scope is removed
+    mb.modify(inbox[0], remove=["INBOX"])
+    account.pull()
+
+    assert inbox[0] not in account.local.gids
+    with notmuch2.Database() as db:
+        assert db.count_messages("path:account/**") == len(inbox) - 1
@@ -0,0 +1,99 @@
+import email
+import os
+import time
+
+import pytest
+
+import lieer
+
+
+def test_make_stub(fakegmail):
+    mb = fakegmail.mailbox
+    m = mb.resource(next(iter(mb.messages.values())), "metadata")
+
+    stub = email.message_from_bytes(lieer.Local.make_stub(m))
+
+    assert stub["Message-ID"] == "<%s@lieer.example.com>" % m["id"]
+    assert stub["X-Lieer-Stub"] == m["id"]
+    assert stub.get_content_type() == "text/plain"
+    assert "gmi hydrate" in stub.get_payload()
+
+
+@pytest.fixture
+def stubbed(account):
+    """
+    A repository where only the bodies of messages from the last week are stored.
+    """
+    mb = account.fake.mailbox
+    recent = mb.add(labels=["INBOX"])
+    recent["internalDate"] = str(int(time.time() * 1000))
+
+    account.local.config.set_full_body_days(7)
+    account.pull()
+    account.recent = recent["id"]
+    return account
+
+
+def test_pull_stubs(stubbed):
+    import notmuch2
+
+    n = len(stubbed.fake.mailbox.messages)
+    with notmuch2.Database() as db:
+        assert db.count_messages("path:account/** and tag:lieer-stub") == n - 1
+        assert db.count_messages("id:%s@lieer.example.com" % stubbed.recent) == 1
+        m = db.find("%s@lieer.example.com" % stubbed.recent)
+        assert "lieer-stub" not in m.tags
+
+
+def test_hydrate(stubbed):
+    import notmuch2
+
+    mb = stubbed.fake.mailbox
+    gid = next(
+        g
+        for g, m in mb.messages.items()
+        if "INBOX" in m["labelIds"] and g != stubbed.recent
+    )
+
+    stubbed.hydrate("id:%s@lieer.example.com" % gid)
+
+    with notmuch2.Database() as db:
+        m = db.find("%s@lieer.example.com" % gid)
+        assert "lieer-stub" not in m.tags
+        assert "inbox" in m.tags
+
+    path = stubbed.local.md + "/" + stubbed.local.gids[gid]
+    with open(path, "rb") as fd:
+        assert fd.read() == mb.messages[gid]["raw"].replace(b"\r\n", b"\n")
+
+    # the stub tag is never pushed
+    stubbed.push()
+    assert stubbed.fake.calls["messages.modify"] == 0
+
+
+def test_hydrate_linked(stubbed):
+    import notmuch2
+
+    gid = next(g for g in stubbed.local.gids if g != stubbed.recent)
+    path = stubbed.local.md + "/" + stubbed.local.gids[gid]
+
+    # the stub is also linked from somewhere else in the database
+    other = os.path.join(os.path.dirname(stubbed.local.wd), "other", "cur")
+    os.makedirs(other)
+    link = os.path.join(other, os.path.basename(path))
+    os.link(path, link)
+    with stubbed.local.write_db() as db:
+        db.add(link)
+        db.find("%s@lieer.example.com" % gid).tags.add("kept")
+
+    stubbed.hydrate("id:%s@lieer.example.com" % gid)
+
+    with notmuch2.Database() as db:
+        m = db.find("%s@lieer.example.com" % gid)
+        assert sorted(str(f) for f in m.filenames()) == sorted([path, link])
+        assert "kept" in m.tags
+        assert "lieer-stub" not in m.tags
+
+    mb = stubbed.fake.mailbox
+    with open(path, "rb") as fd:
+        assert fd.read() == mb.messages[gid]["raw"].replace(b"\r\n", b"\n")
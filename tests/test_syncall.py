@@ -0,0 +1,146 @@
+import concurrent.futures
+import os
+import time
+
+import pytest
+
+import lieer
+
+# sync-all finds the notmuch database to derive the write lock
+syncall = pytest.importorskip("lieer.syncall")
+
+
+def repository(root, name, last_sync, last_mail, shard=None):
+    """
+    A repository last synchronized `last_sync` seconds ago, which last received
+    mail `last_mail` seconds ago (in the maildir of `shard` if given).
+    """
+    path = root / name
+    for d in ("cur", "new", "tmp"):
+        (path / "mail" / d).mkdir(parents=True)
+
+    (path / ".gmailieer.json").write_text('{"account": "%s"}' % name)
+    (path / ".state.gmailieer.json").write_text("{}")
+
+    now = time.time()
+    old = now - 10 * syncall.SyncAll.ACTIVE_PERIOD
+    os.utime(path / ".state.gmailieer.json", (now - last_sync, now - last_sync))
+    os.utime(path / "mail" / "cur", (old, old))
+
+    if shard is not None:
+        (path / "mail" / shard / "cur").mkdir(parents=True)
+    cur = path / "mail" / (shard or "") / "cur"
+    os.utime(cur, (now - last_mail, now - last_mail))
+
+    return str(path)
+
+
+def test_priority(tmp_path):
+    day = syncall.SyncAll.ACTIVE_PERIOD
+    paths = [
+        repository(tmp_path, "idle-recent", 60, 3 * day),
+        repository(tmp_path, "active", 600, 60),
+        repository(tmp_path, "idle-old", 3600, 3 * day),
+        repository(tmp_path, "active-sharded", 3600, 60, shard="3c"),
+    ]
+
+    s = syncall.SyncAll(None, paths)
+    order = [os.path.basename(p) for p in sorted(s.paths, key=s.priority)]
+
+    # active first, then the longest without a synchronization
+    assert order == ["active-sharded", "active", "idle-old", "idle-recent"]
+
+
+class Locked:
+    """
+    A repository left locked by a failed synchronization.
+    """
+
+    lckf = True
+
+    def __init__(self):
+        self.unlocked = False
+
+    def unlock(self):
+        self.unlocked = True
+        self.lckf = None
+
+
+@pytest.mark.parametrize(
+    ("exception", "error"),
+    [
+        (SystemExit(0), None),
+        (SystemExit(7), "exited with status 7"),
+        (RuntimeError("no network"), "RuntimeError: no network"),
+    ],
+)
+def test_sync_one(monkeypatch, exception, error):
+    locals_ = []
+
+    def main(self, argv):
+        assert argv == ["sync", "-C", "/account", "-q"]
+        self.local = Locked()
+        locals_.append(self.local)
+        raise exception
+
+    monkeypatch.setattr(lieer.Gmailieer, "main", main)
+
+    (path, got, duration) = syncall.sync_one("/account", ["-q"], None)
+
+    assert path == "/account"
+    assert got == error
+    assert duration >= 0
+
+    # the lock is released before the next task in the worker
+    assert locals_[0].unlocked
+
+
+def test_summary(capsys):
+    results = [
+        ("/a", None, 1.0),
+        ("/b", "exited with status 1", 2.0),
+        ("/c", None, 0.5),
+    ]
+
+    syncall.SyncAll(None, ["/a", "/b", "/c"]).summary(results, 2.5)
+
+    assert capsys.readouterr().out.splitlines() == [
+        "sync-all: 2 repositories synchronized, 1 failed, in 2.5 s (3.5 s serial time)",
+        "  /b: exited with status 1",
+    ]
+
+
+def test_sync_all_failed(tmp_path, monkeypatch, capsys):
+    paths = [
+        repository(tmp_path, "good", 60, 60),
+        repository(tmp_path, "bad", 60, 60),
+    ]
+
+    def main(self, argv):
+        if argv[2].endswith("bad"):
+            raise RuntimeError("no network")
+
+    gmi_main = lieer.Gmailieer.main
+
+    # the repositories are synchronized in threads rather than processes, so
+    # that the patched gmi is used
+    monkeypatch.setattr(
+        concurrent.futures, "ProcessPoolExecutor", concurrent.futures.ThreadPoolExecutor
+    )
+    monkeypatch.setattr(lieer.Gmailieer, "main", main)
+
+    g = lieer.Gmailieer()
+    args = [
+        "sync-all",
+        "-q",
+        "--write-lock",
+        str(tmp_path / "write.lock"),
+        *paths,
+    ]
+    with pytest.raises(SystemExit) as ex:
+        gmi_main(g, args)
+
+    assert ex.value.code == 1
+    out = capsys.readouterr().out
+    assert "1 repositories synchronized, 1 failed" in out
+    assert "%s: RuntimeError: no network" % paths[1] in out
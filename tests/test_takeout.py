@@ -0,0 +1,140 @@
+import pytest
+
+from lieer.takeout import Takeout
+
+
+def test_takeout(fakegmail, tmp_path):
+    mb = fakegmail.mailbox
+    mbox = tmp_path / "takeout.mbox"
+    mb.takeout(mbox)
+
+    invlabels = {l["name"]: lid for lid, l in mb.labels.items()}
+    got = list(Takeout(str(mbox), invlabels))
+
+    assert [m["id"] for m, _ in got] == list(mb.messages)
+    for m, content in got:
+        r = mb.messages[m["id"]]
+        assert m["threadId"] == r["threadId"]
+        assert m["internalDate"] == r["internalDate"]
+        assert sorted(m["labelIds"]) == sorted(r["labelIds"])
+        assert content == r["raw"].replace(b"\r\n", b"\n")
+
+
+def test_takeout_escaped(tmp_path):
+    mbox = tmp_path / "takeout.mbox"
+    mbox.write_bytes(
+        b"From 1597428924817653467@xxx Thu Apr 16 09:18:58 +0000 2020\n"
+        b"X-GM-THRID: 1597428924817653467\n"
+        b'X-Gmail-Labels: Inbox,Opened,"Lists,Old",\n'
+        b" Unknown\n"
+        b"Subject: escaped\n"
+        b"\n"
+        b">From the start of a line\n"
+        b">>From quoted\n"
+        b"\n"
+        b"From 1597428924817653468@xxx Thu Apr 16 09:19:58 +0000 2020\n"
+        b"Subject: next\n"
+        b"\n"
+        b"body\n"
+    )
+
+    takeout = Takeout(str(mbox), {"Lists,Old": "Label_1"})
+    ((m, content), (n, _)) = list(takeout)
+
+    assert m["id"] == "162b3524c1b0bedb"
+    assert m["threadId"] == m["id"]
+    assert m["labelIds"] == ["INBOX", "Label_1"]
+    assert m["internalDate"] == "1587028738000"
+    assert content == b"Subject: escaped\n\nFrom the start of a line\n>From quoted\n"
+
+    # a message without a thread is in its own
+    assert n["threadId"] == n["id"]
+    assert n["labelIds"] == []
+
+    assert takeout.unknown == {"Unknown": 1}
+
+
+def test_takeout_unescaped(tmp_path):
+    mbox = tmp_path / "takeout.mbox"
+    mbox.write_bytes(
+        b"From 1597428924817653467@xxx Thu Apr 16 09:18:58 +0000 2020\n"
+        b"Subject: unescaped\n"
+        b"\n"
+        b"From the start of a line\n"
+        b"\n"
+        b"From here too\n"
+        b"and\n"
+        b"From 1597428924817653468@xxx Thu Apr 16 09:19:58 +0000 2020\n"
+        b"\n"
+        b"From 1597428924817653469@xxx Thu Apr 16 09:20:58 +0000 2020\n"
+        b"Subject: next\n"
+        b"\n"
+        b"body\n"
+    )
+
+    ((m, content), (n, _)) = list(Takeout(str(mbox), {}))
+
+    assert m["id"] == "162b3524c1b0bedb"
+    assert content == (
+        b"Subject: unescaped\n"
+        b"\n"
+        b"From the start of a line\n"
+        b"\n"
+        b"From here too\n"
+        b"and\n"
+        b"From 1597428924817653468@xxx Thu Apr 16 09:19:58 +0000 2020\n"
+    )
+    assert n["id"] == "162b3524c1b0bedd"
+
+
+def test_takeout_not_takeout(tmp_path):
+    mbox = tmp_path / "other.mbox"
+    mbox.write_bytes(b"From someone@example.com Thu Apr 16 09:18:58 2020\n\nbody\n")
+
+    with pytest.raises(ValueError):
+        list(Takeout(str(mbox), {}))
+
+
+def test_import_takeout(account, tmp_path):
+    import notmuch2
+
+    mb = account.fake.mailbox
+    mbox = tmp_path / "takeout.mbox"
+    mb.takeout(mbox)
+
+    # messages and label changes after the Takeout
+    gid = next(g for g, m in mb.messages.items() if "INBOX" in m["labelIds"])
+    mb.modify(gid, remove=["INBOX"])
+    new = [mb.add(labels=["INBOX", "UNREAD"])["id"] for _ in range(3)]
+
+    account.import_takeout(str(mbox))
+    assert account.fake.calls["messages.get"] == 0
+    assert len(account.local.gids) == len(mb.messages) - 3
+
+    account.pull()
+
+    # only the new messages are downloaded
+    raw = sum(len(mb.messages[g]["raw"]) for g in mb.messages)
+    assert account.fake.bytes_out < raw / 2
+    assert set(account.local.gids) == set(mb.messages)
+
+    for g, m in mb.messages.items():
+        with open(account.local.md + "/" + account.local.gids[g], "rb") as fd:
+            assert fd.read() == m["raw"].replace(b"\r\n", b"\n")
+
+    with notmuch2.Database() as db:
+        m = db.find("%s@lieer.example.com" % gid)
+        assert "inbox" not in m.tags
+        for g in new:
+            assert "unread" in db.find("%s@lieer.example.com" % g).tags
+
+
+def test_import_takeout_pulled(account, tmp_path):
+    import lieer
+
+    mbox = tmp_path / "takeout.mbox"
+    account.fake.mailbox.takeout(mbox)
+    account.pull()
+
+    with pytest.raises(lieer.Local.RepositoryException):
+        account.import_takeout(str(mbox))
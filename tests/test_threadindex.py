@@ -0,0 +1,29 @@
+from lieer.threadindex import ThreadIndex
+
+
+def test_thread_index(tmp_path):
+    f = str(tmp_path / ".threads.gmailieer.json")
+
+    index = ThreadIndex(f)
+    assert len(index) == 0
+    assert index.changed("t1", "10")
+
+    index.save({"t1": "10", "t2": 12})
+
+    index = ThreadIndex(f)
+    assert len(index) == 2
+    assert not index.changed("t1", "10")
+    assert not index.changed("t2", "12")
+    assert index.changed("t1", "11")
+    assert index.changed("t1", None)
+    assert index.changed("t3", "10")
+
+
+def test_thread_index_invalid(tmp_path):
+    f = tmp_path / ".threads.gmailieer.json"
+    f.write_text("{")
+
+    assert len(ThreadIndex(str(f))) == 0
+
+    f.write_text('{"version": 0, "threads": {"t1": "10"}}')
+    assert len(ThreadIndex(str(f))) == 0
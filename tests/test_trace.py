@@ -0,0 +1,49 @@
+import json
+
+import lieer
+from lieer.trace import Trace
+
+from .faults import Clock, Faults
+
+
+def events(path):
+    # the file is a JSON array without the closing bracket
+    return json.loads(path.read_text().rstrip().rstrip(",") + "]")
+
+
+def test_trace(remote, fakegmail, tmp_path, monkeypatch):
+    monkeypatch.setattr(lieer.remote, "time", Clock())
+    f = tmp_path / "trace.json"
+    remote.trace = Trace(str(f))
+    remote.metrics.trace = remote.trace
+
+    fakegmail.fault = Faults([(0, 1, 429, 0.2)], seed=1)
+    gids = list(fakegmail.mailbox.messages)
+
+    remote.get_current_history_id()
+    with remote.metrics.phase("content"):
+        remote.get_messages(gids, lambda _: None, "minimal")
+    remote.trace.close()
+
+    ev = events(f)
+    by_cat = {}
+    for e in ev:
+        assert e["ph"] == "X"
+        by_cat.setdefault(e["cat"], []).append(e)
+
+    assert [e["name"] for e in by_cat["request"]] == ["gmail.users.getProfile"]
+    assert [e["name"] for e in by_cat["phase"]] == ["content"]
+
+    batches = by_cat["remote"]
+    assert len(batches) == 2
+    assert batches[0]["args"]["failed"] == fakegmail.fault.injected
+    assert batches[1]["args"]["failed"] == 0
+
+    subs = by_cat["sub-request"]
+    assert len(subs) == len(gids) + fakegmail.fault.injected
+    assert {e["args"]["status"] for e in subs} == {200, 429}
+    retried = [e for e in subs if e["args"]["retry"] == 1]
+    assert len(retried) == fakegmail.fault.injected
+
+    assert [e["args"]["delay"] for e in by_cat["backoff"]] == [1]
+    assert sum(e["args"]["size"] for e in by_cat["callback"]) == len(gids)
@@ -0,0 +1,213 @@
+import concurrent.futures
+import os
+import socket
+from types import SimpleNamespace
+
+import pytest
+
+# the watcher keeps notmuch loaded
+watch_module = pytest.importorskip("lieer.watch")
+Watch = watch_module.Watch
+
+
+@pytest.fixture
+def watch(account):
+    """
+    A watcher for the pulled account, listening on its socket. The repository is
+    only locked while synchronizing, like with `gmi watch`.
+    """
+    account.pull()
+    account.local.unlock()
+
+    w = Watch(account.gmailieer, 1, 8, 2, 1)
+    w.listen()
+    w.account = account
+    yield w
+    w.close()
+
+
+def request(w, command):
+    """
+    Send command to the watcher and serve it, returns the reply and whether the
+    local changes were pushed.
+    """
+    with concurrent.futures.ThreadPoolExecutor(1) as ex:
+        reply = ex.submit(Watch.trigger, w.socket_f, command)
+        assert w.selector.select(5)
+        pushed = w.serve()
+        return (reply.result(timeout=5), pushed)
+
+
+def test_ping(watch):
+    watch.remote.calls.clear()
+
+    assert request(watch, "ping") == ("ok", False)
+    assert sum(watch.remote.calls.values()) == 0
+
+
+def test_unknown_command(watch):
+    (reply, pushed) = request(watch, "fetch")
+
+    assert reply == "error: unknown command: fetch"
+    assert not pushed
+
+
+def test_trigger_sync(watch):
+    import notmuch2
+
+    mb = watch.account.fake.mailbox
+    gid = next(g for g, m in mb.messages.items() if "STARRED" not in m["labelIds"])
+    mb.modify(gid, add=["STARRED"])
+
+    assert request(watch, "sync") == ("ok", True)
+
+    with notmuch2.Database() as db:
+        assert "flagged" in db.find("%s@lieer.example.com" % gid).tags
+
+    # the lock is only held while synchronizing
+    assert watch.local.lckf is None
+
+
+def test_trigger_push(watch):
+    import notmuch2
+
+    local = watch.local
+    with local.write_db() as db:
+        m = next(iter(db.messages("path:account/** and not tag:flagged")))
+        m.tags.add("flagged")
+        gid = local.messages_to_gids([m])[1][0]
+
+    assert request(watch, "push") == ("ok", True)
+    assert "STARRED" in watch.account.fake.mailbox.messages[gid]["labelIds"]
+
+    # our own changes are not pushed again
+    with notmuch2.Database() as db:
+        assert db.revision().rev == watch.revision
+
+
+def test_trigger_pull(watch):
+    assert request(watch, "pull") == ("ok", False)
+
+
+def test_sync_failure(watch, monkeypatch):
+    def fail(*_):
+        raise RuntimeError("push failed")
+
+    monkeypatch.setattr(watch.gmailieer, "push", fail)
+
+    assert request(watch, "sync") == ("error: synchronization failed", False)
+    assert not watch.sync(push=True, pull=False)
+    assert watch.local.lckf is None
+
+
+def test_listen_stale_socket(watch):
+    socket_f = watch.socket_f
+
+    # already running
+    other = Watch(watch.gmailieer, 1, 8, 2, 1)
+    with concurrent.futures.ThreadPoolExecutor(1) as ex:
+        listening = ex.submit(other.listen)
+        assert watch.selector.select(5)
+        watch.serve()
+        with pytest.raises(OSError, match="already running"):
+            listening.result(timeout=5)
+
+    # left behind by a watcher that did not exit cleanly
+    watch.close()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.bind(socket_f)
+    assert os.path.exists(socket_f)
+
+    watch.listen()
+    assert request(watch, "ping") == ("ok", False)
+
+
+class Stop(Exception):
+    pass
+
+
+class Clock:
+    """
+    Replaces the time module and the selector of the watcher: waiting for a
+    request advances the clock, until `stop`.
+    """
+
+    def __init__(self, stop):
+        self.now = 0.0
+        self.stop = stop
+
+    def monotonic(self):
+        return self.now
+
+    def select(self, timeout):
+        self.now += timeout
+        if self.now > self.stop:
+            raise Stop()
+        return []
+
+
+def run_loop(tmp_path, monkeypatch, stop, revision=lambda now: 0, changed=False):
+    """
+    Run the loop of a watcher with min_interval 1, max_interval 8, debounce 2 and
+    local_interval 1 until `stop` seconds. `revision` gives the notmuch revision
+    at a time, and the remote has `changed` on every check. Returns the
+    synchronizations as (time, push, pull, check).
+    """
+    clock = Clock(stop)
+    monkeypatch.setattr(watch_module, "time", clock)
+
+    g = SimpleNamespace(local=SimpleNamespace(wd=str(tmp_path)), remote=None)
+    w = Watch(g, 1, 8, 2, 1)
+    w.selector = clock
+    w.revision = revision(0)
+    w.get_revision = lambda: revision(clock.now)
+
+    syncs = []
+
+    def sync(push, pull, check=False):
+        syncs.append((clock.now, push, pull, check))
+        return changed if check else True
+
+    w.sync = sync
+
+    with pytest.raises(Stop):
+        w.loop()
+
+    return syncs
+
+
+def test_loop_interval(tmp_path, monkeypatch):
+    syncs = run_loop(tmp_path, monkeypatch, 23.5)
+
+    # the interval is doubled while nothing changes, up to max_interval
+    assert syncs == [
+        (0, True, True, False),
+        (1, False, True, True),
+        (3, False, True, True),
+        (7, False, True, True),
+        (15, False, True, True),
+        (23, False, True, True),
+    ]
+
+
+def test_loop_interval_changed(tmp_path, monkeypatch):
+    syncs = run_loop(tmp_path, monkeypatch, 4.5, changed=True)
+
+    # and reset to min_interval when the remote has changed
+    assert [t for (t, _, _, check) in syncs if check] == [1, 2, 3, 4]
+
+
+def test_loop_debounce(tmp_path, monkeypatch):
+    # tagging once at 1 second
+    syncs = run_loop(tmp_path, monkeypatch, 10, lambda now: 0 if now < 1 else 1)
+
+    # pushed once the revision has been stable for debounce seconds
+    assert [t for (t, push, pull, _) in syncs if push and not pull] == [3]
+
+
+def test_loop_max_debounce(tmp_path, monkeypatch):
+    # tagging every second until 30 seconds
+    syncs = run_loop(tmp_path, monkeypatch, 40, lambda now: int(min(now, 30)))
+
+    # pushed at the latest MAX_DEBOUNCE (10) debounce periods after the first change
+    assert [t for (t, push, pull, _) in syncs if push and not pull] == [21, 32]